@@ -1,26 +1,78 @@
+import copy
 import dataclasses
-from typing import Dict, Set, Optional, List, Union
+from typing import Dict, FrozenSet, Iterable, Set, Optional, List, Tuple, Union
 
+from build import WEAPON_INDEPENDENT_TYPES, WEAPON_SWAP
+from instrumentation import timed
 from skill_state import SkillState
 from weapon_type import WeaponType
 
 
+def get_castable_skills_by_weapon_set(skill_keys: Iterable[str],
+                                      skill_to_weapon_type_dict: Dict[str, WeaponType],
+                                      weapon_set_to_weapon_types_dict: Dict[str, Set[WeaponType]]) \
+        -> Dict[str, FrozenSet[str]]:
+    """
+    Skills each weapon set can cast regardless of cooldowns, for both weapon sets weapon swap switches between even if
+    the build has no weapons in one of them.
+    """
+    skill_keys = list(skill_keys)
+    return {
+        weapon_set: frozenset(
+            skill_key
+            for skill_key
+            in skill_keys
+            if skill_to_weapon_type_dict[skill_key] in WEAPON_INDEPENDENT_TYPES
+            or skill_to_weapon_type_dict[skill_key] in weapon_set_to_weapon_types_dict.get(weapon_set, ())
+        )
+        for weapon_set
+        in ("set_1", "set_2", *weapon_set_to_weapon_types_dict.keys())
+    }
+
+
 @dataclasses.dataclass
 class ActorState(object):
     skill_states: Dict[str, SkillState]
     current_weapon_set: str
     skill_to_weapon_type_dict: Dict[str, WeaponType]
     weapon_set_to_weapon_types_dict: Dict[str, Set[WeaponType]]
+    # Derived from the other fields if not given
+    castable_skills_by_weapon_set: Optional[Dict[str, FrozenSet[str]]] = None
+
+    def __post_init__(self):
+        if self.castable_skills_by_weapon_set is None:
+            self.castable_skills_by_weapon_set = get_castable_skills_by_weapon_set(
+                self.skill_states.keys(), self.skill_to_weapon_type_dict, self.weapon_set_to_weapon_types_dict)
+
+    def clone(self) -> "ActorState":
+        # Only the skill states carry dynamic state, the build-derived dicts are shared
+        return ActorState(
+            {skill_key: copy.copy(skill_state) for skill_key, skill_state in self.skill_states.items()},
+            self.current_weapon_set,
+            self.skill_to_weapon_type_dict,
+            self.weapon_set_to_weapon_types_dict,
+            self.castable_skills_by_weapon_set)
+
+    def get_current_cooldown(self, skill_key: str) -> int:
+        return self.skill_states[skill_key].current_cooldown
+
+    def get_current_ammo(self, skill_key: str) -> int:
+        return self.skill_states[skill_key].current_ammo
+
+    def get_state_key(self, time_quantum: int = 1) -> Tuple:
+        """
+        Canonical key of the dynamic state: weapon set plus cooldown (quantized) and ammo of every skill.
+        """
+        state_key = [self.current_weapon_set]
+        for skill_state in self.skill_states.values():
+            # Rounded up so that a skill on cooldown never shares a key with a skill off cooldown
+            state_key.append(-(-skill_state.current_cooldown // time_quantum))
+            state_key.append(skill_state.current_ammo)
+        return tuple(state_key)
 
     def can_cast(self, skill_key: str) -> bool:
-        skill_required_weapon_type = self.skill_to_weapon_type_dict[skill_key]
-        current_weapon_types = self.weapon_set_to_weapon_types_dict[self.current_weapon_set]
-        return self.skill_states[skill_key].current_ammo > 0 and (
-                skill_required_weapon_type == WeaponType.MAIN_HAND or
-                skill_required_weapon_type == WeaponType.EMPTY_HANDED or
-                skill_required_weapon_type == WeaponType.INVALID or
-                skill_required_weapon_type in current_weapon_types
-        )
+        return skill_key in self.castable_skills_by_weapon_set[self.current_weapon_set] \
+            and self.skill_states[skill_key].current_ammo > 0
 
     def cast(self, skill_key: str):
         skill_state = self.skill_states[skill_key]
@@ -28,7 +80,7 @@ class ActorState(object):
             skill_state.current_cooldown = skill_state.max_cooldown
         skill_state.current_ammo -= 1
 
-        if skill_key == "Weapon Swap":
+        if skill_key == WEAPON_SWAP:
             self.current_weapon_set = "set_2" \
                 if self.current_weapon_set == "set_1" \
                 else "set_1"
@@ -40,15 +92,34 @@ class ActorState(object):
             if skill_state.current_cooldown == 0 and skill_state.current_ammo < skill_state.max_ammo:
                 skill_state.current_ammo += 1
 
-    def simulate(self, next_skill: Optional[str]) -> (int, Optional[str]):
+    def get_time_to_next_event(self) -> Optional[int]:
+        """
+        Time until the next cooldown expiry or ammo recharge, castability can't change before then.
+        :return: None if no skill is recharging
+        """
+        time_to_next_event = None
+        for skill_state in self.skill_states.values():
+            if skill_state.current_cooldown > 0:
+                time_to_event = skill_state.current_cooldown
+            elif skill_state.current_ammo < skill_state.max_ammo:
+                time_to_event = 1
+            else:
+                continue
+            if time_to_next_event is None or time_to_event < time_to_next_event:
+                time_to_next_event = time_to_event
+        return time_to_next_event
+
+    def simulate(self, next_skill: Optional[str], skip_idle: bool = False) -> (int, Optional[str]):
         """
         TODO: Explain how to use the return values
-        :param next_skill:
+        :param next_skill: None to wait
+        :param skip_idle: wait until the next event instead of 1ms
         :return: time_delta, executed_skill
         """
         if next_skill is None:
-            self.tick_cooldown()
-            return 1, None
+            time_delta = (self.get_time_to_next_event() or 1) if skip_idle else 1
+            self.tick_cooldown(time_delta)
+            return time_delta, None
 
         if not self.can_cast(next_skill):
             return 0, None
@@ -60,18 +131,19 @@ class ActorState(object):
         return time_delta, next_skill
 
     def simulate_rotation(self, rotation: Dict[str, List[Dict[str, Union[str, int]]]]):
-        time = 1
-        for skill_cast in rotation["skill_casts"]:
-            next_skill: str = str(skill_cast["skill"])
-            if not next_skill:
-                continue
+        with timed("actor_state.simulate_rotation"):
+            time = 1
+            for skill_cast in rotation["skill_casts"]:
+                next_skill: str = str(skill_cast["skill"])
+                if not next_skill:
+                    continue
 
-            if not self.can_cast(next_skill):
-                time += 1
-                continue
+                if not self.can_cast(next_skill):
+                    time += 1
+                    continue
 
-            self.cast(next_skill)
+                self.cast(next_skill)
 
-            time_delta = max(1, self.skill_states[next_skill].cast_duration)
-            self.tick_cooldown(time_delta)
-            time += time_delta
+                time_delta = max(1, self.skill_states[next_skill].cast_duration)
+                self.tick_cooldown(time_delta)
+                time += time_delta
@@ -0,0 +1,185 @@
+import codecs
+import dataclasses
+import json
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+from instrumentation import timed
+
+# Damage events are sampled into intervals of this many ms for damage profiles
+DAMAGE_PROFILE_INTERVAL_MS = 100
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CONTINUATIONS = frozenset("0123456789.eE+-")
+
+# Parser states
+_EXPECT_OBJECT_START = 0
+_EXPECT_KEY_OR_OBJECT_END = 1
+_EXPECT_KEY = 2
+_EXPECT_COLON = 3
+_EXPECT_VALUE = 4
+_EXPECT_MEMBER_SEPARATOR = 5
+_EXPECT_EVENT_OR_ARRAY_END = 6
+_EXPECT_EVENT = 7
+_EXPECT_EVENT_SEPARATOR = 8
+_DONE = 9
+
+
+class AuditStreamParser(object):
+    """
+    Incremental parser for a gw2combat audit document.
+
+    Each element of the top-level "tick_events" array is decoded on its own and handed to on_tick_event, then dropped,
+    so memory use is bounded by the largest single event instead of the whole audit. Every other top-level member is
+    decoded normally and kept in `members`.
+    """
+
+    def __init__(self, on_tick_event: Callable[[Dict], Any]):
+        self.on_tick_event = on_tick_event
+        self.members: Dict[str, Any] = {}
+        self.num_tick_events = 0
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._text = ""
+        self._position = 0
+        self._state = _EXPECT_OBJECT_START
+        self._key = ""
+
+    @property
+    def done(self) -> bool:
+        return self._state == _DONE
+
+    def feed(self, chunk: bytes) -> bool:
+        with timed("json.audit_stream"):
+            self._text += self._text_decoder.decode(chunk)
+            self._parse(final=False)
+            self._text = self._text[self._position:]
+            self._position = 0
+        return self.done
+
+    def close(self):
+        self._text += self._text_decoder.decode(b"", final=True)
+        self._parse(final=True)
+        if not self.done:
+            raise ValueError("Incomplete audit")
+
+    def _skip_whitespace(self) -> bool:
+        self._position = _WHITESPACE.match(self._text, self._position).end()
+        return self._position < len(self._text)
+
+    def _expect(self, *tokens: str) -> str:
+        token = self._text[self._position]
+        if token not in tokens:
+            raise ValueError(f"Unexpected {token!r} at audit offset {self._position}, expected one of {tokens}")
+        self._position += 1
+        return token
+
+    def _decode_value(self, final: bool) -> Tuple[bool, Any]:
+        try:
+            value, end = self._decoder.raw_decode(self._text, self._position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        # A value at the very end of the buffer, or a number followed by part of an exponent or fraction, may still
+        # continue in the next chunk
+        if not final and (end == len(self._text) or (
+                isinstance(value, (int, float)) and self._text[end] in _NUMBER_CONTINUATIONS)):
+            return False, None
+        self._position = end
+        return True, value
+
+    def _parse(self, final: bool):
+        while self._state != _DONE and self._skip_whitespace():
+            if self._state == _EXPECT_OBJECT_START:
+                self._expect("{")
+                self._state = _EXPECT_KEY_OR_OBJECT_END
+            elif self._state in (_EXPECT_KEY_OR_OBJECT_END, _EXPECT_KEY):
+                if self._state == _EXPECT_KEY_OR_OBJECT_END and self._text[self._position] == "}":
+                    self._position += 1
+                    self._state = _DONE
+                    continue
+                decoded, self._key = self._decode_value(final)
+                if not decoded:
+                    return
+                self._state = _EXPECT_COLON
+            elif self._state == _EXPECT_COLON:
+                self._expect(":")
+                self._state = _EXPECT_VALUE
+            elif self._state == _EXPECT_VALUE:
+                if self._key == "tick_events" and self._text[self._position] == "[":
+                    self._position += 1
+                    self._state = _EXPECT_EVENT_OR_ARRAY_END
+                    continue
+                decoded, value = self._decode_value(final)
+                if not decoded:
+                    return
+                self.members[self._key] = value
+                self._state = _EXPECT_MEMBER_SEPARATOR
+            elif self._state == _EXPECT_MEMBER_SEPARATOR:
+                self._state = _EXPECT_KEY if self._expect(",", "}") == "," else _DONE
+            elif self._state in (_EXPECT_EVENT_OR_ARRAY_END, _EXPECT_EVENT):
+                if self._state == _EXPECT_EVENT_OR_ARRAY_END and self._text[self._position] == "]":
+                    self._position += 1
+                    self._state = _EXPECT_MEMBER_SEPARATOR
+                    continue
+                decoded, tick_event = self._decode_value(final)
+                if not decoded:
+                    return
+                self.num_tick_events += 1
+                self.on_tick_event(tick_event)
+                self._state = _EXPECT_EVENT_SEPARATOR
+            elif self._state == _EXPECT_EVENT_SEPARATOR:
+                self._state = _EXPECT_EVENT if self._expect(",", "]") == "," else _EXPECT_MEMBER_SEPARATOR
+
+
+@dataclasses.dataclass
+class DamageSummary(object):
+    """
+    Damage aggregated from audit damage events. Per-source entries are keyed by (actor, source_actor, source_skill)
+    where actor is the actor taking the damage. Damage taken is also summed per actor and DAMAGE_PROFILE_INTERVAL_MS
+    interval, each interval keyed by its end so that damage is never credited early.
+    """
+    damage_by_actor: Dict[str, int] = dataclasses.field(default_factory=dict)
+    damage_by_source: Dict[Tuple[str, str, str], int] = dataclasses.field(default_factory=dict)
+    last_damage_time_ms_by_source: Dict[Tuple[str, str, str], int] = dataclasses.field(default_factory=dict)
+    damage_by_actor_and_interval: Dict[str, Dict[int, int]] = dataclasses.field(default_factory=dict)
+
+    def add_tick_event(self, tick_event: Dict):
+        event = tick_event["event"]
+        if event["event_type"] != "damage_event":
+            return
+        actor = tick_event["actor"]
+        source = (actor, event.get("source_actor", ""), event.get("source_skill", ""))
+        self.damage_by_actor[actor] = self.damage_by_actor.get(actor, 0) + event["damage"]
+        self.damage_by_source[source] = self.damage_by_source.get(source, 0) + event["damage"]
+        self.last_damage_time_ms_by_source[source] = int(tick_event["time_ms"])
+        interval_end = -(-int(tick_event["time_ms"]) // DAMAGE_PROFILE_INTERVAL_MS) * DAMAGE_PROFILE_INTERVAL_MS
+        damage_by_interval = self.damage_by_actor_and_interval.setdefault(actor, {})
+        damage_by_interval[interval_end] = damage_by_interval.get(interval_end, 0) + event["damage"]
+
+    def get_damage_profile(self, *actors: str) -> Tuple[List[int], List[int]]:
+        """
+        :return: offsets, cumulative damage taken by the actors within each offset, only at offsets where it changes
+        """
+        damage_by_interval: Dict[int, int] = {}
+        for actor in actors:
+            for interval_end, damage in self.damage_by_actor_and_interval.get(actor, {}).items():
+                damage_by_interval[interval_end] = damage_by_interval.get(interval_end, 0) + damage
+        offsets = []
+        damage_profile = []
+        cumulative_damage = 0
+        for interval_end, damage in sorted(damage_by_interval.items()):
+            if damage == 0:
+                continue
+            cumulative_damage += damage
+            offsets.append(interval_end)
+            damage_profile.append(cumulative_damage)
+        return offsets, damage_profile
+
+
+def summarize_audit(audit: Dict) -> DamageSummary:
+    damage_summary = DamageSummary()
+    for tick_event in audit.get("tick_events", []):
+        damage_summary.add_tick_event(tick_event)
+    return damage_summary
@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import copy
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, TextIO
+
+import main as optimizer
+from actor_state import ActorState
+from client import ShardedSimulationClient, parse_endpoint
+from encounter_template import EncounterTemplate, get_actor_encounter
+from rotation_trie import RotationTrie
+from search_stats import SearchStats
+from transposition import TranspositionTable
+from verification import TopRotations, prepend_rotation_prefix, verify_rotations
+
+EXIT_SUCCESS = 0
+EXIT_JOB_FAILED = 1
+EXIT_INVALID_ARGUMENTS = 2
+
+
+class JobContext(object):
+    """
+    Encounters and probed actor states shared by the jobs of a batch. Jobs that share a build wait for the first one to
+    probe its skills instead of probing them again. Failed probes are not kept, the jobs fail and the next one with the
+    build probes again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._encounters: Dict[str, Dict] = {}
+        self._actor_states: Dict[str, ActorState] = {}
+        self._probe_locks: Dict[str, threading.Lock] = {}
+
+    def get_encounter(self, path: str) -> Dict:
+        with self._lock:
+            encounter = self._encounters.get(path)
+        if encounter is None:
+            encounter = optimizer.load_encounter(path)
+            if encounter is None:
+                raise ValueError(f"Encounter {path} has an actor without a build")
+            with self._lock:
+                encounter = self._encounters.setdefault(path, encounter)
+        # Jobs modify the rotation of their copy
+        return copy.deepcopy(encounter)
+
+    def get_actor_state(self, encounter: Dict) -> ActorState:
+        # Skill probes only see the first actor, without its rotation, and its enemies, the same key as the prompt loop
+        key = EncounterTemplate(get_actor_encounter(encounter)).get_hash(
+            rotation={"skill_casts": []}, server_version=optimizer.SERVER_VERSION)
+        with self._lock:
+            probe_lock = self._probe_locks.setdefault(key, threading.Lock())
+        with probe_lock:
+            actor_state = self._actor_states.get(key)
+            if actor_state is None:
+                # Raises ProbeError before anything is stored
+                actor_state = optimizer.get_actor_state_from_encounter(encounter)
+                self._actor_states[key] = actor_state
+        return actor_state.clone()
+
+
+def get_positive_int(job: Dict, key: str, default=None):
+    value = job.get(key, default)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise ValueError(f"\"{key}\" must be a positive integer")
+    return value
+
+
+def get_search_arguments(job: Dict, algorithm: str) -> List[int]:
+    if algorithm == "beam":
+        return [get_positive_int(job, "width", 8)]
+    elif algorithm == "bnb":
+        return [get_positive_int(job, "node_limit", optimizer.BNB_NODE_LIMIT)]
+    elif algorithm == "genetic":
+        return [get_positive_int(job, "generations", 100), get_positive_int(job, "population", 64)]
+    return []
+
+
+def run_job(job: Dict, context: JobContext) -> Dict:
+    """
+    Runs a single job:
+    {"id": ..., "encounter": <path>, "rotation": ["<skill>", ...], "search": <greedy/beam/bnb/genetic>, "time": <ms>,
+     "depth": <casts>, "width": <beam width>, "node_limit": <bnb node limit>, "generations": <genetic generations>,
+     "population": <genetic population>, "checkpoint": <genetic checkpoint directory>, "verify": <rotations to verify>}
+    Every key is optional, the defaults match the prompt loop.
+    """
+    algorithm = job.get("search", "greedy")
+    if algorithm not in optimizer.SEARCH_ALGORITHMS:
+        raise ValueError(f"Unknown search algorithm: {algorithm}")
+    search_arguments = get_search_arguments(job, algorithm)
+    search_time = get_positive_int(job, "time", 30000)
+    search_depth = get_positive_int(job, "depth")
+    search_time_quantum = get_positive_int(job, "quantum", 1)
+    num_verified = get_positive_int(job, "verify")
+
+    encounter = context.get_encounter(job.get("encounter", optimizer.DEFAULT_ENCOUNTER))
+    if "rotation" in job:
+        encounter["actors"][0]["rotation"] = {
+            "skill_casts": [{"skill": skill, "cast_time_ms": 0} for skill in job["rotation"] if skill]
+        }
+    # Replayed through a rotation trie, which also gives the cast times and static damage of the replayed rotation
+    rotation_prefix = RotationTrie(context.get_actor_state(encounter)).evaluate([
+        str(skill_cast["skill"])
+        for skill_cast
+        in encounter["actors"][0]["rotation"]["skill_casts"]
+        if str(skill_cast["skill"])
+    ])
+    actor_state = rotation_prefix.actor_state
+
+    search_stats = SearchStats()
+    top_rotations = TopRotations(optimizer.TOP_ROTATIONS_SIZE)
+    total_damage, best_skill_sequence = optimizer.run_search(
+        actor_state, algorithm, search_arguments, search_time, search_depth, search_stats,
+        TranspositionTable(optimizer.TRANSPOSITION_TABLE_SIZE, search_time_quantum), top_rotations,
+        job.get("checkpoint"))
+    result = {
+        "status": "ok",
+        "search": algorithm,
+        "total_damage": total_damage,
+        "rotation": best_skill_sequence,
+        "completed": search_stats.completed,
+        "nodes_expanded": search_stats.nodes_expanded,
+        "evaluations": search_stats.evaluations,
+        "elapsed": search_stats.elapsed,
+    }
+    if num_verified is not None:
+        verified_rotations = verify_rotations(
+            encounter,
+            prepend_rotation_prefix(rotation_prefix, top_rotations.get_rotations()[:num_verified]),
+            optimizer.SIMULATION_CLIENT,
+            optimizer.VERIFIED_ROTATION_CACHE,
+            search_time,
+            optimizer.PROBE_AUDITS,
+            optimizer.SERVER_VERSION)
+        result["verified"] = [
+            {
+                "audited_damage": verified_rotation.audited_damage,
+                "static_damage": verified_rotation.static_damage,
+                "rotation": verified_rotation.rotation,
+            }
+            for verified_rotation
+            in verified_rotations
+        ]
+    return result
+
+
+def run_batch(jobs_file: TextIO, output: TextIO, workers: int) -> int:
+    """
+    Runs every job of a JSON-lines file on up to `workers` threads and writes one JSON line per job as soon as it
+    finishes, so results are not in input order. Results carry the job id, or the line number if the job has none.
+    :return: exit code, EXIT_JOB_FAILED if any job failed
+    """
+    context = JobContext()
+
+    def run(line_number: int, line: str) -> Dict:
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("a job must be a JSON object")
+        except ValueError as e:
+            return {"id": line_number, "line": line_number, "status": "error", "error": f"Invalid job: {e}"}
+        try:
+            result = run_job(job, context)
+        except Exception as e:
+            result = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        return {"id": job.get("id", line_number), "line": line_number, **result}
+
+    lines = [(line_number, line) for line_number, line in enumerate(jobs_file, start=1) if line.strip()]
+    num_failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(lines) or 1))) as executor:
+        futures = [executor.submit(run, line_number, line) for line_number, line in lines]
+        for future in as_completed(futures):
+            result = future.result()
+            if result["status"] != "ok":
+                num_failed += 1
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    print(f"Info: {len(lines) - num_failed}/{len(lines)} jobs succeeded")
+    return EXIT_JOB_FAILED if num_failed > 0 else EXIT_SUCCESS
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Runs a JSON-lines file of optimization jobs and writes a JSON line per job as it finishes.")
+    parser.add_argument("jobs", help="JSON-lines file with one job per line, - to read from stdin")
+    parser.add_argument("-o", "--output", help="file to write the results to, stdout by default")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of jobs run concurrently")
+    parser.add_argument("-s", "--servers", help="comma separated host:port list of gw2combat servers")
+    args = parser.parse_args()
+    if args.workers <= 0:
+        parser.error("the number of workers must be positive")
+
+    try:
+        jobs_file = sys.stdin if args.jobs == "-" else open(args.jobs, "r")
+        output = open(args.output, "w") if args.output else sys.stdout
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_INVALID_ARGUMENTS
+
+    if args.servers:
+        try:
+            endpoints = [parse_endpoint(endpoint) for endpoint in args.servers.split(",") if endpoint]
+        except ValueError:
+            parser.error(f"invalid server list: {args.servers}")
+        optimizer.SIMULATION_CLIENT.close()
+        optimizer.SIMULATION_CLIENT = ShardedSimulationClient(endpoints)
+
+    try:
+        # Messages of the optimizer go to stderr so that the results are the only output
+        with contextlib.redirect_stdout(sys.stderr):
+            return run_batch(jobs_file, output, args.workers)
+    finally:
+        optimizer.SKILL_SIMULATION_CACHE.save()
+        optimizer.VERIFIED_ROTATION_CACHE.save()
+        optimizer.SIMULATION_CLIENT.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import dataclasses
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from compact_actor_state import AnyActorState, get_candidates_by_weapon_set
+from greedy import search_greedy
+from search_stats import SearchStats
+from transposition import TranspositionTable
+from verification import TopRotations
+
+
+@dataclasses.dataclass
+class BeamNode:
+    total_damage: int
+    time: int
+    actor_state: AnyActorState
+    rotation: List[Dict]
+
+    @property
+    def damage_per_time(self) -> float:
+        return self.total_damage / self.time
+
+
+def search_beam(actor_state: AnyActorState,
+                max_time: Optional[int],
+                depth: Optional[int] = None,
+                width: int = 8,
+                stats: Optional[SearchStats] = None,
+                transposition_table: Optional[TranspositionTable] = None,
+                top_rotations: Optional[TopRotations] = None) \
+        -> (int, Dict[str, List[Tuple[str, int]]]):
+    """
+    Expands every castable skill of every node in the beam and keeps the `width` nodes with the highest damage per
+    elapsed time for the next step. Unlike greedy search this can delay a skill in favour of a better follow-up.
+    The greedy rotation seeds the best rotation, so the result is never worse than greedy search. Nodes that reach a
+    state already in the transposition table with no more damage are dropped. Every rotation expanded, including the
+    greedy seed, is offered to top_rotations. If the search is cancelled through stats the best rotation found so far
+    is returned and stats.completed is False.
+    """
+    if stats is None:
+        stats = SearchStats()
+
+    skills = sorted(
+        actor_state.skill_states.values(),
+        key=lambda skill: skill.score_per_cast_time,
+        reverse=True)
+    candidates_by_weapon_set = get_candidates_by_weapon_set(actor_state, skills)
+
+    greedy_damage, greedy_rotation = search_greedy(actor_state.clone(), max_time, depth)
+    best_node = BeamNode(greedy_damage, 1, actor_state, greedy_rotation["skill_casts"])
+    if top_rotations is not None:
+        top_rotations.offer(best_node.total_damage, best_node.rotation)
+    stats.offer(best_node.total_damage, best_node.rotation)
+    beam = [BeamNode(0, 1, actor_state, [])]
+    while beam:
+        if stats.cancelled:
+            stats.completed = False
+            break
+        candidates: List[BeamNode] = []
+        for node in beam:
+            if node.time > max_time or (depth is not None and len(node.rotation) >= depth):
+                continue
+
+            castable_skills = [
+                skill
+                for skill
+                in candidates_by_weapon_set[node.actor_state.current_weapon_set]
+                if node.actor_state.can_cast(skill.skill_key)
+            ]
+            if not castable_skills:
+                # Nothing to cast, skip to the next cooldown event
+                if node.actor_state.get_time_to_next_event() is None:
+                    continue
+                next_actor_state = node.actor_state.clone()
+                time_delta, _ = next_actor_state.simulate(None, skip_idle=True)
+                stats.idle_steps += 1
+                if transposition_table is not None and transposition_table.is_transposition(
+                        next_actor_state, node.time + time_delta, node.total_damage, len(node.rotation)):
+                    continue
+                candidates.append(BeamNode(node.total_damage, node.time + time_delta, next_actor_state, node.rotation))
+                continue
+
+            for skill in castable_skills:
+                next_actor_state = node.actor_state.clone()
+                time_delta, _ = next_actor_state.simulate(skill.skill_key)
+                stats.nodes_expanded += 1
+                next_node = BeamNode(
+                    node.total_damage + skill.skill_simulation_data.get_damage_until(max_time - node.time),
+                    node.time + time_delta,
+                    next_actor_state,
+                    node.rotation + [{"skill": skill.skill_key, "cast_time_ms": node.time}])
+                if transposition_table is not None and transposition_table.is_transposition(
+                        next_actor_state, next_node.time, next_node.total_damage, len(next_node.rotation)):
+                    continue
+                candidates.append(next_node)
+                if top_rotations is not None:
+                    top_rotations.offer(next_node.total_damage, next_node.rotation)
+                if next_node.total_damage > best_node.total_damage:
+                    best_node = next_node
+                    stats.offer(best_node.total_damage, best_node.rotation)
+
+        beam = heapq.nlargest(width, candidates, key=lambda candidate: candidate.damage_per_time)
+
+    stats.finish()
+    return best_node.total_damage, {"skill_casts": best_node.rotation}
@@ -0,0 +1,366 @@
+import argparse
+import copy
+import dataclasses
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from actor_state import ActorState
+from build import WEAPON_SWAP, get_castable_skills, get_skill_to_weapon_type_dict, get_weapon_set_to_weapon_types_dict
+from client import ShardedSimulationClient, SimulationClient
+from compact_actor_state import AnyActorState, CompactActorState
+from greedy import search_greedy
+from mock_server import MockSimulationServer
+from search_stats import SearchStats
+from simulation_cache import SimulationCache
+from skill_state import SkillState, SkillSimulationData
+from weapon_type import WeaponType
+
+# Bumped when benchmarks change what they measure, baselines of another version are not comparable
+BASELINE_FORMAT_VERSION = 2
+SYNTHETIC_SIZES = (8, 16, 32, 64)
+# A run returns the number of operations it performed, or the latency of each of them if it measures them itself
+BenchmarkRun = Callable[[], Union[int, List[float]]]
+
+
+def load_synthetic_actor_state(build_path: str = "resources/build-lb-slb.json",
+                               skill_filter: Optional[Callable[[Dict], bool]] = None,
+                               num_skills: Optional[int] = None) -> ActorState:
+    """
+    Builds an actor state from the castable skills of a build without a gw2combat server, each skill gets a fixed
+    damage derived from its key. With num_skills the castable skills are repeated under numbered keys, e.g.
+    "Barrage #2", until there are exactly num_skills. Weapon swap isn't repeated, copies of it would be idle skills.
+    """
+    build = json.load(open(build_path, "r"))
+    skills = [skill for skill in get_castable_skills(build) if skill_filter is None or skill_filter(skill)]
+    if num_skills is not None:
+        repeated_skills = [skill for skill in skills if skill["skill_key"] != WEAPON_SWAP]
+        skills = skills[:num_skills]
+        for index in range(len(skills), num_skills):
+            skill = repeated_skills[index % len(repeated_skills)]
+            skills.append({**skill, "skill_key": f"{skill['skill_key']} #{index // len(repeated_skills) + 1}"})
+    build["skills"] = skills
+
+    weapon_set_to_weapon_types_dict = get_weapon_set_to_weapon_types_dict(build)
+    skill_to_weapon_type_dict = get_skill_to_weapon_type_dict(build)
+
+    skill_states = {}
+    for skill in skills:
+        damage = 1000 + zlib.crc32(skill["skill_key"].encode("utf-8")) % 9000
+        skill_states[skill["skill_key"]] = SkillState(
+            skill["skill_key"],
+            WeaponType(skill.get("weapon_type", "invalid")),
+            SkillSimulationData(damage, 0),
+            damage,
+            (skill.get("cooldown") or (0, 0))[1],
+            skill["cast_duration"][1],
+            skill.get("ammo", 1)
+        )
+
+    return ActorState(
+        skill_states,
+        build.get("initial_weapon_set", "set_1"),
+        skill_to_weapon_type_dict,
+        weapon_set_to_weapon_types_dict)
+
+
+def benchmark_time_skipping(max_time: int = 30000):
+    # Only skills with a cooldown, so the actor spends most of the search window waiting
+    actor_state = load_synthetic_actor_state(skill_filter=lambda skill: (skill.get("cooldown") or (0, 0))[1] > 0)
+
+    results = {}
+    for skip_idle in (False, True):
+        stats = SearchStats()
+        results[skip_idle] = search_greedy(
+            CompactActorState.from_actor_state(actor_state), max_time, None, stats, skip_idle)
+        print(f"Info: greedy search, skip idle: {skip_idle}, "
+              f"iterations: {stats.nodes_expanded + stats.idle_steps} "
+              f"(casts: {stats.nodes_expanded}, idle steps: {stats.idle_steps}), "
+              f"elapsed: {stats.elapsed * 1000:.2f}ms")
+    if results[False] != results[True]:
+        raise Exception("Time skipping changed the greedy rotation")
+    print("Info: identical rotations with and without time skipping")
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    name: str
+    operations: int
+    elapsed: float
+    latencies: List[float]
+    peak_memory: int
+
+    @property
+    def throughput(self) -> float:
+        return self.operations / self.elapsed if self.elapsed > 0.0 else 0.0
+
+    def get_percentile(self, percentile: float) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def to_dict(self) -> Dict:
+        return {
+            "throughput": self.throughput,
+            "p50_ms": self.get_percentile(50) * 1000,
+            "p95_ms": self.get_percentile(95) * 1000,
+            "p99_ms": self.get_percentile(99) * 1000,
+            "peak_memory_kb": self.peak_memory / 1024,
+        }
+
+
+def run_benchmark(name: str, setup: Callable[[], BenchmarkRun], samples: int) -> BenchmarkResult:
+    """
+    Times `samples` runs of the benchmark after a warm-up run. Runs that only count their operations contribute the
+    mean latency of their operations to the percentiles. Peak memory is traced in a separate run, without the setup,
+    so that tracing doesn't slow down the timed runs.
+    """
+    run = setup()
+    run()
+    operations = 0
+    elapsed = 0.0
+    latencies: List[float] = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        result = run()
+        duration = time.perf_counter() - start
+        elapsed += duration
+        if isinstance(result, list):
+            operations += len(result)
+            latencies.extend(result)
+        else:
+            operations += result
+            latencies.append(duration / max(1, result))
+
+    tracemalloc.start()
+    try:
+        run = setup()
+        tracemalloc.reset_peak()
+        baseline_memory, _ = tracemalloc.get_traced_memory()
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(name, operations, elapsed, latencies, peak_memory - baseline_memory)
+
+
+def simulate_steps(actor_state: AnyActorState, skill_keys: List[str], steps: int):
+    for step in range(steps):
+        time_delta, _ = actor_state.simulate(skill_keys[step % len(skill_keys)])
+        if time_delta == 0:
+            actor_state.simulate(None)
+
+
+def get_simulate_benchmark(num_skills: int, compact: bool, steps: int = 1000) -> Callable[[], BenchmarkRun]:
+    def setup() -> BenchmarkRun:
+        actor_state = load_synthetic_actor_state(num_skills=num_skills)
+        actor_state = CompactActorState.from_actor_state(actor_state) if compact else actor_state
+        skill_keys = list(actor_state.skill_states.keys())
+
+        def run() -> int:
+            simulate_steps(actor_state, skill_keys, steps)
+            return steps
+
+        return run
+
+    return setup
+
+
+def get_tick_cooldown_benchmark(num_skills: int, compact: bool, ticks: int = 1000) -> Callable[[], BenchmarkRun]:
+    def setup() -> BenchmarkRun:
+        actor_state = load_synthetic_actor_state(num_skills=num_skills)
+        actor_state = CompactActorState.from_actor_state(actor_state) if compact else actor_state
+        skill_keys = list(actor_state.skill_states.keys())
+
+        def run() -> int:
+            # Put every castable skill on cooldown so that the ticks have work to do
+            for skill_key in skill_keys:
+                if actor_state.can_cast(skill_key):
+                    actor_state.cast(skill_key)
+            for _ in range(ticks):
+                actor_state.tick_cooldown()
+            return ticks
+
+        return run
+
+    return setup
+
+
+def get_copy_benchmark(num_skills: int, method: str, copies: int = 100) -> Callable[[], BenchmarkRun]:
+    def setup() -> BenchmarkRun:
+        actor_state = load_synthetic_actor_state(num_skills=num_skills)
+        if method == "compact":
+            actor_state = CompactActorState.from_actor_state(actor_state)
+        simulate_steps(actor_state, list(actor_state.skill_states.keys()), num_skills)
+
+        def run() -> int:
+            for _ in range(copies):
+                if method == "deepcopy":
+                    copy.deepcopy(actor_state)
+                else:
+                    actor_state.clone()
+            return copies
+
+        return run
+
+    return setup
+
+
+def get_greedy_benchmark(num_skills: int, max_time: int = 30000) -> Callable[[], BenchmarkRun]:
+    def setup() -> BenchmarkRun:
+        actor_state = CompactActorState.from_actor_state(load_synthetic_actor_state(num_skills=num_skills))
+
+        def run() -> int:
+            search_greedy(actor_state.clone(), max_time)
+            return 1
+
+        return run
+
+    return setup
+
+
+def get_load_encounter_benchmark(loads: int = 10) -> Callable[[], BenchmarkRun]:
+    import main as optimizer
+
+    def setup() -> BenchmarkRun:
+        def run() -> int:
+            for _ in range(loads):
+                optimizer.load_encounter(optimizer.DEFAULT_ENCOUNTER)
+            return loads
+
+        return run
+
+    return setup
+
+
+def get_client_batch_benchmark(address: Tuple[str, int], batch_size: int = 32) -> Callable[[], BenchmarkRun]:
+    import main as optimizer
+
+    def setup() -> BenchmarkRun:
+        client = SimulationClient(*address)
+        encounter = optimizer.load_encounter(optimizer.DEFAULT_ENCOUNTER)
+        skill_keys = [skill["skill_key"] for skill in get_castable_skills(encounter["actors"][0]["build"])]
+        encounters = []
+        for index in range(batch_size):
+            next_encounter = copy.deepcopy(encounter)
+            skill_key = skill_keys[index % len(skill_keys)]
+            next_encounter["actors"][0]["rotation"] = {"skill_casts": [{"skill": skill_key, "cast_time_ms": 0}]}
+            encounters.append(next_encounter)
+
+        def run() -> List[float]:
+            return [result.latency for result in client.simulate_batch(encounters)]
+
+        return run
+
+    return setup
+
+
+def get_probe_benchmark(address: Tuple[str, int]) -> Callable[[], BenchmarkRun]:
+    import main as optimizer
+
+    def setup() -> BenchmarkRun:
+        encounter = optimizer.load_encounter(optimizer.DEFAULT_ENCOUNTER)
+        optimizer.SIMULATION_CLIENT = ShardedSimulationClient([address])
+
+        def run() -> int:
+            # Probe every skill on the server, an empty in-memory cache keeps the results from being reused
+            optimizer.SKILL_SIMULATION_CACHE = SimulationCache()
+            optimizer.get_actor_state_from_encounter(encounter)
+            return 1
+
+        return run
+
+    return setup
+
+
+def get_benchmarks(address: Tuple[str, int]) -> Dict[str, Callable[[], BenchmarkRun]]:
+    benchmarks = {}
+    for num_skills in SYNTHETIC_SIZES:
+        benchmarks[f"simulate/actor_state/{num_skills}"] = get_simulate_benchmark(num_skills, compact=False)
+        benchmarks[f"simulate/compact/{num_skills}"] = get_simulate_benchmark(num_skills, compact=True)
+        benchmarks[f"tick_cooldown/actor_state/{num_skills}"] = get_tick_cooldown_benchmark(num_skills, compact=False)
+        benchmarks[f"tick_cooldown/compact/{num_skills}"] = get_tick_cooldown_benchmark(num_skills, compact=True)
+        benchmarks[f"copy/deepcopy/{num_skills}"] = get_copy_benchmark(num_skills, "deepcopy")
+        benchmarks[f"copy/clone/{num_skills}"] = get_copy_benchmark(num_skills, "clone")
+        benchmarks[f"copy/compact/{num_skills}"] = get_copy_benchmark(num_skills, "compact")
+        benchmarks[f"greedy/compact/{num_skills}"] = get_greedy_benchmark(num_skills)
+    benchmarks["load_encounter"] = get_load_encounter_benchmark()
+    benchmarks["client/simulate_batch"] = get_client_batch_benchmark(address)
+    benchmarks["probe/get_actor_state"] = get_probe_benchmark(address)
+    return benchmarks
+
+
+def find_regressions(results: List[BenchmarkResult], baseline: Dict, threshold: float) -> List[str]:
+    """
+    Compares throughput and peak memory against a baseline, a change worse than threshold (relative) is a regression.
+    """
+    regressions = []
+    for result in results:
+        baseline_result = baseline["results"].get(result.name)
+        if baseline_result is None:
+            continue
+        if result.throughput < baseline_result["throughput"] * (1.0 - threshold):
+            regressions.append(f"{result.name}: throughput {result.throughput:.1f}/s, "
+                               f"baseline {baseline_result['throughput']:.1f}/s")
+        # Allocations below a few KB are noise
+        peak_memory_kb = result.peak_memory / 1024
+        if peak_memory_kb > max(4.0, baseline_result["peak_memory_kb"] * (1.0 + threshold)):
+            regressions.append(f"{result.name}: peak memory {peak_memory_kb:.1f}KB, "
+                               f"baseline {baseline_result['peak_memory_kb']:.1f}KB")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the actor state, search and simulation client hot paths.")
+    parser.add_argument("benchmarks", nargs="*", help="only run benchmarks whose name starts with one of these")
+    parser.add_argument("--samples", type=int, default=20, help="timed runs per benchmark")
+    parser.add_argument("--latency", type=float, default=5.0, help="latency of the mock server in ms")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results to a baseline file")
+    parser.add_argument("--baseline", metavar="PATH", help="compare the results to a baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change flagged as a regression")
+    parser.add_argument("--time-skipping", action="store_true", help="also check idle time skipping")
+    args = parser.parse_args()
+
+    if args.time_skipping:
+        benchmark_time_skipping()
+
+    results: List[BenchmarkResult] = []
+    with MockSimulationServer(latency=args.latency / 1000) as server:
+        for name, setup in get_benchmarks(server.address).items():
+            if args.benchmarks and not any(name.startswith(prefix) for prefix in args.benchmarks):
+                continue
+            result = run_benchmark(name, setup, args.samples)
+            results.append(result)
+            data = result.to_dict()
+            print(f"Info: {name}: {data['throughput']:.1f} ops/s, p50 {data['p50_ms']:.4f}ms, "
+                  f"p95 {data['p95_ms']:.4f}ms, p99 {data['p99_ms']:.4f}ms, peak memory {data['peak_memory_kb']:.1f}KB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({
+                "version": BASELINE_FORMAT_VERSION,
+                "python": platform.python_version(),
+                "results": {result.name: result.to_dict() for result in results},
+            }, baseline_file, indent=2)
+        print(f"Info: baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("version") != BASELINE_FORMAT_VERSION:
+            print(f"Error: incompatible baseline version {baseline.get('version')}")
+            return 2
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Warning: regression in {regression}")
+        if regressions:
+            return 1
+        print(f"Info: no regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
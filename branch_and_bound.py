@@ -0,0 +1,155 @@
+from typing import Dict, List, Optional, Tuple
+
+from compact_actor_state import AnyActorState, get_candidates_by_weapon_set
+from greedy import search_greedy
+from search_stats import SearchStats
+from skill_state import SkillState
+from transposition import TranspositionTable
+from verification import TopRotations
+
+
+def get_max_casts(actor_state: AnyActorState, skill_state: SkillState, window: int) -> float:
+    """
+    Upper bound on the number of casts of a skill starting within the next `window` ms. Skills with several charges
+    only start their cooldown when cast at full ammo and regain a charge every tick once it expired, so their casts are
+    not capped.
+    """
+    if skill_state.max_cooldown <= 0 or skill_state.max_ammo > 1:
+        return float("inf")
+    current_cooldown = actor_state.get_current_cooldown(skill_state.skill_key)
+    if current_cooldown > 0:
+        available_casts = actor_state.get_current_ammo(skill_state.skill_key)
+        recharges = 1 + (window - current_cooldown) // skill_state.max_cooldown \
+            if current_cooldown <= window \
+            else 0
+    else:
+        available_casts = skill_state.max_ammo
+        recharges = window // skill_state.max_cooldown
+    return available_casts + recharges * skill_state.max_ammo
+
+
+def get_damage_upper_bound(actor_state: AnyActorState, window: int, remaining_casts: Optional[int]) -> float:
+    """
+    Fractional knapsack over the cooldown-limited casts of every skill, once by cast time and once by number of casts.
+    Both relax the real problem so the smaller of the two never underestimates the reachable damage. Full damage is
+    assumed for every cast, which also bounds the damage left after the fight end truncates it.
+    """
+    skills = [
+        skill_state
+        for skill_state
+        in actor_state.skill_states.values()
+        if skill_state.skill_simulation_data.total_damage > 0
+    ]
+    if not skills:
+        return 0
+
+    # The last cast may start at the very end of the window and still complete
+    time_capacity = window + max(max(1, skill_state.cast_duration) for skill_state in skills)
+    time_bound = 0.0
+    for skill_state in sorted(
+            skills,
+            key=lambda skill: skill.skill_simulation_data.total_damage / max(1, skill.cast_duration),
+            reverse=True):
+        cast_duration = max(1, skill_state.cast_duration)
+        num_casts = min(get_max_casts(actor_state, skill_state, window), time_capacity / cast_duration)
+        time_bound += num_casts * skill_state.skill_simulation_data.total_damage
+        time_capacity -= num_casts * cast_duration
+        if time_capacity <= 0:
+            break
+
+    if remaining_casts is None:
+        return time_bound
+
+    cast_bound = 0.0
+    for skill_state in sorted(skills, key=lambda skill: skill.skill_simulation_data.total_damage, reverse=True):
+        num_casts = min(get_max_casts(actor_state, skill_state, window), remaining_casts)
+        cast_bound += num_casts * skill_state.skill_simulation_data.total_damage
+        remaining_casts -= num_casts
+        if remaining_casts <= 0:
+            break
+    return min(time_bound, cast_bound)
+
+
+def search_branch_and_bound(actor_state: AnyActorState,
+                            max_time: Optional[int],
+                            depth: Optional[int] = None,
+                            node_limit: Optional[int] = 100000,
+                            stats: Optional[SearchStats] = None,
+                            transposition_table: Optional[TranspositionTable] = None,
+                            top_rotations: Optional[TopRotations] = None) \
+        -> (int, Dict[str, List[Tuple[str, int]]]):
+    """
+    Depth-first search seeded with the greedy rotation, pruning every node whose damage upper bound can't beat the best
+    rotation found so far or that reaches a state already in the transposition table with no more damage. If node_limit
+    is hit or the search is cancelled through stats the best rotation found so far is returned and stats.completed is
+    False. Every rotation visited, including the greedy seed, is offered to top_rotations.
+    """
+    if stats is None:
+        stats = SearchStats()
+
+    skills = sorted(
+        actor_state.skill_states.values(),
+        key=lambda skill: skill.score_per_cast_time,
+        reverse=True)
+    candidates_by_weapon_set = get_candidates_by_weapon_set(actor_state, skills)
+
+    best_damage, best_rotation = search_greedy(actor_state.clone(), max_time, depth)
+    best_rotation = best_rotation["skill_casts"]
+    if top_rotations is not None:
+        top_rotations.offer(best_damage, best_rotation)
+    stats.offer(best_damage, best_rotation)
+
+    stack: List[Tuple[int, int, AnyActorState, List[Dict]]] = [(0, 1, actor_state, [])]
+    while stack:
+        if (node_limit is not None and stats.nodes_expanded >= node_limit) or stats.cancelled:
+            stats.completed = False
+            break
+
+        total_damage, time, node_actor_state, rotation = stack.pop()
+        if top_rotations is not None:
+            top_rotations.offer(total_damage, rotation)
+        if total_damage > best_damage:
+            best_damage, best_rotation = total_damage, rotation
+            stats.offer(best_damage, best_rotation)
+        if time > max_time or (depth is not None and len(rotation) >= depth):
+            continue
+        remaining_casts = depth - len(rotation) if depth is not None else None
+        if total_damage + get_damage_upper_bound(node_actor_state, max_time - time + 1, remaining_casts) \
+                <= best_damage:
+            continue
+
+        castable_skills = [
+            skill
+            for skill
+            in candidates_by_weapon_set[node_actor_state.current_weapon_set]
+            if node_actor_state.can_cast(skill.skill_key)
+        ]
+        if not castable_skills:
+            # Nothing to cast, skip to the next cooldown event
+            if node_actor_state.get_time_to_next_event() is None:
+                continue
+            next_actor_state = node_actor_state.clone()
+            time_delta, _ = next_actor_state.simulate(None, skip_idle=True)
+            stats.idle_steps += 1
+            if transposition_table is None or not transposition_table.is_transposition(
+                    next_actor_state, time + time_delta, total_damage, len(rotation)):
+                stack.append((total_damage, time + time_delta, next_actor_state, rotation))
+            continue
+
+        # Push in reverse so that the highest priority skill is explored first
+        for skill in reversed(castable_skills):
+            next_actor_state = node_actor_state.clone()
+            time_delta, _ = next_actor_state.simulate(skill.skill_key)
+            stats.nodes_expanded += 1
+            next_total_damage = total_damage + skill.skill_simulation_data.get_damage_until(max_time - time)
+            if transposition_table is not None and transposition_table.is_transposition(
+                    next_actor_state, time + time_delta, next_total_damage, len(rotation) + 1):
+                continue
+            stack.append((
+                next_total_damage,
+                time + time_delta,
+                next_actor_state,
+                rotation + [{"skill": skill.skill_key, "cast_time_ms": time}]))
+
+    stats.finish()
+    return best_damage, {"skill_casts": best_rotation}
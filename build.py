@@ -0,0 +1,104 @@
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Set
+
+from weapon_type import WeaponType
+
+# Skill whose effect, switching the weapon set, is implemented by the actor states instead of by the build
+WEAPON_SWAP = "Weapon Swap"
+# Keys of a skill definition that don't make casting it do anything
+_INERT_SKILL_KEYS = frozenset(("skill_key", "cast_duration", "cooldown", "ammo", "weapon_type", "NOTE", "tags"))
+WEAPON_INDEPENDENT_TYPES = frozenset((WeaponType.MAIN_HAND, WeaponType.EMPTY_HANDED, WeaponType.INVALID))
+
+
+def get_weapon_set_to_weapon_types_dict(build: Dict) -> Dict[str, Set[WeaponType]]:
+    weapon_set_to_weapon_types_dict: Dict[str, Set[WeaponType]] = {}
+    for weapon in build.get("weapons", []):
+        if weapon["set"] not in weapon_set_to_weapon_types_dict:
+            weapon_set_to_weapon_types_dict[weapon["set"]] = set()
+        weapon_set_to_weapon_types_dict[weapon["set"]].add(WeaponType(weapon["type"]))
+    return weapon_set_to_weapon_types_dict
+
+
+def get_weapon_set_for_weapon_type(weapon_type: WeaponType,
+                                  preferred_weapon_set: str,
+                                  weapon_set_to_weapon_types_dict: Dict[str, Set[WeaponType]]) -> Optional[str]:
+    """
+    :return: preferred_weapon_set if it can cast skills of weapon_type, otherwise the first weapon set of the build that
+        can, None if no weapon set can
+    """
+    if weapon_type in WEAPON_INDEPENDENT_TYPES \
+            or weapon_type in weapon_set_to_weapon_types_dict.get(preferred_weapon_set, ()):
+        return preferred_weapon_set
+    for weapon_set, weapon_types in weapon_set_to_weapon_types_dict.items():
+        if weapon_type in weapon_types:
+            return weapon_set
+    return None
+
+
+def get_skill_to_weapon_type_dict(build: Dict) -> Dict[str, WeaponType]:
+    return {skill["skill_key"]: WeaponType(skill.get("weapon_type", "invalid")) for skill in build.get("skills", [])}
+
+
+def _get_triggered_skill_keys(value) -> Iterator[str]:
+    """
+    Keys of the skills cast by skill_triggers, unchained_skill_triggers etc. anywhere in a build.
+    """
+    if isinstance(value, dict):
+        for key, member in value.items():
+            if key.endswith("skill_triggers") and isinstance(member, list):
+                for trigger in member:
+                    if isinstance(trigger, dict) and "skill_key" in trigger:
+                        yield trigger["skill_key"]
+            yield from _get_triggered_skill_keys(member)
+    elif isinstance(value, list):
+        for member in value:
+            yield from _get_triggered_skill_keys(member)
+
+
+def get_castable_skills(build: Dict) -> List[Dict]:
+    """
+    Skills of the build a player can put in a rotation, in build order. Left out are skills without a cast duration
+    (passives), child skills of other skills, skills cast by triggers (procs), skills that do nothing when cast (AFK
+    skills, the searches wait on their own), skills no weapon set can cast and weapon swap with a single weapon set.
+    """
+    weapon_set_to_weapon_types_dict = get_weapon_set_to_weapon_types_dict(build)
+    weapon_types = set().union(*weapon_set_to_weapon_types_dict.values())
+    skills = build.get("skills", [])
+    child_skill_keys = {
+        child_skill_key
+        for skill
+        in skills
+        for child_skill_key
+        in skill.get("child_skill_keys", [])
+    }
+    child_skill_keys.update(_get_triggered_skill_keys(build))
+
+    castable_skills = []
+    for skill in skills:
+        if "cast_duration" not in skill \
+                or skill["skill_key"] in child_skill_keys \
+                or "attribute_damage_to_skill" in skill:
+            continue
+        if skill["skill_key"] == WEAPON_SWAP:
+            if len(weapon_set_to_weapon_types_dict) < 2:
+                continue
+        elif _INERT_SKILL_KEYS.issuperset(skill.keys()):
+            continue
+        weapon_type = WeaponType(skill.get("weapon_type", "invalid"))
+        if weapon_type not in WEAPON_INDEPENDENT_TYPES and weapon_type not in weapon_types:
+            continue
+        castable_skills.append(skill)
+    return castable_skills
+
+
+def load_skill_score_overrides(path: str) -> Dict[str, int]:
+    """
+    Loads the scores that replace the probed damage of skills in greedy ordering, e.g. to cast buffs that deal little
+    damage themselves first. The file maps skill keys to scores, skills missing from a build are ignored.
+    :return: no overrides if the file doesn't exist
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as overrides_file:
+        return {skill_key: int(score) for skill_key, score in json.load(overrides_file).items()}
@@ -0,0 +1,543 @@
+import dataclasses
+import json
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from instrumentation import timed
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 54321
+RECV_BUFFER_SIZE = 64 * 1024
+
+T = TypeVar("T")
+# An encounter dict or an already encoded request, e.g. rendered by EncounterTemplate
+Encounter = Union[Dict, bytes]
+
+
+@dataclasses.dataclass
+class SimulationResult:
+    audit: Dict
+    latency: float
+
+
+@dataclasses.dataclass
+class ClientStats:
+    requests: int = 0
+    one_shot_requests: int = 0
+    connections_opened: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    last_latency: float = 0.0
+
+    def record(self, latency: float):
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests > 0 else 0.0
+
+
+class Connection:
+    """
+    A socket with a growable receive buffer. Responses are framed either by a newline (persistent connections) or by
+    the server closing the connection (one-shot requests).
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.start = 0
+        self.end = 0
+        self.streamed = 0
+        self.closed = False
+
+    def _receive(self) -> int:
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if self.start > 0:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+            if pending * 2 > len(self.buffer):
+                self.buffer.extend(bytes(len(self.buffer)))
+            self.start = 0
+            self.end = pending
+        with timed("socket.receive"):
+            received = self.sock.recv_into(memoryview(self.buffer)[self.end:])
+        if received == 0:
+            self.closed = True
+        self.end += received
+        return received
+
+    def read_until_newline(self) -> bytes:
+        offset = 0
+        while True:
+            index = self.buffer.find(b"\n", self.start + offset, self.end)
+            if index >= 0:
+                response = bytes(self.buffer[self.start:index])
+                self.start = index + 1
+                return response
+            offset = self.end - self.start
+            if self._receive() == 0:
+                return self.read_until_eof()
+
+    def read_until_eof(self) -> bytes:
+        while not self.closed:
+            self._receive()
+        response = bytes(self.buffer[self.start:self.end])
+        self.start = self.end
+        return response
+
+    def stream_response(self, feed: Callable[[bytes], bool]) -> int:
+        """
+        Hands received data to feed until it reports the response as complete or the server closes the connection.
+        :return: number of bytes handed to feed
+        """
+        self.streamed = self.end - self.start
+        done = self.streamed > 0 and feed(bytes(self.buffer[self.start:self.end]))
+        self.start = self.end = 0
+        view = memoryview(self.buffer)
+        while not done:
+            with timed("socket.receive"):
+                received = self.sock.recv_into(view)
+            if received == 0:
+                self.closed = True
+                break
+            self.streamed += received
+            done = feed(view[:received])
+        return self.streamed
+
+    def send(self, payload: bytes):
+        with timed("socket.send"):
+            self.sock.sendall(payload)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+
+def connect(host: str, port: int, timeout: Optional[float] = None) -> Connection:
+    with timed("socket.connect"):
+        sock = socket.create_connection((host, port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return Connection(sock)
+
+
+def encode_request(encounter: Encounter) -> bytes:
+    if isinstance(encounter, bytes):
+        return encounter
+    with timed("json.encode"):
+        return (json.dumps(encounter) + "\n").encode("utf-8")
+
+
+def decode_response(response: bytes) -> Dict:
+    with timed("json.decode"):
+        return json.loads(response.decode("utf-8", errors="ignore"))
+
+
+def simulate_once(encounter: Encounter, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                  timeout: Optional[float] = None) -> Dict:
+    connection = connect(host, port, timeout)
+    try:
+        connection.send(encode_request(encounter))
+        return decode_response(connection.read_until_eof())
+    finally:
+        connection.close()
+
+
+class SimulationClient:
+    """
+    Pool of connections to a gw2combat server.
+
+    With persistent connections each pooled connection is reused across requests and batches are pipelined, i.e. all
+    requests assigned to a connection are written before their responses are read back in order. If the server closes
+    the connection after a response, the client falls back to one-shot requests (one connection per request).
+    """
+
+    def __init__(self,
+                 host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT,
+                 pool_size: int = 4,
+                 persistent: bool = True,
+                 timeout: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.pool_size = max(1, pool_size)
+        self.persistent = persistent
+        self.timeout = timeout
+        self.stats = ClientStats()
+        self._idle_connections: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> Connection:
+        try:
+            connection = self._idle_connections.get_nowait()
+            if not connection.closed:
+                return connection
+        except queue.Empty:
+            pass
+        with self._lock:
+            self.stats.connections_opened += 1
+        return connect(self.host, self.port, self.timeout)
+
+    def _release(self, connection: Connection):
+        if connection.closed or not self.persistent or self._idle_connections.qsize() >= self.pool_size:
+            connection.close()
+            return
+        self._idle_connections.put(connection)
+
+    def _record(self, latency: float, one_shot: bool = False):
+        with self._lock:
+            self.stats.record(latency)
+            if one_shot:
+                self.stats.one_shot_requests += 1
+
+    def _fall_back(self):
+        with self._lock:
+            if self.persistent:
+                print("Info: server closed a persistent connection, falling back to one-shot requests")
+            self.persistent = False
+
+    def _simulate_one_shot(self, payload: bytes) -> SimulationResult:
+        start = time.perf_counter()
+        connection = connect(self.host, self.port, self.timeout)
+        try:
+            connection.send(payload)
+            audit = decode_response(connection.read_until_eof())
+        finally:
+            connection.close()
+        latency = time.perf_counter() - start
+        self._record(latency, one_shot=True)
+        return SimulationResult(audit, latency)
+
+    def _simulate_pipelined(self, payloads: List[bytes]) -> List[SimulationResult]:
+        if not self.persistent:
+            return [self._simulate_one_shot(payload) for payload in payloads]
+
+        connection = self._acquire()
+        send_times: List[float] = []
+        send_error: List[BaseException] = []
+
+        def send_all():
+            try:
+                for payload in payloads:
+                    send_times.append(time.perf_counter())
+                    connection.send(payload)
+            except OSError as e:
+                send_error.append(e)
+
+        # Writes happen on a separate thread so that a large pipeline can't deadlock with the server's responses
+        sender = threading.Thread(target=send_all, daemon=True)
+        sender.start()
+        results: List[SimulationResult] = []
+        try:
+            for index in range(len(payloads)):
+                if connection.closed:
+                    break
+                response = connection.read_until_newline()
+                # Skip the line terminator left behind by a streamed response
+                while not response and not connection.closed:
+                    response = connection.read_until_newline()
+                if not response:
+                    break
+                try:
+                    audit = decode_response(response)
+                except ValueError:
+                    # Not newline framed, e.g. pretty printed by a server that closes the connection after responding
+                    audit = decode_response(response + b"\n" + connection.read_until_eof())
+                latency = time.perf_counter() - send_times[index]
+                self._record(latency)
+                results.append(SimulationResult(audit, latency))
+        except OSError:
+            connection.close()
+        sender.join()
+        if send_error:
+            connection.close()
+
+        if connection.closed:
+            self._fall_back()
+        self._release(connection)
+        results.extend(self._simulate_one_shot(payload) for payload in payloads[len(results):])
+        return results
+
+    def simulate_streaming(self, encounter: Encounter, feed: Callable[[bytes], bool]) -> float:
+        """
+        Streams the response into feed (e.g. AuditStreamParser.feed) instead of buffering it.
+        :return: latency of the request
+        """
+        payload = encode_request(encounter)
+        if self.persistent:
+            start = time.perf_counter()
+            connection = self._acquire()
+            connection.streamed = 0
+            try:
+                connection.send(payload)
+                num_bytes = connection.stream_response(feed)
+            except OSError:
+                connection.close()
+                # Only a request that failed before any of the response was consumed can be retried
+                if connection.streamed > 0:
+                    raise
+                num_bytes = 0
+            if connection.closed:
+                self._fall_back()
+            self._release(connection)
+            if num_bytes > 0:
+                latency = time.perf_counter() - start
+                self._record(latency)
+                return latency
+
+        start = time.perf_counter()
+        connection = connect(self.host, self.port, self.timeout)
+        try:
+            connection.send(payload)
+            connection.stream_response(feed)
+        finally:
+            connection.close()
+        latency = time.perf_counter() - start
+        self._record(latency, one_shot=True)
+        return latency
+
+    def simulate(self, encounter: Encounter) -> Dict:
+        return self._simulate_pipelined([encode_request(encounter)])[0].audit
+
+    def simulate_batch(self, encounters: List[Encounter]) -> List[SimulationResult]:
+        payloads = [encode_request(encounter) for encounter in encounters]
+        if not payloads:
+            return []
+
+        num_workers = min(self.pool_size, len(payloads))
+        if num_workers == 1:
+            return self._simulate_pipelined(payloads)
+
+        if self.persistent:
+            # Contiguous slices, one pipeline per pooled connection
+            chunk_size = (len(payloads) + num_workers - 1) // num_workers
+            chunks: List[Tuple[int, List[bytes]]] = [
+                (offset, payloads[offset:offset + chunk_size])
+                for offset
+                in range(0, len(payloads), chunk_size)
+            ]
+        else:
+            chunks = [(offset, [payload]) for offset, payload in enumerate(payloads)]
+
+        results: List[Optional[SimulationResult]] = [None] * len(payloads)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                (offset, executor.submit(self._simulate_pipelined, chunk))
+                for offset, chunk
+                in chunks
+            ]
+            for offset, future in futures:
+                for index, result in enumerate(future.result()):
+                    results[offset + index] = result
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def parse_endpoint(endpoint: str) -> Tuple[str, int]:
+    """
+    Parses "host:port", ":port" or "port" into (host, port).
+    """
+    host, _, port = endpoint.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+@dataclasses.dataclass
+class EndpointStats:
+    outstanding: int = 0
+    failures: int = 0
+    retries: int = 0
+    healthy: bool = True
+    unhealthy_since: float = 0.0
+    busy_time: float = 0.0
+    busy_since: float = 0.0
+
+
+class ShardedSimulationClient:
+    """
+    Spreads requests over several gw2combat servers, each with its own SimulationClient.
+
+    Every request goes to the healthy endpoint with the least outstanding requests. An endpoint that fails with a
+    connection error is marked unhealthy and the request is retried on another endpoint, up to max_retries times.
+    Unhealthy endpoints are skipped until health_check_interval seconds have passed, after which they get requests
+    again and the next success marks them healthy. Simulations have no side effects, so retrying is always safe.
+    """
+
+    def __init__(self,
+                 endpoints: Sequence[Tuple[str, int]],
+                 pool_size: int = 4,
+                 persistent: bool = True,
+                 timeout: Optional[float] = None,
+                 max_retries: int = 2,
+                 health_check_interval: float = 5.0):
+        if not endpoints:
+            raise ValueError("At least one server endpoint is required")
+        self.clients = [SimulationClient(host, port, pool_size, persistent, timeout) for host, port in endpoints]
+        self.endpoint_stats = [EndpointStats() for _ in self.clients]
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+
+    @property
+    def persistent(self) -> bool:
+        return any(client.persistent for client in self.clients)
+
+    @property
+    def stats(self) -> ClientStats:
+        stats = ClientStats()
+        for client in self.clients:
+            stats.requests += client.stats.requests
+            stats.one_shot_requests += client.stats.one_shot_requests
+            stats.connections_opened += client.stats.connections_opened
+            stats.total_latency += client.stats.total_latency
+            stats.max_latency = max(stats.max_latency, client.stats.max_latency)
+        stats.last_latency = max((client.stats.last_latency for client in self.clients), default=0.0)
+        return stats
+
+    def get_throughput(self, index: int) -> float:
+        """
+        Requests completed per second of the time the endpoint had requests outstanding.
+        """
+        with self._lock:
+            endpoint_stats = self.endpoint_stats[index]
+            busy_time = endpoint_stats.busy_time
+            if endpoint_stats.outstanding > 0:
+                busy_time += time.perf_counter() - endpoint_stats.busy_since
+        return self.clients[index].stats.requests / busy_time if busy_time > 0.0 else 0.0
+
+    def check_health(self) -> List[bool]:
+        """
+        Actively checks that every endpoint accepts connections and updates their health.
+        """
+        health = []
+        for index, client in enumerate(self.clients):
+            try:
+                socket.create_connection((client.host, client.port), timeout=self.timeout or 1.0).close()
+                self._mark_healthy(index)
+                health.append(True)
+            except OSError:
+                self._mark_unhealthy(index)
+                health.append(False)
+        return health
+
+    def _mark_healthy(self, index: int):
+        with self._lock:
+            self.endpoint_stats[index].healthy = True
+
+    def _mark_unhealthy(self, index: int):
+        with self._lock:
+            endpoint_stats = self.endpoint_stats[index]
+            endpoint_stats.failures += 1
+            endpoint_stats.healthy = False
+            endpoint_stats.unhealthy_since = time.perf_counter()
+
+    def _acquire(self, num_requests: int, excluded: Sequence[int]) -> int:
+        with self._lock:
+            now = time.perf_counter()
+            candidates = [
+                index
+                for index, endpoint_stats
+                in enumerate(self.endpoint_stats)
+                if index not in excluded and (
+                        endpoint_stats.healthy
+                        or now - endpoint_stats.unhealthy_since >= self.health_check_interval)
+            ]
+            if not candidates:
+                # Every endpoint is down or already failed this request, try the one that failed longest ago
+                candidates = [
+                    index for index in range(len(self.clients)) if index not in excluded
+                ] or list(range(len(self.clients)))
+                candidates.sort(key=lambda index: self.endpoint_stats[index].unhealthy_since)
+                candidates = candidates[:1]
+            index = min(candidates, key=lambda index: self.endpoint_stats[index].outstanding)
+            endpoint_stats = self.endpoint_stats[index]
+            if endpoint_stats.outstanding == 0:
+                endpoint_stats.busy_since = now
+            endpoint_stats.outstanding += num_requests
+            return index
+
+    def _release(self, index: int, num_requests: int):
+        with self._lock:
+            endpoint_stats = self.endpoint_stats[index]
+            endpoint_stats.outstanding -= num_requests
+            if endpoint_stats.outstanding == 0:
+                endpoint_stats.busy_time += time.perf_counter() - endpoint_stats.busy_since
+
+    def _run(self, num_requests: int, request: Callable[[SimulationClient], T]) -> T:
+        failed: List[int] = []
+        while True:
+            index = self._acquire(num_requests, failed)
+            try:
+                result = request(self.clients[index])
+            except OSError:
+                self._mark_unhealthy(index)
+                if len(failed) >= self.max_retries:
+                    raise
+                failed.append(index)
+                with self._lock:
+                    self.endpoint_stats[index].retries += 1
+                continue
+            finally:
+                self._release(index, num_requests)
+            self._mark_healthy(index)
+            return result
+
+    def simulate_streaming(self, encounter: Encounter, feed: Callable[[bytes], bool]) -> float:
+        streamed = [0]
+
+        def counting_feed(chunk: bytes) -> bool:
+            streamed[0] += len(chunk)
+            return feed(chunk)
+
+        def request(client: SimulationClient) -> float:
+            # A response that was partially fed can't be replayed into feed
+            try:
+                return client.simulate_streaming(encounter, counting_feed)
+            except OSError as e:
+                if streamed[0] > 0:
+                    raise RuntimeError(f"Connection to {client.host}:{client.port} lost mid-response") from e
+                raise
+
+        return self._run(1, request)
+
+    def simulate(self, encounter: Encounter) -> Dict:
+        return self._run(1, lambda client: client.simulate(encounter))
+
+    def simulate_batch(self, encounters: List[Encounter]) -> List[SimulationResult]:
+        if not encounters:
+            return []
+        if len(self.clients) == 1:
+            return self._run(len(encounters), lambda client: client.simulate_batch(encounters))
+
+        # Enough chunks to fill every endpoint's pool, each chunk goes to the least loaded endpoint when it starts
+        num_chunks = min(len(encounters), len(self.clients) * self.pool_size)
+        chunk_size = (len(encounters) + num_chunks - 1) // num_chunks
+        chunks = [encounters[offset:offset + chunk_size] for offset in range(0, len(encounters), chunk_size)]
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [
+                executor.submit(self._run, len(chunk), lambda client, chunk=chunk: client.simulate_batch(chunk))
+                for chunk
+                in chunks
+            ]
+            return [result for future in futures for result in future.result()]
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+
+AnySimulationClient = Union[SimulationClient, ShardedSimulationClient]
@@ -0,0 +1,165 @@
+from array import array
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple, Union
+
+from actor_state import ActorState, get_castable_skills_by_weapon_set
+from build import WEAPON_SWAP
+from skill_state import SkillState
+from weapon_type import WeaponType
+
+
+class CompactActorState(object):
+    """
+    Array-backed equivalent of ActorState for search inner loops.
+
+    Cooldowns and ammo live in contiguous arrays indexed by skill id, castability per weapon set is precomputed as a
+    bitmask over skill ids and the build-derived data is shared between clones, so clone() only copies two small
+    arrays. tick_cooldown only visits the skills that are recharging. skill_states holds the static SkillState data,
+    their dynamic fields are not used.
+    """
+
+    def __init__(self,
+                 skill_states: Dict[str, SkillState],
+                 current_weapon_set: str,
+                 skill_to_weapon_type_dict: Dict[str, WeaponType],
+                 weapon_set_to_weapon_types_dict: Dict[str, Set[WeaponType]],
+                 castable_skills_by_weapon_set: Optional[Dict[str, FrozenSet[str]]] = None):
+        self.skill_states = skill_states
+        self.skill_to_weapon_type_dict = skill_to_weapon_type_dict
+        self.weapon_set_to_weapon_types_dict = weapon_set_to_weapon_types_dict
+        self.skill_keys: Tuple[str, ...] = tuple(skill_states.keys())
+        self.skill_indexes: Dict[str, int] = {skill_key: index for index, skill_key in enumerate(self.skill_keys)}
+        self.max_cooldowns = array("q", [skill_state.max_cooldown for skill_state in skill_states.values()])
+        self.max_ammo = array("q", [skill_state.max_ammo for skill_state in skill_states.values()])
+        self.time_deltas = array("q", [max(1, skill_state.cast_duration) for skill_state in skill_states.values()])
+        if castable_skills_by_weapon_set is None:
+            castable_skills_by_weapon_set = get_castable_skills_by_weapon_set(
+                self.skill_keys, skill_to_weapon_type_dict, weapon_set_to_weapon_types_dict)
+        self.castable_skills_by_weapon_set = castable_skills_by_weapon_set
+        self.castable_masks: Dict[str, int] = {
+            weapon_set: sum(1 << self.skill_indexes[skill_key] for skill_key in castable_skills)
+            for weapon_set, castable_skills
+            in castable_skills_by_weapon_set.items()
+        }
+        self.weapon_swap_index: Optional[int] = self.skill_indexes.get(WEAPON_SWAP)
+
+        self.current_weapon_set = current_weapon_set
+        self.castable_mask = self.castable_masks[current_weapon_set]
+        self.cooldowns = array("q", [skill_state.current_cooldown for skill_state in skill_states.values()])
+        self.ammo = array("q", [skill_state.current_ammo for skill_state in skill_states.values()])
+        self._recharging: List[int] = [
+            index
+            for index
+            in range(len(self.skill_keys))
+            if self.cooldowns[index] > 0 or self.ammo[index] < self.max_ammo[index]
+        ]
+
+    @staticmethod
+    def from_actor_state(actor_state: ActorState) -> "CompactActorState":
+        return CompactActorState(
+            actor_state.skill_states,
+            actor_state.current_weapon_set,
+            actor_state.skill_to_weapon_type_dict,
+            actor_state.weapon_set_to_weapon_types_dict,
+            actor_state.castable_skills_by_weapon_set)
+
+    def clone(self) -> "CompactActorState":
+        actor_state = object.__new__(CompactActorState)
+        actor_state.__dict__.update(self.__dict__)
+        actor_state.cooldowns = self.cooldowns[:]
+        actor_state.ammo = self.ammo[:]
+        actor_state._recharging = self._recharging[:]
+        return actor_state
+
+    def get_current_cooldown(self, skill_key: str) -> int:
+        return self.cooldowns[self.skill_indexes[skill_key]]
+
+    def get_current_ammo(self, skill_key: str) -> int:
+        return self.ammo[self.skill_indexes[skill_key]]
+
+    def get_state_key(self, time_quantum: int = 1) -> Tuple:
+        state_key = [self.current_weapon_set]
+        for cooldown, ammo in zip(self.cooldowns, self.ammo):
+            # Rounded up so that a skill on cooldown never shares a key with a skill off cooldown
+            state_key.append(-(-cooldown // time_quantum))
+            state_key.append(ammo)
+        return tuple(state_key)
+
+    def can_cast(self, skill_key: str) -> bool:
+        index = self.skill_indexes[skill_key]
+        return (self.castable_mask >> index) & 1 == 1 and self.ammo[index] > 0
+
+    def cast(self, skill_key: str):
+        index = self.skill_indexes[skill_key]
+        if self.ammo[index] == self.max_ammo[index]:
+            self.cooldowns[index] = self.max_cooldowns[index]
+        self.ammo[index] -= 1
+        if index not in self._recharging:
+            self._recharging.append(index)
+
+        if index == self.weapon_swap_index:
+            self.current_weapon_set = "set_2" \
+                if self.current_weapon_set == "set_1" \
+                else "set_1"
+            self.castable_mask = self.castable_masks[self.current_weapon_set]
+
+    def tick_cooldown(self, delta=1):
+        if not self._recharging:
+            return
+        cooldowns = self.cooldowns
+        ammo = self.ammo
+        max_ammo = self.max_ammo
+        recharging = []
+        for index in self._recharging:
+            cooldown = cooldowns[index]
+            if cooldown > 0:
+                cooldown = cooldown - delta if cooldown > delta else 0
+                cooldowns[index] = cooldown
+            if cooldown == 0 and ammo[index] < max_ammo[index]:
+                ammo[index] += 1
+            if cooldown > 0 or ammo[index] < max_ammo[index]:
+                recharging.append(index)
+        self._recharging = recharging
+
+    def get_time_to_next_event(self) -> Optional[int]:
+        if not self._recharging:
+            return None
+        cooldowns = self.cooldowns
+        return min(cooldowns[index] if cooldowns[index] > 0 else 1 for index in self._recharging)
+
+    def simulate(self, next_skill: Optional[str], skip_idle: bool = False) -> (int, Optional[str]):
+        if next_skill is None:
+            time_delta = (self.get_time_to_next_event() or 1) if skip_idle else 1
+            self.tick_cooldown(time_delta)
+            return time_delta, None
+
+        if not self.can_cast(next_skill):
+            return 0, None
+
+        self.cast(next_skill)
+
+        time_delta = self.time_deltas[self.skill_indexes[next_skill]]
+        self.tick_cooldown(time_delta)
+        return time_delta, next_skill
+
+    def simulate_rotation(self, rotation: Dict[str, List[Dict[str, Union[str, int]]]]):
+        for skill_cast in rotation["skill_casts"]:
+            next_skill: str = str(skill_cast["skill"])
+            if not next_skill:
+                continue
+            self.simulate(next_skill)
+
+
+AnyActorState = Union[ActorState, CompactActorState]
+
+
+def get_candidates_by_weapon_set(actor_state: AnyActorState,
+                                 skill_states: Sequence[SkillState]) -> Dict[str, List[SkillState]]:
+    """
+    The skill states each weapon set can cast, in the given order, so that searches only consider the candidates of
+    the current weapon set.
+    """
+    return {
+        weapon_set: [skill_state for skill_state in skill_states if skill_state.skill_key in castable_skills]
+        for weapon_set, castable_skills
+        in actor_state.castable_skills_by_weapon_set.items()
+    }
@@ -0,0 +1,183 @@
+import hashlib
+import json
+from typing import Dict, List, Optional, Sequence
+
+# Members of the encounter that requests override
+_OVERRIDDEN_MEMBERS = ("actors", "termination_conditions", "audit_configuration")
+# Name of the actor in actor encounters, so that the same build under another name gives the same requests
+ACTOR_ENCOUNTER_ACTOR_NAME = "actor"
+
+
+def _serialize_members(members: Dict, excluded: Sequence[str] = ()) -> str:
+    return ", ".join(
+        f"{json.dumps(key)}: {json.dumps(value)}"
+        for key, value
+        in members.items()
+        if key not in excluded
+    )
+
+
+def _join_members(*members: str) -> str:
+    return "{" + ", ".join(member for member in members if member) + "}"
+
+
+def get_actor(encounter: Dict, actor_name: Optional[str] = None) -> Dict:
+    """
+    :return: the actor with this name, the first actor if actor_name is None
+    """
+    if actor_name is None:
+        return encounter["actors"][0]
+    for actor in encounter["actors"]:
+        if actor["name"] == actor_name:
+            return actor
+    raise KeyError(f"Unknown actor: {actor_name}")
+
+
+def get_enemy_names(encounter: Dict, actor_name: str) -> List[str]:
+    """
+    Actors of another team than the actor, every other actor if the actor has no team.
+    """
+    actor = get_actor(encounter, actor_name)
+    return [
+        other_actor["name"]
+        for other_actor
+        in encounter["actors"]
+        if other_actor is not actor and (actor.get("team") is None or other_actor.get("team") != actor.get("team"))
+    ]
+
+
+def get_actor_encounter(encounter: Dict, actor_name: Optional[str] = None) -> Dict:
+    """
+    The encounter with only the actor, moved first so that templates override its rotation, and its enemies. Without
+    allies all damage the enemies take comes from the actor, and the result only depends on the actor's build and
+    the enemies. The actor is renamed to ACTOR_ENCOUNTER_ACTOR_NAME, termination conditions included, unless an enemy
+    already has that name. Only the actor list, the actor and the termination conditions are copied.
+    """
+    actor = get_actor(encounter, actor_name)
+    enemy_names = get_enemy_names(encounter, actor["name"])
+    enemies = [other_actor for other_actor in encounter["actors"] if other_actor["name"] in enemy_names]
+    if ACTOR_ENCOUNTER_ACTOR_NAME in enemy_names:
+        return {**encounter, "actors": [actor, *enemies]}
+
+    actor_encounter = {**encounter, "actors": [{**actor, "name": ACTOR_ENCOUNTER_ACTOR_NAME}, *enemies]}
+    if "termination_conditions" in encounter:
+        actor_encounter["termination_conditions"] = [
+            {**termination_condition, "actor": ACTOR_ENCOUNTER_ACTOR_NAME}
+            if termination_condition.get("actor") == actor["name"]
+            else termination_condition
+            for termination_condition
+            in encounter["termination_conditions"]
+        ]
+    return actor_encounter
+
+
+class EncounterTemplate(object):
+    """
+    An encounter with its invariant JSON serialized once, used to build requests that only differ in the rotation and
+    initial weapon set of the first actor, additional termination conditions and the audits to perform. Rendering a
+    request splices the serialized overrides into the serialized invariant parts, so neither the encounter is copied
+    nor the builds are serialized again. get_hash likewise only hashes the overrides on top of a precomputed digest.
+
+    The encounter must not be modified while the template is in use.
+    """
+
+    def __init__(self, encounter: Dict):
+        self.encounter = encounter
+        first_actor = encounter["actors"][0]
+        build = first_actor.get("build", {})
+        audit_configuration = encounter.get("audit_configuration")
+
+        self.rotation: Dict = first_actor.get("rotation", {"skill_casts": []})
+        self.initial_weapon_set: Optional[str] = build.get("initial_weapon_set")
+        self.audits: Optional[List[str]] = (audit_configuration or {}).get("audits_to_perform")
+
+        self._encounter_members = _serialize_members(encounter, _OVERRIDDEN_MEMBERS)
+        self._actor_members = _serialize_members(first_actor, ("build", "rotation"))
+        self._build_members = _serialize_members(build, ("initial_weapon_set",))
+        self._other_actors = ", ".join(json.dumps(actor) for actor in encounter["actors"][1:])
+        self._termination_conditions = [
+            json.dumps(termination_condition)
+            for termination_condition
+            in encounter.get("termination_conditions", [])
+        ]
+        self._has_audit_configuration = audit_configuration is not None
+        self._audit_configuration_members = _serialize_members(audit_configuration or {}, ("audits_to_perform",))
+        self._rotation_json = json.dumps(self.rotation)
+
+        # Digest of everything but the overridable values, only the levels on the path to them are copied
+        invariant_encounter = {
+            **encounter,
+            "actors": [
+                {
+                    **{key: value for key, value in first_actor.items() if key != "rotation"},
+                    "build": {key: value for key, value in build.items() if key != "initial_weapon_set"},
+                },
+                *encounter["actors"][1:],
+            ],
+            "audit_configuration": {
+                key: value
+                for key, value
+                in (audit_configuration or {}).items()
+                if key != "audits_to_perform"
+            },
+        }
+        self._digest = hashlib.sha256(
+            json.dumps(invariant_encounter, sort_keys=True, separators=(",", ":")).encode("utf-8")).digest()
+
+    def render(self,
+               rotation: Optional[Dict] = None,
+               initial_weapon_set: Optional[str] = None,
+               termination_conditions: Sequence[Dict] = (),
+               audits: Optional[List[str]] = None) -> bytes:
+        """
+        :return: the newline-terminated request, accepted by the SimulationClient methods in place of an encounter
+        """
+        initial_weapon_set = initial_weapon_set if initial_weapon_set is not None else self.initial_weapon_set
+        audits = audits if audits is not None else self.audits
+
+        build = _join_members(
+            self._build_members,
+            f"\"initial_weapon_set\": {json.dumps(initial_weapon_set)}" if initial_weapon_set is not None else "")
+        first_actor = _join_members(
+            self._actor_members,
+            f"\"build\": {build}",
+            f"\"rotation\": {json.dumps(rotation) if rotation is not None else self._rotation_json}")
+        actors = ", ".join(actor for actor in (first_actor, self._other_actors) if actor)
+        all_termination_conditions = ", ".join(
+            self._termination_conditions
+            + [json.dumps(termination_condition) for termination_condition in termination_conditions])
+        audit_configuration = ""
+        if self._has_audit_configuration or audits is not None:
+            audit_configuration = "\"audit_configuration\": " + _join_members(
+                self._audit_configuration_members,
+                f"\"audits_to_perform\": {json.dumps(audits)}" if audits is not None else "")
+
+        encounter = _join_members(
+            self._encounter_members,
+            f"\"actors\": [{actors}]",
+            f"\"termination_conditions\": [{all_termination_conditions}]",
+            audit_configuration)
+        return (encounter + "\n").encode("utf-8")
+
+    def get_hash(self,
+                 rotation: Optional[Dict] = None,
+                 initial_weapon_set: Optional[str] = None,
+                 termination_conditions: Sequence[Dict] = (),
+                 audits: Optional[List[str]] = None,
+                 server_version: Optional[str] = None) -> str:
+        """
+        Content hash of the request rendered with the same overrides, for simulation caches. Overrides that resolve to
+        the same request give the same hash.
+        """
+        overrides = [
+            rotation if rotation is not None else self.rotation,
+            initial_weapon_set if initial_weapon_set is not None else self.initial_weapon_set,
+            list(termination_conditions),
+            audits if audits is not None else self.audits,
+        ]
+        hasher = hashlib.sha256(self._digest)
+        hasher.update(json.dumps(overrides, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        if server_version is not None:
+            hasher.update(b"\0")
+            hasher.update(server_version.encode("utf-8"))
+        return hasher.hexdigest()
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from compact_actor_state import AnyActorState
+from greedy import search_greedy
+from search_stats import SearchStats
+from verification import TopRotations
+
+GENETIC_CHECKPOINT_VERSION = 2
+MAX_GENOME_LENGTH = 512
+TOURNAMENT_SIZE = 3
+ELITE_SIZE = 2
+CROSSOVER_RATE = 0.8
+# Evaluations are sent to the workers in a few chunks per worker to balance the load without per-genome overhead
+CHUNKS_PER_WORKER = 4
+
+Genome = Tuple[str, ...]
+
+# Set once per worker process by _initialize_worker
+_worker_actor_state: Optional[AnyActorState] = None
+_worker_max_time: int = 0
+_worker_depth: Optional[int] = None
+
+
+def decode_genome(actor_state: AnyActorState,
+                  genome: Sequence[str],
+                  max_time: int,
+                  depth: Optional[int] = None) -> (int, List[Dict]):
+    """
+    Turns a genome, a sequence of skill keys, into a feasible rotation. Each skill is cast as soon as it has ammo,
+    waiting for cooldowns if needed, and skills that can't be cast with the current weapon set are skipped.
+    :return: total_damage, skill_casts
+    """
+    actor_state = actor_state.clone()
+    total_damage = 0
+    skill_casts = []
+    time = 1
+    for skill_key in genome:
+        if depth is not None and len(skill_casts) >= depth:
+            break
+        while time <= max_time and not actor_state.can_cast(skill_key):
+            # Ammo left means the weapon set is wrong, waiting won't help
+            if actor_state.get_current_ammo(skill_key) > 0 or actor_state.get_time_to_next_event() is None:
+                break
+            time_delta, _ = actor_state.simulate(None, skip_idle=True)
+            time += time_delta
+        if time > max_time:
+            break
+        time_delta, executed_skill = actor_state.simulate(skill_key)
+        if executed_skill is None:
+            continue
+        total_damage += actor_state.skill_states[skill_key].skill_simulation_data.get_damage_until(max_time - time)
+        skill_casts.append({"skill": skill_key, "cast_time_ms": time})
+        time += time_delta
+    return total_damage, skill_casts
+
+
+def get_genome_length(actor_state: AnyActorState, max_time: int) -> int:
+    cast_durations = [max(1, skill_state.cast_duration) for skill_state in actor_state.skill_states.values()]
+    if not cast_durations:
+        return 1
+    return max(1, min(MAX_GENOME_LENGTH, max_time * len(cast_durations) // sum(cast_durations)))
+
+
+def get_checkpoint_fingerprint(actor_state: AnyActorState,
+                               max_time: int,
+                               depth: Optional[int],
+                               population_size: int,
+                               seed: int) -> str:
+    """
+    Hash of everything a checkpoint depends on, a checkpoint is only resumed by the same search.
+    """
+    skills = [
+        [skill_key, skill_state.skill_simulation_data.total_damage, skill_state.max_cooldown,
+         skill_state.cast_duration, skill_state.max_ammo,
+         list(skill_state.skill_simulation_data.damage_profile_offsets),
+         list(skill_state.skill_simulation_data.damage_profile)]
+        for skill_key, skill_state
+        in actor_state.skill_states.items()
+    ]
+    fingerprint = [skills, list(actor_state.get_state_key()), max_time, depth, population_size, seed]
+    return hashlib.sha256(json.dumps(fingerprint, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def get_checkpoint_path(directory: Optional[str], fingerprint: str) -> Optional[str]:
+    """
+    Checkpoints are keyed on the fingerprint, concurrent searches with different parameters never share a file.
+    """
+    if directory is None:
+        return None
+    return os.path.join(directory, f"{fingerprint}.json")
+
+
+def load_checkpoint(path: Optional[str], fingerprint: str) -> Optional[Dict]:
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable checkpoint {path}: {e}")
+        return None
+    if checkpoint.get("version") != GENETIC_CHECKPOINT_VERSION or checkpoint.get("fingerprint") != fingerprint:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path: Optional[str], checkpoint: Dict):
+    if path is None:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # A unique temporary file per write, identical searches on other threads may save the same checkpoint concurrently
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def _initialize_worker(actor_state: AnyActorState, max_time: int, depth: Optional[int]):
+    global _worker_actor_state, _worker_max_time, _worker_depth
+    _worker_actor_state = actor_state
+    _worker_max_time = max_time
+    _worker_depth = depth
+
+
+def _evaluate_genomes(genomes: List[Genome]) -> List[int]:
+    return [decode_genome(_worker_actor_state, genome, _worker_max_time, _worker_depth)[0] for genome in genomes]
+
+
+def _select(rng: random.Random, population: List[Genome], fitnesses: List[int]) -> Genome:
+    best_index = max(rng.sample(range(len(population)), min(TOURNAMENT_SIZE, len(population))),
+                     key=lambda index: fitnesses[index])
+    return population[best_index]
+
+
+def _mutate(rng: random.Random, genome: List[str], skill_keys: Sequence[str]):
+    mutation_rate = 1 / len(genome)
+    for index in range(len(genome)):
+        if rng.random() < mutation_rate:
+            genome[index] = rng.choice(skill_keys)
+    # Shifting part of the genome keeps the relative order of the following skills, which point mutations can't do
+    if rng.random() < 0.5:
+        index = rng.randrange(len(genome))
+        if rng.random() < 0.5:
+            genome.insert(index, rng.choice(skill_keys))
+            genome.pop()
+        else:
+            genome.pop(index)
+            genome.append(rng.choice(skill_keys))
+
+
+def _breed(rng: random.Random,
+           population: List[Genome],
+           fitnesses: List[int],
+           skill_keys: Sequence[str]) -> List[Genome]:
+    ranking = sorted(range(len(population)), key=lambda index: fitnesses[index], reverse=True)
+    next_population = [population[index] for index in ranking[:ELITE_SIZE]]
+    while len(next_population) < len(population):
+        parent = _select(rng, population, fitnesses)
+        if rng.random() < CROSSOVER_RATE and len(parent) > 1:
+            other_parent = _select(rng, population, fitnesses)
+            crossover_point = rng.randrange(1, len(parent))
+            child = list(parent[:crossover_point] + other_parent[crossover_point:])
+        else:
+            child = list(parent)
+        _mutate(rng, child, skill_keys)
+        next_population.append(tuple(child))
+    return next_population
+
+
+def search_genetic(actor_state: AnyActorState,
+                   max_time: int,
+                   depth: Optional[int] = None,
+                   generations: int = 100,
+                   population_size: int = 64,
+                   workers: int = 1,
+                   checkpoint_directory: Optional[str] = None,
+                   seed: int = 0,
+                   stats: Optional[SearchStats] = None,
+                   top_rotations: Optional[TopRotations] = None) \
+        -> (int, Dict[str, List[Tuple[str, int]]]):
+    """
+    Genetic search over skill sequences decoded with decode_genome, scored by static damage truncated at max_time. The
+    initial population holds the greedy rotation and random genomes, each generation keeps the best genomes and breeds
+    the rest with tournament selection, one-point crossover and mutation.
+
+    Evaluations are spread over `workers` processes that receive the actor state, including the probed skill data,
+    once at startup. The population is checkpointed in checkpoint_directory after every generation, a search with the
+    same actor state and parameters resumes from its checkpoint and runs until `generations` in total. The generation
+    and seed fully determine the random choices, so a resumed search is identical to an uninterrupted one. A search
+    cancelled through stats stops after the current generation and can be resumed the same way.
+    """
+    if stats is None:
+        stats = SearchStats()
+
+    skill_keys = list(actor_state.skill_states.keys())
+    if not skill_keys or population_size <= 0:
+        stats.finish()
+        return 0, {"skill_casts": []}
+
+    _, greedy_rotation = search_greedy(actor_state.clone(), max_time, depth)
+    greedy_genome = [skill_cast["skill"] for skill_cast in greedy_rotation["skill_casts"]]
+    genome_length = depth if depth is not None else min(
+        MAX_GENOME_LENGTH, max(get_genome_length(actor_state, max_time), len(greedy_genome)))
+    genome_length = max(1, genome_length)
+
+    fingerprint = get_checkpoint_fingerprint(actor_state, max_time, depth, population_size, seed)
+    checkpoint_path = get_checkpoint_path(checkpoint_directory, fingerprint)
+    checkpoint = load_checkpoint(checkpoint_path, fingerprint)
+    if checkpoint is not None:
+        print(f"Info: resuming genetic search from generation {checkpoint['generation']}")
+        generation = checkpoint["generation"]
+        population = [tuple(genome) for genome in checkpoint["population"]]
+    else:
+        generation = 0
+        rng = random.Random(f"{seed}:initial")
+        population = [tuple((greedy_genome + [skill_keys[0]] * genome_length)[:genome_length])]
+        while len(population) < population_size:
+            population.append(tuple(rng.choice(skill_keys) for _ in range(genome_length)))
+
+    executor = None
+    if workers > 1:
+        # Spawned, searches run on job threads and a forked worker could inherit a lock held by another thread
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_initialize_worker,
+            initargs=(actor_state, max_time, depth))
+    try:
+        fitness_by_genome: Dict[Genome, int] = {}
+        while True:
+            # Elites and unchanged children repeat genomes of the previous generation, they aren't evaluated again
+            pending = list({genome for genome in population if genome not in fitness_by_genome})
+            if executor is None:
+                pending_fitnesses = [decode_genome(actor_state, genome, max_time, depth)[0] for genome in pending]
+            else:
+                chunk_size = max(1, -(-len(pending) // (workers * CHUNKS_PER_WORKER)))
+                chunks = [pending[index:index + chunk_size] for index in range(0, len(pending), chunk_size)]
+                pending_fitnesses = [
+                    fitness
+                    for chunk_fitnesses
+                    in executor.map(_evaluate_genomes, chunks)
+                    for fitness
+                    in chunk_fitnesses
+                ]
+            stats.evaluations += len(pending)
+            fitness_by_genome = {
+                **{genome: fitness_by_genome[genome] for genome in population if genome in fitness_by_genome},
+                **dict(zip(pending, pending_fitnesses)),
+            }
+            fitnesses = [fitness_by_genome[genome] for genome in population]
+            best_index = max(range(len(population)), key=lambda index: fitnesses[index])
+            if fitnesses[best_index] > stats.best_damage or not stats.best_rotation:
+                stats.offer(*decode_genome(actor_state, population[best_index], max_time, depth))
+
+            if generation >= generations:
+                break
+            if stats.cancelled:
+                stats.completed = False
+                break
+            population = _breed(random.Random(f"{seed}:{generation}"), population, fitnesses, skill_keys)
+            generation += 1
+            save_checkpoint(checkpoint_path, {
+                "version": GENETIC_CHECKPOINT_VERSION,
+                "fingerprint": fingerprint,
+                "generation": generation,
+                "population": [list(genome) for genome in population],
+            })
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    ranking = sorted(range(len(population)), key=lambda index: fitnesses[index], reverse=True)
+    best_damage, best_skill_casts = decode_genome(actor_state, population[ranking[0]], max_time, depth)
+    if top_rotations is not None:
+        for index in ranking:
+            total_damage, skill_casts = decode_genome(actor_state, population[index], max_time, depth)
+            top_rotations.offer(total_damage, skill_casts)
+
+    stats.finish()
+    return best_damage, {"skill_casts": best_skill_casts}
@@ -1,16 +1,28 @@
 from typing import List, Optional, Dict, Tuple
 
-from actor_state import ActorState
+from compact_actor_state import AnyActorState, get_candidates_by_weapon_set
+from search_stats import SearchStats
 from skill_state import SkillState
 from weapon_type import WeaponType
 
 
-def search_greedy(actor_state: ActorState, max_time: Optional[int], depth: Optional[int] = None) \
-        -> (int, Dict[str, List[Tuple[str, int]]]):
+def search_greedy(actor_state: AnyActorState,
+                  max_time: Optional[int],
+                  depth: Optional[int] = None,
+                  stats: Optional[SearchStats] = None,
+                  skip_idle: bool = True) -> (int, Dict[str, List[Tuple[str, int]]]):
+    if stats is None:
+        stats = SearchStats()
+
     sorted_skills = sorted(
         actor_state.skill_states.values(),
         key=lambda skill: skill.score_per_cast_time,
         reverse=True)
+    candidates_by_weapon_set = get_candidates_by_weapon_set(actor_state, sorted_skills)
+
+    # Casts after this time lose damage to the fight end, from then on skills are ranked by the damage they still deal
+    truncation_time = max_time - max(
+        (skill.skill_simulation_data.full_damage_offset for skill in sorted_skills), default=0)
 
     total_damage = 0
 
@@ -19,19 +31,44 @@ def search_greedy(actor_state: ActorState, max_time: Optional[int], depth: Optio
     while time <= max_time:
         if depth is not None and len(best_rotation) >= depth:
             break
+        if stats.cancelled:
+            stats.completed = False
+            break
         next_skill: Optional[SkillState] = None
-        for skill in sorted_skills:
-            if actor_state.can_cast(skill.skill_key):
-                next_skill = skill
+        candidates = candidates_by_weapon_set[actor_state.current_weapon_set]
+        if time <= truncation_time:
+            for skill in candidates:
+                if actor_state.can_cast(skill.skill_key):
+                    next_skill = skill
+                    break
+        else:
+            best_score = None
+            for skill in candidates:
+                if actor_state.can_cast(skill.skill_key):
+                    score = skill.get_score_per_cast_time_until(max_time - time)
+                    if best_score is None or score > best_score:
+                        next_skill, best_score = skill, score
+
+        if next_skill is None:
+            # Nothing to cast, wait for a cooldown. Castability only changes on cooldown and ammo events, so skipping
+            # straight to the next one yields the same cast times as waiting 1ms at a time
+            if skip_idle and actor_state.get_time_to_next_event() is None:
                 break
+            time_delta, _ = actor_state.simulate(None, skip_idle)
+            stats.idle_steps += 1
+            time += time_delta
+            continue
 
         time_delta, executed_skill = actor_state.simulate(next_skill.skill_key)
+        stats.nodes_expanded += 1
         if time_delta == 0:
             raise Exception(f"Error: skill {next_skill.skill_key} cannot be cast")
         if executed_skill == next_skill.skill_key:
-            total_damage += next_skill.skill_simulation_data.total_damage
+            total_damage += next_skill.skill_simulation_data.get_damage_until(max_time - time)
             best_rotation.append({"skill": next_skill.skill_key, "cast_time_ms": time})
 
         time += time_delta
 
+    stats.offer(total_damage, best_rotation)
+    stats.finish()
     return total_damage, {"skill_casts": best_rotation}
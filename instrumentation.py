@@ -0,0 +1,117 @@
+import bisect
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterator, List
+
+# Upper bounds of the histogram buckets in seconds, powers of two from 1us to about 17 minutes
+HISTOGRAM_BUCKETS: List[float] = [2 ** exponent / 1000000 for exponent in range(31)]
+
+
+class Histogram(object):
+    """
+    Log-scale histogram of durations. Percentiles are approximated by the upper bound of their bucket, which is at most
+    twice the actual value, and clamped to the largest recorded duration.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, duration: float):
+        self.bucket_counts[bisect.bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def get_percentile(self, percentile: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percentile / 100)
+        cumulative_count = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                upper_bound = HISTOGRAM_BUCKETS[index] if index < len(HISTOGRAM_BUCKETS) else self.max
+                return min(upper_bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.mean,
+            "min": self.min if self.count > 0 else 0.0,
+            "max": self.max,
+            "p50": self.get_percentile(50),
+            "p95": self.get_percentile(95),
+            "p99": self.get_percentile(99),
+            "buckets": {
+                str(HISTOGRAM_BUCKETS[index] if index < len(HISTOGRAM_BUCKETS) else "inf"): bucket_count
+                for index, bucket_count
+                in enumerate(self.bucket_counts)
+                if bucket_count > 0
+            },
+        }
+
+
+class Instrumentation(object):
+    """
+    Thread-safe registry of named duration histograms, one per instrumented stage.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.record(duration)
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def get_histograms(self) -> Dict[str, Histogram]:
+        with self._lock:
+            return dict(sorted(self._histograms.items()))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def export(self, path: str):
+        data = {name: histogram.to_dict() for name, histogram in self.get_histograms().items()}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as export_file:
+            json.dump(data, export_file, indent=2)
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+def timed(name: str):
+    return INSTRUMENTATION.timer(name)
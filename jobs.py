@@ -0,0 +1,140 @@
+import asyncio
+import dataclasses
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from search_stats import SearchStats
+
+# Minimum time in seconds between two best-so-far reports of a job
+PROGRESS_INTERVAL = 1.0
+
+
+@dataclasses.dataclass
+class Job:
+    id: int
+    description: str
+    task: Optional[asyncio.Task]
+    # Control of searches, None for jobs that can't stop early
+    stats: Optional[SearchStats] = None
+    cancelled: bool = False
+    error: Optional[Exception] = None
+    start_time: float = dataclasses.field(default_factory=time.perf_counter)
+    end_time: float = 0.0
+    last_progress_time: float = 0.0
+
+    @property
+    def status(self) -> str:
+        if self.task is not None and not self.task.done():
+            return "cancelling" if self.cancelled else "running"
+        if self.cancelled:
+            return "cancelled"
+        return "failed" if self.error is not None else "done"
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end_time if self.end_time > 0.0 else time.perf_counter()) - self.start_time
+
+
+class JobRunner(object):
+    """
+    Runs the long commands of the prompt loop as asyncio tasks whose work happens on a thread pool, so the prompt keeps
+    accepting commands while they run. on_done is called on the event loop thread with the result of the work.
+
+    Cancelling a search sets its SearchStats control, the search stops at its next check and on_done receives the best
+    rotation found so far. Jobs without stats can't be interrupted, they run to the end and their result is dropped.
+    New best rotations of searches are reported at most every PROGRESS_INTERVAL seconds.
+
+    With background set to False jobs run to completion on the calling thread instead, e.g. to profile them.
+    """
+
+    def __init__(self, max_workers: int):
+        self.jobs: Dict[int, Job] = {}
+        self.background = True
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._ids = itertools.count(1)
+
+    def start(self,
+              description: str,
+              work: Callable[[], Any],
+              on_done: Callable[[Any], None],
+              stats: Optional[SearchStats] = None) -> Job:
+        job = Job(next(self._ids), description, None, stats)
+        if not self.background:
+            try:
+                on_done(work())
+            except Exception as e:
+                job.error = e
+                print(f"Error: job {job.id} ({job.description}) failed: {e}")
+            finally:
+                job.end_time = time.perf_counter()
+            return job
+
+        loop = asyncio.get_running_loop()
+        job.last_progress_time = job.start_time
+        if stats is not None:
+            stats.on_improvement = lambda improved_stats: self._on_improvement(loop, job, improved_stats)
+
+        async def run():
+            try:
+                result = await loop.run_in_executor(self._executor, work)
+                job.end_time = time.perf_counter()
+                if job.cancelled and job.stats is None:
+                    print(f"Info: job {job.id} ({job.description}) cancelled")
+                    return
+                print(f"Info: job {job.id} ({job.description}) {'cancelled' if job.cancelled else 'finished'} "
+                      f"after {job.elapsed:.2f}s")
+                on_done(result)
+            except Exception as e:
+                job.end_time = job.end_time or time.perf_counter()
+                job.error = e
+                print(f"Error: job {job.id} ({job.description}) failed: {e}")
+
+        job.task = loop.create_task(run())
+        self.jobs[job.id] = job
+        print(f"Info: started job {job.id} ({description})")
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        :return: False if there is no running job with this id
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.task.done():
+            return False
+        job.cancelled = True
+        if job.stats is not None:
+            job.stats.cancel()
+        return True
+
+    async def wait(self, job_id: int) -> bool:
+        """
+        :return: False if there is no job with this id
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        await asyncio.wait([job.task])
+        return True
+
+    async def close(self):
+        """
+        Cancels every running job and waits for all of them to stop.
+        """
+        for job_id in list(self.jobs.keys()):
+            self.cancel(job_id)
+        tasks = [job.task for job in self.jobs.values()]
+        if tasks:
+            await asyncio.wait(tasks)
+        self._executor.shutdown()
+
+    def _on_improvement(self, loop: asyncio.AbstractEventLoop, job: Job, stats: SearchStats):
+        # Called on the worker thread of the search
+        now = time.perf_counter()
+        if now - job.last_progress_time < PROGRESS_INTERVAL:
+            return
+        job.last_progress_time = now
+        best_damage = stats.best_damage
+        loop.call_soon_threadsafe(
+            print, f"Info: job {job.id} best so far: {best_damage} damage after {job.elapsed:.2f}s")
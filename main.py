@@ -1,143 +1,225 @@
-import copy
+import asyncio
+import cProfile
+import dataclasses
 import json
+import multiprocessing
+import os
+import pstats
 import shlex
-import socket
-from typing import Dict, Optional, Set
-
+import shutil
+import sys
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from audit_parser import AuditStreamParser, DamageSummary
+from beam import search_beam
+from build import (WEAPON_INDEPENDENT_TYPES, get_castable_skills, get_skill_to_weapon_type_dict,
+                   get_weapon_set_for_weapon_type, get_weapon_set_to_weapon_types_dict, load_skill_score_overrides)
+from branch_and_bound import search_branch_and_bound
+from client import DEFAULT_HOST, DEFAULT_PORT, Encounter, ShardedSimulationClient, parse_endpoint
+from compact_actor_state import CompactActorState
+from encounter_template import EncounterTemplate, get_actor_encounter
+from genetic import search_genetic
 from greedy import search_greedy
+from instrumentation import INSTRUMENTATION, timed
+from jobs import JobRunner
+from search_stats import SearchStats
+from rotation_trie import RotationTrie, RotationTrieNode
+from simulation_cache import SimulationCache
 from skill_state import SkillState, SkillSimulationData
+from transposition import TranspositionTable
+from verification import (TopRotations, VerifiedJointRotation, VerifiedRotation, prepend_rotation_prefix,
+                          verify_joint_rotation, verify_rotations)
 from actor_state import ActorState
 from weapon_type import WeaponType
 
-allowed_skills_by_weapon = ((
-                                "Barrage",
-                                "Frost Trap",
-                                "Sic 'Em!",
-                                "Point-Blank Shot",
-                                "One Wolf Pack",
-                                "Frenzied Attack",
-                                "Worldly Impact",
-                                "Rapid Fire",
-                                "Long Range Shot",
-                                "AFK 40ms",
-                            ), (
-                                "Splitblade",
-                                "Frost Trap",
-                                "Path of Scars",
-                                "Winter's Bite",
-                                "Frenzied Attack",
-                                "Worldly Impact",
-                                "Whirling Defense",
-                                "Ricochet",
-                                "One Wolf Pack",
-                                "Sic 'Em!",
-                                "AFK 40ms",
-                            ))
-
-SKILL_SIMULATION_DATA: Dict[str, SkillSimulationData] = {}
-
-
-def simulate(encounter: Dict):
-    def recvall(sock):
-        payload = b""
-        while True:
-            buff = sock.recv(1024)
-            payload += buff
-            if len(buff) == 0:
-                break
-        return payload.decode("utf-8", errors="ignore")
-
-    payload = json.dumps(encounter) + "\n"
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect(("127.0.0.1", 54321))
-        sock.sendall(payload.encode("utf-8"))
-        response = recvall(sock)
-    return json.loads(response)
-
+DEFAULT_ENCOUNTER = os.path.join("resources", "encounter.json")
+SKILL_SIMULATION_CACHE = SimulationCache(os.path.join(".cache", "skill_simulation_data.json"))
+VERIFIED_ROTATION_CACHE = SimulationCache(os.path.join(".cache", "verified_rotations.json"))
+SERVER_VERSION: Optional[str] = os.environ.get("GW2COMBAT_VERSION")
+# Comma separated host:port list of gw2combat servers, requests are load balanced over all of them
+SERVER_ENDPOINTS = [
+    parse_endpoint(endpoint)
+    for endpoint
+    in os.environ.get("GW2COMBAT_SERVERS", f"{DEFAULT_HOST}:{DEFAULT_PORT}").split(",")
+    if endpoint
+]
+SIMULATION_CLIENT = ShardedSimulationClient(SERVER_ENDPOINTS)
+PROBE_WORKERS = 8
+# Skill key to score map replacing the probed damage of skills, see load_skill_score_overrides
+SKILL_SCORE_OVERRIDES = load_skill_score_overrides(
+    os.environ.get("GW2COMBAT_SCORE_OVERRIDES", os.path.join("resources", "skill_score_overrides.json")))
+# Skill probes only need damage events
+PROBE_AUDITS = ["DAMAGE"]
+TRANSPOSITION_TABLE_SIZE = 1 << 20
+# Number of best distinct rotations kept from the latest search for server verification
+TOP_ROTATIONS_SIZE = 32
+ROTATION_TRIE_SIZE = 100000
+GENETIC_WORKERS = os.cpu_count() or 1
+GENETIC_CHECKPOINT_DIRECTORY = os.path.join(".cache", "genetic_checkpoints")
+GENETIC_SEED = 0
+SEARCH_ALGORITHMS = ("greedy", "beam", "bnb", "genetic")
+SEARCH_USAGE = "<greedy/beam <width>/bnb <optional:node limit>/genetic <generations> <population>>"
+# Number of processes searching the rotations of different actors of the encounter concurrently
+ACTOR_SEARCH_WORKERS = os.cpu_count() or 1
+BNB_NODE_LIMIT = 100000
+# Number of searches and simulations run concurrently in the background
+JOB_WORKERS = 4
+PROFILE_OUTPUT = os.path.join(".cache", "profile.prof")
+PROFILE_MEMORY_OUTPUT = os.path.join(".cache", "profile.tracemalloc")
+# Number of functions and allocation sites printed by profile
+PROFILE_TOP = 20
+
+
+def simulate(encounter: Encounter):
+    return SIMULATION_CLIENT.simulate(encounter)
+
+
+def simulate_damage(encounter: Encounter) -> DamageSummary:
+    damage_summary = DamageSummary()
+    parser = AuditStreamParser(damage_summary.add_tick_event)
+    SIMULATION_CLIENT.simulate_streaming(encounter, parser.feed)
+    parser.close()
+    return damage_summary
+
+
+def load_encounter(path: str) -> Optional[Dict]:
+    """
+    Loads an encounter and resolves the build_path and rotation_path of its actors.
+    :return: None if an actor has no build
+    """
+    encounter = json.load(open(path, "r"))
+    for actor in encounter["actors"]:
+        if "build" not in actor and "build_path" in actor:
+            actor["build"] = json.load(open(actor["build_path"]))
+        elif "build" not in actor:
+            print(f"Error: actor {actor} build or build_path not found")
+            return None
 
-def get_skill_score(skill: Dict, skill_simulation_data: SkillSimulationData):
-    if skill["skill_key"] == "Sic 'Em!":
-        return 100000
-    if skill["skill_key"] == "One Wolf Pack":
-        return 99999
-    return skill_simulation_data.total_damage
+        if "rotation" not in actor and "rotation_path" in actor:
+            actor["rotation"] = json.load(open(actor["rotation_path"]))
+        elif "rotation" not in actor:
+            # Set a default empty rotation just for consistency
+            actor["rotation"] = {"skill_casts": []}
+    return encounter
 
 
-def calculate_skill_simulation_data(encounter, skill, weapon_set_to_weapon_types_dict) -> SkillSimulationData:
-    global SKILL_SIMULATION_DATA
+def snapshot_encounter(encounter: Dict) -> Dict:
+    """
+    Copy of the encounter and its actor list for jobs, set rotation replaces the rotation of the actors while they run.
+    """
+    return {**encounter, "actors": [dict(actor) for actor in encounter["actors"]]}
 
-    if skill["skill_key"] in SKILL_SIMULATION_DATA:
-        return SKILL_SIMULATION_DATA[skill["skill_key"]]
 
-    next_encounter = copy.deepcopy(encounter)
+def get_skill_score(skill: Dict, skill_simulation_data: SkillSimulationData):
+    return SKILL_SCORE_OVERRIDES.get(skill["skill_key"], skill_simulation_data.total_damage)
+
+
+def calculate_skill_simulation_data(encounter_template: EncounterTemplate,
+                                    skill,
+                                    weapon_set_to_weapon_types_dict) -> SkillSimulationData:
+    """
+    Probes a skill of the first actor of encounter_template, which must be an actor encounter (get_actor_encounter).
+    """
+    actor_name = encounter_template.encounter["actors"][0]["name"]
+    enemy_names = [enemy["name"] for enemy in encounter_template.encounter["actors"][1:]]
+    initial_weapon_set = encounter_template.initial_weapon_set
     skill_required_weapon_type = WeaponType(skill.get("weapon_type", "invalid"))
-    if skill_required_weapon_type not in (WeaponType.MAIN_HAND, WeaponType.EMPTY_HANDED, WeaponType.INVALID):
-        if "initial_weapon_set" not in next_encounter["actors"][0]["build"]:
-            next_encounter["actors"][0]["build"]["initial_weapon_set"] = "set_1"
-
-        current_weapon_types = weapon_set_to_weapon_types_dict[
-            next_encounter["actors"][0]["build"]["initial_weapon_set"]]
-        if skill_required_weapon_type not in current_weapon_types:
-            next_encounter["actors"][0]["build"]["initial_weapon_set"] = "set_2" \
-                if next_encounter["actors"][0]["build"]["initial_weapon_set"] == "set_1" \
-                else "set_1"
-
-        current_weapon_types = weapon_set_to_weapon_types_dict[
-            next_encounter["actors"][0]["build"]["initial_weapon_set"]]
-        if skill_required_weapon_type not in current_weapon_types:
+    if skill_required_weapon_type not in WEAPON_INDEPENDENT_TYPES:
+        initial_weapon_set = get_weapon_set_for_weapon_type(
+            skill_required_weapon_type, initial_weapon_set or "set_1", weapon_set_to_weapon_types_dict)
+        if initial_weapon_set is None:
             raise Exception("Could not find a weapon type that can cast skill: " + skill["skill_key"])
 
-    next_rotation = {"skill_casts": [{"skill": skill["skill_key"], "cast_time_ms": 0}]}
-    next_encounter["actors"][0]["rotation"] = next_rotation
-    next_encounter["termination_conditions"].append({
-        "type": "TIME",
-        "actor": "lb-slb",
-        "time": 30000
-    })
-
-    try:
-        audit = simulate(next_encounter)
-
-        damage = 0
-        latest_influence_time_ms = 0
-        for tick_event in audit["tick_events"]:
-            if tick_event["actor"] == "golem":
-                damage += tick_event["event"]["damage"] if tick_event["event"]["event_type"] == "damage_event" else 0
-
-        for tick_event in reversed(audit["tick_events"]):
-            if (tick_event["actor"] == "golem" and
-                    tick_event["event"]["event_type"] == "damage_event" and
-                    tick_event["event"]["source_actor"] == "lb-slb" and
-                    tick_event["event"]["source_skill"] == skill["skill_key"]):
-                latest_influence_time_ms = int(tick_event["time_ms"])
-                break
-
-        SKILL_SIMULATION_DATA[skill["skill_key"]] = SkillSimulationData(damage, latest_influence_time_ms)
-    except Exception as e:
-        print(f"exception: {e}")
-        SKILL_SIMULATION_DATA[skill["skill_key"]] = SkillSimulationData(0, 0)
-    return SKILL_SIMULATION_DATA[skill["skill_key"]]
-
-
-def get_actor_state_from_encounter(encounter: Dict) -> ActorState:
-    weapon_set_to_weapon_types_dict: Dict[str, Set[WeaponType]] = {}
-    for weapon in encounter["actors"][0]["build"]["weapons"]:
-        if weapon["set"] not in weapon_set_to_weapon_types_dict:
-            weapon_set_to_weapon_types_dict[weapon["set"]] = set()
-        weapon_set_to_weapon_types_dict[weapon["set"]].add(WeaponType(weapon["type"]))
-
-    skill_to_weapon_type_dict: Dict[str, WeaponType] = {}
-    for skill in encounter["actors"][0]["build"]["skills"]:
-        skill_to_weapon_type_dict[skill["skill_key"]] = WeaponType(skill.get("weapon_type", "invalid"))
+    probe_overrides = {
+        "rotation": {"skill_casts": [{"skill": skill["skill_key"], "cast_time_ms": 0}]},
+        "initial_weapon_set": initial_weapon_set,
+        "termination_conditions": [{
+            "type": "TIME",
+            "actor": actor_name,
+            "time": 30000
+        }],
+        "audits": PROBE_AUDITS,
+    }
+
+    # The probe encounter fully determines the result, so its hash is the cache key
+    cache_key = encounter_template.get_hash(**probe_overrides, server_version=SERVER_VERSION)
+    cached_skill_simulation_data = SKILL_SIMULATION_CACHE.get(cache_key)
+    if cached_skill_simulation_data is not None:
+        damage, latest_influence_time_ms, damage_profile_offsets, damage_profile = cached_skill_simulation_data
+        return SkillSimulationData(
+            damage, latest_influence_time_ms, array("q", damage_profile_offsets), array("q", damage_profile))
+
+    # Failures are raised, a probe that didn't run must not be cached or mistaken for a skill without damage
+    with timed("probe.render"):
+        probe_request = encounter_template.render(**probe_overrides)
+    damage_summary = simulate_damage(probe_request)
+    damage = sum(damage_summary.damage_by_actor.get(enemy_name, 0) for enemy_name in enemy_names)
+    latest_influence_time_ms = max((
+        damage_summary.last_damage_time_ms_by_source.get((enemy_name, actor_name, skill["skill_key"]), 0)
+        for enemy_name
+        in enemy_names
+    ), default=0)
+    # The skill is cast at 0ms, so the damage profile of the probe is the one of a cast
+    damage_profile_offsets, damage_profile = damage_summary.get_damage_profile(*enemy_names)
+
+    SKILL_SIMULATION_CACHE.put(
+        cache_key, [damage, latest_influence_time_ms, damage_profile_offsets, damage_profile])
+    return SkillSimulationData(
+        damage, latest_influence_time_ms, array("q", damage_profile_offsets), array("q", damage_profile))
+
+
+class ProbeError(Exception):
+    """
+    Raised by get_actor_state_from_encounter when skill probes failed. actor_state has no damage for the failed skills,
+    it is only good for a degraded search and must not be reused once the server is back.
+    """
+
+    def __init__(self, failed_skills: List[str], actor_state: ActorState):
+        super().__init__(f"simulation failed for skills: {', '.join(failed_skills)}")
+        self.failed_skills = failed_skills
+        self.actor_state = actor_state
+
+
+def get_actor_state_from_encounter(encounter: Dict, actor_name: Optional[str] = None) -> ActorState:
+    """
+    Probes the castable skills of an actor, the first actor by default. Probes run without the actor's allies, so
+    their results are cached per actor build and enemies.
+    :raises ProbeError: if any probe failed, once every skill was probed
+    """
+    actor_encounter = get_actor_encounter(encounter, actor_name)
+    build = actor_encounter["actors"][0]["build"]
+    initial_weapon_set = build.get("initial_weapon_set", "set_1")
+    weapon_set_to_weapon_types_dict = get_weapon_set_to_weapon_types_dict(build)
+    weapon_set_to_weapon_types_dict.setdefault(initial_weapon_set, set())
+    skill_to_weapon_type_dict = get_skill_to_weapon_type_dict(build)
+    castable_skills = get_castable_skills(build)
+
+    # The build is serialized once for all probes
+    encounter_template = EncounterTemplate(actor_encounter)
+    # Probe every skill concurrently, results are collected in build order so the skill states stay deterministic
+    with timed("probe.skills"), ThreadPoolExecutor(max_workers=max(1, min(PROBE_WORKERS, len(castable_skills)))) \
+            as executor:
+        futures = [
+            executor.submit(
+                calculate_skill_simulation_data, encounter_template, skill, weapon_set_to_weapon_types_dict)
+            for skill
+            in castable_skills
+        ]
+
+    SKILL_SIMULATION_CACHE.save()
 
     skill_states = {}
-    for skill in encounter["actors"][0]["build"]["skills"]:
-        # TODO: Derive allowed skills from build itself
-        if skill["skill_key"] not in allowed_skills_by_weapon[0] \
-                and skill["skill_key"] not in allowed_skills_by_weapon[1]:
-            continue
-
-        skill_simulation_data = calculate_skill_simulation_data(encounter, skill, weapon_set_to_weapon_types_dict)
+    failed_skills = []
+    for skill, future in zip(castable_skills, futures):
+        try:
+            skill_simulation_data = future.result()
+        except Exception as e:
+            print(f"Error: simulation for skill \"{skill['skill_key']}\" failed: {e}")
+            failed_skills.append(skill["skill_key"])
+            skill_simulation_data = SkillSimulationData(0, 0)
         score = get_skill_score(skill, skill_simulation_data)
         damage = skill_simulation_data.total_damage
 
@@ -154,217 +236,758 @@ def get_actor_state_from_encounter(encounter: Dict) -> ActorState:
 
     actor_state = ActorState(
         skill_states,
-        encounter["actors"][0]["build"].get("initial_weapon_set", "set_1"),
+        initial_weapon_set,
         skill_to_weapon_type_dict,
         weapon_set_to_weapon_types_dict)
 
+    if failed_skills:
+        raise ProbeError(failed_skills, actor_state)
     return actor_state
 
 
-def loop():
-    print("Info: available commands - set/display/simulate/search/exit")
-
-    # Setup a default encounter
+def run_search(actor_state: ActorState,
+               algorithm: str,
+               arguments: List[int],
+               search_time: int,
+               search_depth: Optional[int],
+               search_stats: SearchStats,
+               transposition_table: TranspositionTable,
+               top_rotations: TopRotations,
+               genetic_checkpoint_directory: Optional[str] = None,
+               genetic_workers: Optional[int] = None) -> (int, Dict):
+    """
+    Runs one of SEARCH_ALGORITHMS from actor_state, which is not modified. The arguments are the ones of the search
+    command: beam <width>, bnb <optional:node limit> and genetic <generations> <population>. Genetic searches use
+    GENETIC_WORKERS processes unless genetic_workers is given.
+    """
+    # Searches run on the array-backed representation
+    compact_actor_state = CompactActorState.from_actor_state(actor_state)
+    with timed(f"search.{algorithm}"):
+        if algorithm == "greedy":
+            total_damage, best_skill_sequence = search_greedy(
+                compact_actor_state, search_time, search_depth, search_stats)
+            top_rotations.offer(total_damage, best_skill_sequence["skill_casts"])
+            return total_damage, best_skill_sequence
+        elif algorithm == "beam":
+            return search_beam(
+                compact_actor_state, search_time, search_depth, arguments[0], search_stats, transposition_table,
+                top_rotations)
+        elif algorithm == "bnb":
+            return search_branch_and_bound(
+                compact_actor_state, search_time, search_depth, arguments[0] if arguments else BNB_NODE_LIMIT,
+                search_stats, transposition_table, top_rotations)
+        elif algorithm == "genetic":
+            return search_genetic(
+                compact_actor_state, search_time, search_depth, arguments[0], arguments[1],
+                genetic_workers or GENETIC_WORKERS, genetic_checkpoint_directory, GENETIC_SEED, search_stats,
+                top_rotations)
+    raise ValueError(f"Unknown search algorithm: {algorithm}")
+
+
+def parse_search_arguments(words: List[str]) -> Optional[Tuple[str, List[int]]]:
+    """
+    Parses "<algorithm> <argument> ..." as described by SEARCH_USAGE.
+    :return: the algorithm and its arguments, None if they don't match SEARCH_USAGE
+    :raises ValueError: if an argument is not a positive integer
+    """
+    if not words or words[0] not in SEARCH_ALGORITHMS:
+        return None
+    arguments = [int(word) for word in words[1:]]
+    if any(argument <= 0 for argument in arguments):
+        raise ValueError("search arguments must be positive")
+    if (words[0] == "greedy" and len(arguments) != 0) \
+            or (words[0] == "beam" and len(arguments) != 1) \
+            or (words[0] == "bnb" and len(arguments) > 1) \
+            or (words[0] == "genetic" and len(arguments) != 2):
+        return None
+    return words[0], arguments
+
+
+def _search_actor(actor_state: ActorState,
+                  algorithm: str,
+                  arguments: List[int],
+                  search_time: int,
+                  search_depth: Optional[int],
+                  search_time_quantum: int) -> Tuple[int, Dict, bool]:
+    """
+    Searches the rotation of one actor in a worker process of optimize_actors.
+    :return: the total damage, the rotation and whether the search completed
+    """
+    search_stats = SearchStats()
+    # Genetic searches don't spawn processes of their own, the actors are already searched in parallel
+    total_damage, rotation = run_search(
+        actor_state, algorithm, arguments, search_time, search_depth, search_stats,
+        TranspositionTable(TRANSPOSITION_TABLE_SIZE, search_time_quantum), TopRotations(TOP_ROTATIONS_SIZE),
+        genetic_workers=1)
+    return total_damage, rotation, search_stats.completed
+
+
+def optimize_actors(encounter: Dict,
+                    algorithm: str,
+                    arguments: List[int],
+                    search_time: int,
+                    search_depth: Optional[int],
+                    search_time_quantum: int) -> Tuple[VerifiedJointRotation, Dict[str, bool]]:
+    """
+    Searches the rotation of every actor with castable skills from the start of the encounter, each actor in its own
+    process, then simulates all the rotations together on the server.
+    :return: the verified rotations and whether the search of each actor completed
+    """
+    actor_names = [actor["name"] for actor in encounter["actors"] if get_castable_skills(actor["build"])]
+    if not actor_names:
+        raise ValueError("no actor has castable skills")
+    # Probes go through the shared client and cache, the searches only need the probed actor states
+    actor_states = [get_actor_state_from_encounter(encounter, actor_name) for actor_name in actor_names]
+    # Spawned, this runs on a job thread and a forked worker could inherit a lock held by another thread, e.g. in timed
+    with timed("optimize.search"), ProcessPoolExecutor(
+            max_workers=min(ACTOR_SEARCH_WORKERS, len(actor_names)), mp_context=multiprocessing.get_context("spawn")) \
+            as executor:
+        futures = [
+            executor.submit(
+                _search_actor, actor_state, algorithm, arguments, search_time, search_depth, search_time_quantum)
+            for actor_state
+            in actor_states
+        ]
+        results = [future.result() for future in futures]
+
+    rotations = {
+        actor_name: (total_damage, rotation)
+        for actor_name, (total_damage, rotation, _)
+        in zip(actor_names, results)
+    }
+    with timed("optimize.verify"):
+        verified_joint_rotation = verify_joint_rotation(
+            encounter,
+            rotations,
+            SIMULATION_CLIENT,
+            VERIFIED_ROTATION_CACHE,
+            search_time,
+            PROBE_AUDITS,
+            SERVER_VERSION)
+    completed = {actor_name: actor_completed for actor_name, (_, _, actor_completed) in zip(actor_names, results)}
+    return verified_joint_rotation, completed
+
+
+@dataclasses.dataclass
+class LoopState:
+    """
+    State of the prompt loop shared by its commands.
+    """
+    encounter: Optional[Dict] = None
     current_actor_state: Optional[ActorState] = None
-    encounter: Dict = json.load(open("resources/encounter.json", "r"))
-    for actor in encounter["actors"]:
-        if "build" not in actor and "build_path" in actor:
-            actor["build"] = json.load(open(actor["build_path"]))
-        else:
-            print(f"Error: actor {actor} build or build_path not found")
-            encounter = None
-            break
-
-        if "rotation" not in actor and "rotation_path" in actor:
-            actor["rotation"] = json.load(open(actor["rotation_path"]))
-        elif "rotation" not in actor:
-            # Set a default empty rotation just for consistency
-            actor["rotation"] = {"skill_casts": []}
-    current_actor_state = get_actor_state_from_encounter(encounter)
-    current_actor_state.simulate_rotation(encounter["actors"][0]["rotation"])
-
+    rotation_trie: Optional[RotationTrie] = None
     latest_audit: Optional[Dict] = None
-    search_time: int = 30000  # Default search time is 10 seconds worth of simulation time
+    search_time: Optional[int] = 30000  # Default search time is 30 seconds worth of simulation time
     search_depth: Optional[int] = None
-    while True:
-        line = input()
-        words = line.split(" ")
-        if words[0] in ("exit", "quit", "q"):
-            break
-        elif words[0] == "set":
-            if len(words) < 2:
-                print("Usage: set <encounter/rotation/time/depth> <value(s)>")
-                continue
-            if words[1] == "encounter":
-                if len(words) < 3:
-                    print("Usage: set encounter <path>")
-                    print("Info: loading default encounter from resources/encounter.json")
-                    encounter = json.load(open("resources/encounter.json"))
-                else:
-                    encounter = json.load(open(words[2]))
-                for actor in encounter["actors"]:
-                    if "build" not in actor and "build_path" in actor:
-                        actor["build"] = json.load(open(actor["build_path"]))
-                    else:
-                        print(f"Error: actor {actor} build or build_path not found")
-                        encounter = None
-                        break
-
-                    if "rotation" not in actor and "rotation_path" in actor:
-                        actor["rotation"] = json.load(open(actor["rotation_path"]))
-                    elif "rotation" not in actor:
-                        # Set a default empty rotation just for consistency
-                        actor["rotation"] = {"skill_casts": []}
-                current_actor_state = get_actor_state_from_encounter(encounter)
-                current_actor_state.simulate_rotation(encounter["actors"][0]["rotation"])
-            elif words[1] == "rotation":
-                if len(words) < 3:
-                    print("Usage: set rotation <optional:actor> \"<skill>\" \"<skill>\" ...")
-                    continue
-                if encounter is None:
-                    print("Error: encounter not loaded")
-                    continue
-                actor = None
-                skills_offset = 2
-                for a in encounter["actors"]:
-                    if a["name"] == words[2]:
-                        actor = a
-                        skills_offset = 3
-                        break
-                if actor is None:
-                    print("Info: selecting first actor by default")
-                    actor = encounter["actors"][0]
-                rotation = {"skill_casts": []}
-                words = shlex.split(line)
-                for skill in words[skills_offset:]:
-                    if not skill:
-                        print("Warning: empty skill")
-                        continue
-                    rotation["skill_casts"].append({"skill": skill, "cast_time_ms": 0})
-                actor["rotation"] = rotation
-                current_actor_state = get_actor_state_from_encounter(encounter)
-                current_actor_state.simulate_rotation(encounter["actors"][0]["rotation"])
-            elif words[1] == "time":
-                if len(words) != 3:
-                    print("Usage: set time <time>")
-                    continue
-                try:
-                    search_time = int(words[2])
-                    if search_time <= 0:
-                        raise ValueError
-                except ValueError:
-                    print("Error: invalid value")
-                    search_time = None
-                    continue
-            elif words[1] == "depth":
-                if len(words) != 3:
-                    print("Usage: set depth <depth>")
-                    continue
-                try:
-                    search_depth = int(words[2])
-                    if search_depth <= 0:
-                        raise ValueError
-                except ValueError:
-                    print("Error: invalid value")
-                    search_depth = None
-                    continue
-        elif words[0] == "display":
-            if len(words) != 2:
-                print("Usage: display <encounter/rotation/actor <actor> <optional:rotation>/audit/time/depth>")
-                continue
-            if words[1] == "encounter":
-                print(json.dumps(encounter))
-            elif words[1] == "rotation":
+    latest_top_rotations: Optional[TopRotations] = None
+    # Trie node of the rotation the latest search to finish started after, its candidates continue it
+    latest_rotation_prefix: Optional[RotationTrieNode] = None
+    search_time_quantum: int = 1  # Time quantum of transposition table keys, above 1ms the search becomes approximate
+    # Probed actor state of the current build before any cast, never modified, and the probe encounter hash it is for
+    base_actor_state: Optional[ActorState] = None
+    build_key: Optional[str] = None
+    # Skills of the first actor's rotation replayed into current_actor_state, blocked casts included
+    replayed_skills: List[str] = dataclasses.field(default_factory=list)
+    jobs: JobRunner = dataclasses.field(default_factory=lambda: JobRunner(JOB_WORKERS))
+
+
+def update_actor_state(state: LoopState):
+    """
+    Brings current_actor_state up to date with the encounter. Skills are only probed again if something the probes
+    depend on changed, which is everything but the first actor's rotation. Otherwise the dynamic state is reset from
+    the base actor state and the rotation replayed, or, if the new rotation extends the replayed one, only the appended
+    skills are simulated on top of the current state. The rotation trie starts from the base actor state, so it is kept
+    as long as the build is.
+    """
+    # The probes replace the rotation, so the hash of the actor encounter with an empty one identifies the build
+    build_key = EncounterTemplate(get_actor_encounter(state.encounter)).get_hash(
+        rotation={"skill_casts": []}, server_version=SERVER_VERSION)
+    base_actor_state = state.base_actor_state
+    if build_key != state.build_key or base_actor_state is None:
+        try:
+            base_actor_state = get_actor_state_from_encounter(state.encounter)
+            state.base_actor_state = base_actor_state
+            state.build_key = build_key
+        except ProbeError as e:
+            # Not kept, the next update probes again
+            print(f"Warning: {e}, their damage is 0 until they are probed again")
+            base_actor_state = e.actor_state
+            state.base_actor_state = None
+            state.build_key = None
+        state.rotation_trie = RotationTrie(CompactActorState.from_actor_state(base_actor_state), ROTATION_TRIE_SIZE)
+        state.current_actor_state = None
+
+    skill_casts = [
+        skill_cast
+        for skill_cast
+        in state.encounter["actors"][0]["rotation"]["skill_casts"]
+        if str(skill_cast["skill"])
+    ]
+    skills = [str(skill_cast["skill"]) for skill_cast in skill_casts]
+    num_replayed = len(state.replayed_skills)
+    actor_state = state.current_actor_state
+    if actor_state is None or skills[:num_replayed] != state.replayed_skills:
+        actor_state = base_actor_state.clone()
+        num_replayed = 0
+    # Unset while replaying, a failed replay must not leave a partially replayed state behind to be extended
+    state.current_actor_state = None
+    actor_state.simulate_rotation({"skill_casts": skill_casts[num_replayed:]})
+    state.current_actor_state = actor_state
+    state.replayed_skills = skills
+
+
+async def execute_command(line: str, state: LoopState) -> bool:
+    """
+    Executes a single prompt loop command. Searches and simulations are started as background jobs.
+    :return: False if the loop should exit
+    """
+    global PROBE_WORKERS, SIMULATION_CLIENT
+
+    words = line.split(" ")
+    if words[0] in ("exit", "quit", "q"):
+        return False
+    elif words[0] == "set":
+        if len(words) < 2:
+            print("Usage: set <encounter/rotation/time/depth/quantum/workers/servers> <value(s)>")
+            return True
+        if words[1] == "encounter":
+            if len(words) < 3:
+                print("Usage: set encounter <path>")
+                print(f"Info: loading default encounter from {DEFAULT_ENCOUNTER}")
+                state.encounter = load_encounter(DEFAULT_ENCOUNTER)
+            else:
+                state.encounter = load_encounter(words[2])
+            if state.encounter is None:
+                state.current_actor_state = None
+                return True
+            # Probing talks to the server, off the event loop so that jobs keep reporting
+            await asyncio.get_running_loop().run_in_executor(None, update_actor_state, state)
+        elif words[1] == "rotation":
+            if len(words) < 3:
+                print("Usage: set rotation <optional:actor> \"<skill>\" \"<skill>\" ...")
+                return True
+            if state.encounter is None:
+                print("Error: encounter not loaded")
+                return True
+            actor = None
+            skills_offset = 2
+            for a in state.encounter["actors"]:
+                if a["name"] == words[2]:
+                    actor = a
+                    skills_offset = 3
+                    break
+            if actor is None:
                 print("Info: selecting first actor by default")
-                actor = encounter["actors"][0]
-                print(f"Info: rotation: {json.dumps(actor['rotation'])}")
-                simple_rotation = " ".join([
-                    f"\"{skill_cast['skill']}\""
-                    for skill_cast
-                    in actor['rotation']['skill_casts']
-                ])
-                print(f"Info: simple rotation: {simple_rotation}")
-            elif words[1] == "actor":
-                if len(words) < 3:
-                    print("Usage: display actor <actor> <optional:rotation>")
+                actor = state.encounter["actors"][0]
+            rotation = {"skill_casts": []}
+            words = shlex.split(line)
+            for skill in words[skills_offset:]:
+                if not skill:
+                    print("Warning: empty skill")
                     continue
-
-                actor = None
-                for a in encounter["actors"]:
-                    if a["name"] == words[2]:
-                        actor = a
-                        break
-                if actor is None:
-                    print("Error: actor not found")
-                    continue
-                if len(words) == 4:
-                    if words[3] == "rotation":
-                        print(json.dumps(actor["rotation"]))
-                        print(f"Info: rotation: {json.dumps(actor['rotation'])}")
-                        simple_rotation = " ".join([
-                            f"\"{skill_cast['skill']}\""
-                            for skill_cast
-                            in actor['rotation']['skill_casts']
-                        ])
-                        print(f"Info: simple rotation: {simple_rotation}")
-                    else:
-                        print("Usage: display actor <actor> <optional:rotation>")
+                rotation["skill_casts"].append({"skill": skill, "cast_time_ms": 0})
+            actor["rotation"] = rotation
+            await asyncio.get_running_loop().run_in_executor(None, update_actor_state, state)
+        elif words[1] == "time":
+            if len(words) != 3:
+                print("Usage: set time <time>")
+                return True
+            try:
+                state.search_time = int(words[2])
+                if state.search_time <= 0:
+                    raise ValueError
+            except ValueError:
+                print("Error: invalid value")
+                state.search_time = None
+                return True
+        elif words[1] == "quantum":
+            if len(words) != 3:
+                print("Usage: set quantum <time quantum>")
+                return True
+            try:
+                quantum = int(words[2])
+                if quantum <= 0:
+                    raise ValueError
+            except ValueError:
+                print("Error: invalid value")
+                return True
+            state.search_time_quantum = quantum
+        elif words[1] == "workers":
+            if len(words) != 3:
+                print("Usage: set workers <workers>")
+                return True
+            try:
+                workers = int(words[2])
+                if workers <= 0:
+                    raise ValueError
+            except ValueError:
+                print("Error: invalid value")
+                return True
+            PROBE_WORKERS = workers
+        elif words[1] == "servers":
+            if len(words) < 3:
+                print("Usage: set servers <host:port> <host:port> ...")
+                return True
+            try:
+                endpoints = [parse_endpoint(endpoint) for endpoint in words[2:] if endpoint]
+            except ValueError:
+                print("Error: invalid value")
+                return True
+            SIMULATION_CLIENT.close()
+            SIMULATION_CLIENT = ShardedSimulationClient(endpoints)
+        elif words[1] == "depth":
+            if len(words) != 3:
+                print("Usage: set depth <depth>")
+                return True
+            try:
+                state.search_depth = int(words[2])
+                if state.search_depth <= 0:
+                    raise ValueError
+            except ValueError:
+                print("Error: invalid value")
+                state.search_depth = None
+                return True
+    elif words[0] == "display":
+        if len(words) != 2:
+            print("Usage: display <encounter/rotation/actor <actor> <optional:rotation>/audit/time/depth/quantum/"
+                  "workers/client/servers/cache/stats>")
+            return True
+        if words[1] == "encounter":
+            print(json.dumps(state.encounter))
+        elif words[1] == "rotation":
+            print("Info: selecting first actor by default")
+            actor = state.encounter["actors"][0]
+            print(f"Info: rotation: {json.dumps(actor['rotation'])}")
+            simple_rotation = " ".join([
+                f"\"{skill_cast['skill']}\""
+                for skill_cast
+                in actor['rotation']['skill_casts']
+            ])
+            print(f"Info: simple rotation: {simple_rotation}")
+        elif words[1] == "actor":
+            if len(words) < 3:
+                print("Usage: display actor <actor> <optional:rotation>")
+                return True
+
+            actor = None
+            for a in state.encounter["actors"]:
+                if a["name"] == words[2]:
+                    actor = a
+                    break
+            if actor is None:
+                print("Error: actor not found")
+                return True
+            if len(words) == 4:
+                if words[3] == "rotation":
+                    print(json.dumps(actor["rotation"]))
+                    print(f"Info: rotation: {json.dumps(actor['rotation'])}")
+                    simple_rotation = " ".join([
+                        f"\"{skill_cast['skill']}\""
+                        for skill_cast
+                        in actor['rotation']['skill_casts']
+                    ])
+                    print(f"Info: simple rotation: {simple_rotation}")
                 else:
-                    print(json.dumps(actor))
-            elif words[1] == "audit":
-                if latest_audit is None:
-                    print("Error: no simulations run yet")
-                    continue
-                print(json.dumps(latest_audit))
-            elif words[1] == "time":
-                if search_time is None:
-                    print("Error: search time not set")
-                    continue
-                print(search_time)
-            elif words[1] == "depth":
-                if search_depth is None:
-                    print("Error: search depth not set")
-                    continue
-                print(search_depth)
-        elif words[0] == "simulate":
-            if encounter is None:
-                print("Error: encounter not loaded")
-                continue
-            simulation_encounter = copy.deepcopy(encounter)
-            simulation_encounter["termination_conditions"].append({"type": "TIME", "time": search_time})
-            latest_audit = simulate(simulation_encounter)
-            print(json.dumps(latest_audit))
-        elif words[0] == "search":
-            if encounter is None:
-                print("Error: encounter not loaded")
-                continue
-            if search_time is None:
-                print("Error: search time not set")
-                continue
-            if len(words) != 2:
-                print("Usage: search <greedy>")
-                continue
-            if current_actor_state is None:
-                copy_actor_state = get_actor_state_from_encounter(encounter)
+                    print("Usage: display actor <actor> <optional:rotation>")
             else:
-                copy_actor_state = copy.deepcopy(current_actor_state)
-            if words[1] == "greedy":
-                total_damage, best_skill_sequence = search_greedy(copy_actor_state, search_time, search_depth)
+                print(json.dumps(actor))
+        elif words[1] == "audit":
+            if state.latest_audit is None:
+                print("Error: no simulations run yet")
+                return True
+            print(json.dumps(state.latest_audit))
+        elif words[1] == "time":
+            if state.search_time is None:
+                print("Error: search time not set")
+                return True
+            print(state.search_time)
+        elif words[1] == "depth":
+            if state.search_depth is None:
+                print("Error: search depth not set")
+                return True
+            print(state.search_depth)
+        elif words[1] == "quantum":
+            print(state.search_time_quantum)
+        elif words[1] == "workers":
+            print(PROBE_WORKERS)
+        elif words[1] == "cache":
+            for cache_name, cache in (("skill simulation", SKILL_SIMULATION_CACHE),
+                                      ("verified rotation", VERIFIED_ROTATION_CACHE)):
+                stats = cache.stats
+                print(f"Info: {cache_name} cache entries: {len(cache)}/{cache.max_entries}")
+                print(f"Info: hits: {stats.hits} misses: {stats.misses} evictions: {stats.evictions} "
+                      f"hit rate: {stats.hit_rate:.2%}")
+        elif words[1] == "servers":
+            health = await asyncio.get_running_loop().run_in_executor(None, SIMULATION_CLIENT.check_health)
+            for index, client in enumerate(SIMULATION_CLIENT.clients):
+                endpoint_stats = SIMULATION_CLIENT.endpoint_stats[index]
+                print(f"Info: {client.host}:{client.port} healthy: {health[index]} "
+                      f"requests: {client.stats.requests} outstanding: {endpoint_stats.outstanding} "
+                      f"failures: {endpoint_stats.failures} retries: {endpoint_stats.retries} "
+                      f"mean latency ms: {client.stats.mean_latency * 1000:.2f} "
+                      f"throughput: {SIMULATION_CLIENT.get_throughput(index):.1f} requests/s")
+        elif words[1] == "stats":
+            histograms = INSTRUMENTATION.get_histograms()
+            if not histograms:
+                print("Info: no stages timed yet")
+            for name, histogram in histograms.items():
+                print(f"Info: {name}: count {histogram.count} total {histogram.total * 1000:.2f}ms "
+                      f"mean {histogram.mean * 1000:.3f}ms "
+                      f"p50 {histogram.get_percentile(50) * 1000:.3f}ms "
+                      f"p95 {histogram.get_percentile(95) * 1000:.3f}ms "
+                      f"p99 {histogram.get_percentile(99) * 1000:.3f}ms "
+                      f"max {histogram.max * 1000:.3f}ms")
+        elif words[1] == "client":
+            stats = SIMULATION_CLIENT.stats
+            print("Info: servers: " + ", ".join(
+                f"{client.host}:{client.port}" for client in SIMULATION_CLIENT.clients))
+            print(f"Info: persistent connections: {SIMULATION_CLIENT.persistent}")
+            print(f"Info: requests: {stats.requests} (one-shot: {stats.one_shot_requests})")
+            print(f"Info: connections opened: {stats.connections_opened}")
+            print(f"Info: latency ms: last {stats.last_latency * 1000:.2f} "
+                  f"mean {stats.mean_latency * 1000:.2f} max {stats.max_latency * 1000:.2f}")
+    elif words[0] == "stats":
+        if len(words) < 2 or words[1] not in ("reset", "export") or (words[1] == "export" and len(words) != 3):
+            print("Usage: stats <reset/export <path>>")
+            return True
+        if words[1] == "reset":
+            INSTRUMENTATION.reset()
+        else:
+            INSTRUMENTATION.export(words[2])
+            print(f"Info: stage timings exported to {words[2]}")
+    elif words[0] == "profile":
+        if len(words) < 2:
+            print("Usage: profile <command>")
+            return True
+        return await profile_command(line[len("profile "):], state)
+    elif words[0] == "cache":
+        if len(words) != 2 or words[1] not in ("clear", "save"):
+            print("Usage: cache <clear/save>")
+            return True
+        if words[1] == "clear":
+            SKILL_SIMULATION_CACHE.clear()
+            VERIFIED_ROTATION_CACHE.clear()
+            # The base actor state holds probe results, the next search or set probes again
+            state.base_actor_state = None
+            state.build_key = None
+            shutil.rmtree(GENETIC_CHECKPOINT_DIRECTORY, ignore_errors=True)
+            print("Info: skill simulation and verified rotation caches and genetic search checkpoints cleared")
+        elif words[1] == "save":
+            SKILL_SIMULATION_CACHE.save()
+            VERIFIED_ROTATION_CACHE.save()
+    elif words[0] == "simulate":
+        if state.encounter is None:
+            print("Error: encounter not loaded")
+            return True
+        if len(words) > 2 or (len(words) == 2 and words[1] != "damage"):
+            print("Usage: simulate <optional:damage>")
+            return True
+        # The request is rendered now, later changes to the encounter don't affect the job
+        encounter_template = EncounterTemplate(state.encounter)
+        termination_conditions = [{"type": "TIME", "time": state.search_time}]
+        if len(words) == 2:
+            # Stream only the damage audit and print the aggregated damage instead of the full audit
+            damage_request = encounter_template.render(
+                termination_conditions=termination_conditions, audits=PROBE_AUDITS)
+
+            def print_damage_summary(damage_summary: DamageSummary):
+                for actor_name, damage in damage_summary.damage_by_actor.items():
+                    print(f"Info: damage taken by {actor_name}: {damage}")
+                for (actor_name, source_actor, source_skill), damage in damage_summary.damage_by_source.items():
+                    last_damage_time_ms = damage_summary.last_damage_time_ms_by_source[
+                        (actor_name, source_actor, source_skill)]
+                    print(f"Info: {source_actor} \"{source_skill}\" -> {actor_name}: {damage} "
+                          f"(last hit at {last_damage_time_ms}ms)")
+
+            state.jobs.start("simulate damage", lambda: simulate_damage(damage_request), print_damage_summary)
+            return True
+        request = encounter_template.render(termination_conditions=termination_conditions)
+
+        def set_latest_audit(audit: Dict):
+            state.latest_audit = audit
+            print(json.dumps(state.latest_audit))
+
+        state.jobs.start("simulate", lambda: simulate(request), set_latest_audit)
+    elif words[0] == "search":
+        if state.encounter is None:
+            print("Error: encounter not loaded")
+            return True
+        if state.search_time is None:
+            print("Error: search time not set")
+            return True
+        try:
+            parsed_search = parse_search_arguments(words[1:])
+        except ValueError:
+            print("Error: invalid value")
+            return True
+        if parsed_search is None:
+            print(f"Usage: search {SEARCH_USAGE}")
+            return True
+        algorithm, search_arguments = parsed_search
+        search_argument: Optional[int] = search_arguments[0] if search_arguments else None
+        # Without a base actor state the latest probes failed, they are retried before searching
+        if state.current_actor_state is None or state.base_actor_state is None:
+            await asyncio.get_running_loop().run_in_executor(None, update_actor_state, state)
+        # The search runs on its own copy, the actor state may change while it runs
+        actor_state = state.current_actor_state.clone()
+        rotation_prefix = state.rotation_trie.evaluate(state.replayed_skills)
+        search_time = state.search_time
+        search_depth = state.search_depth
+        search_stats = SearchStats()
+        transposition_table = TranspositionTable(TRANSPOSITION_TABLE_SIZE, state.search_time_quantum)
+        top_rotations = TopRotations(TOP_ROTATIONS_SIZE)
+
+        def print_search_result(result: (int, Dict)):
+            total_damage, best_skill_sequence = result
+            # Verification uses the top rotations of the latest search to finish
+            state.latest_top_rotations = top_rotations
+            state.latest_rotation_prefix = rotation_prefix
+            if algorithm == "greedy":
                 print("Info: greedy search")
-                print(f"Info: total damage: {total_damage}")
-                print(f"Info: rotation: {json.dumps(best_skill_sequence)}")
+            elif algorithm == "beam":
+                print(f"Info: beam search with width {search_argument}")
+            elif algorithm == "genetic":
+                print(f"Info: genetic search with {search_arguments[0]} generations of {search_arguments[1]} "
+                      f"rotations on {GENETIC_WORKERS} worker processes")
+            else:
+                print(f"Info: branch and bound search with node limit {search_argument or BNB_NODE_LIMIT}")
+            if not search_stats.completed:
+                print("Info: search stopped early, the rotation may not be optimal")
+            print(f"Info: total damage: {total_damage}")
+            print(f"Info: rotation: {json.dumps(best_skill_sequence)}")
+            simple_rotation = " ".join([
+                f"\"{skill_cast['skill']}\""
+                for skill_cast
+                in best_skill_sequence['skill_casts']
+            ])
+            print(f"Info: simple rotation: {simple_rotation}")
+            if search_stats.evaluations > 0:
+                print(f"Info: rotations evaluated: {search_stats.evaluations} "
+                      f"({search_stats.evaluations_per_second:.0f} evaluations/s in {search_stats.elapsed:.2f}s)")
+            else:
+                print(f"Info: nodes expanded: {search_stats.nodes_expanded} "
+                      f"({search_stats.nodes_per_second:.0f} nodes/s in {search_stats.elapsed:.2f}s)")
+            if transposition_table.stats.lookups > 0:
+                print(f"Info: transposition table: {len(transposition_table)} entries, "
+                      f"hit rate {transposition_table.stats.hit_rate:.2%}, "
+                      f"{transposition_table.stats.prunes} subtrees pruned")
+
+        # Genetic searches resume from the checkpoint of a previous search with the same state and parameters
+        state.jobs.start(
+            line,
+            lambda: run_search(
+                actor_state, algorithm, search_arguments, search_time, search_depth, search_stats,
+                transposition_table, top_rotations, GENETIC_CHECKPOINT_DIRECTORY),
+            print_search_result,
+            search_stats)
+    elif words[0] == "optimize":
+        if state.encounter is None:
+            print("Error: encounter not loaded")
+            return True
+        if state.search_time is None:
+            print("Error: search time not set")
+            return True
+        try:
+            parsed_search = parse_search_arguments(words[1:])
+        except ValueError:
+            print("Error: invalid value")
+            return True
+        if parsed_search is None:
+            print(f"Usage: optimize {SEARCH_USAGE}")
+            return True
+        algorithm, search_arguments = parsed_search
+        search_time = state.search_time
+        search_depth = state.search_depth
+        search_time_quantum = state.search_time_quantum
+        encounter = snapshot_encounter(state.encounter)
+
+        def print_optimize_result(result: Tuple[VerifiedJointRotation, Dict[str, bool]]):
+            verified_joint_rotation, completed = result
+            if verified_joint_rotation.cached:
+                print("Info: joint simulation from cache")
+            for actor_name, rotation in verified_joint_rotation.rotations.items():
+                if not completed[actor_name]:
+                    print(f"Info: search of {actor_name} stopped early, the rotation may not be optimal")
                 simple_rotation = " ".join([
                     f"\"{skill_cast['skill']}\""
                     for skill_cast
-                    in best_skill_sequence['skill_casts']
+                    in rotation['skill_casts']
                 ])
-                print(f"Info: simple rotation: {simple_rotation}")
-        else:
-            print("Usage: set/display/simulate/search/exit")
+                print(f"Info: {actor_name} audited damage: {verified_joint_rotation.audited_damage[actor_name]} "
+                      f"(static damage: {verified_joint_rotation.static_damage[actor_name]}) "
+                      f"rotation: {simple_rotation}")
+            print(f"Info: total audited damage: {sum(verified_joint_rotation.audited_damage.values())}")
+
+        # Actor searches run in processes that can't be interrupted, cancelling only drops the result
+        state.jobs.start(
+            line,
+            lambda: optimize_actors(
+                encounter, algorithm, search_arguments, search_time, search_depth, search_time_quantum),
+            print_optimize_result)
+    elif words[0] == "evaluate":
+        if len(words) < 2:
+            print("Usage: evaluate <optional:audit> \"<skill>\" \"<skill>\" ...")
+            return True
+        if state.encounter is None:
+            print("Error: encounter not loaded")
+            return True
+        words = shlex.split(line)
+        audit = words[1] == "audit"
+        skill_keys = [skill for skill in words[2 if audit else 1:] if skill]
+        if state.base_actor_state is None:
+            await asyncio.get_running_loop().run_in_executor(None, update_actor_state, state)
+        unknown_skills = [skill for skill in skill_keys if skill not in state.current_actor_state.skill_states]
+        if unknown_skills:
+            print(f"Error: unknown skills: {unknown_skills}")
+            return True
+
+        # Rotations are evaluated from time zero, sharing every prefix evaluated before
+        node = state.rotation_trie.evaluate(skill_keys)
+        print(f"Info: rotation: {json.dumps(node.get_rotation())}")
+        print(f"Info: static damage: {node.static_damage}")
+        print(f"Info: end time: {node.time}")
+        trie_stats = state.rotation_trie.stats
+        print(f"Info: prefix trie: {len(state.rotation_trie)} nodes, {trie_stats.reused_nodes} reused, "
+              f"{trie_stats.simulated_nodes} simulated, {trie_stats.evictions} evicted")
+        if audit:
+            encounter = snapshot_encounter(state.encounter)
+            search_time = state.search_time
+            rotations = [(node.static_damage, node.get_rotation())]
+
+            def print_audited_damage(verified_rotations: List[VerifiedRotation]):
+                print(f"Info: audited damage: {verified_rotations[0].audited_damage}"
+                      f"{' (from cache)' if verified_rotations[0].cached else ''}")
+
+            # The verified rotation cache is keyed by the whole encounter, including the time and the other actors
+            state.jobs.start(
+                line,
+                lambda: verify_rotations(
+                    encounter, rotations, SIMULATION_CLIENT, VERIFIED_ROTATION_CACHE, search_time, PROBE_AUDITS,
+                    SERVER_VERSION),
+                print_audited_damage)
+    elif words[0] == "verify":
+        if len(words) != 2:
+            print("Usage: verify <number of rotations>")
+            return True
+        try:
+            num_rotations = int(words[1])
+            if num_rotations <= 0:
+                raise ValueError
+        except ValueError:
+            print("Error: invalid value")
+            return True
+        if state.latest_top_rotations is None or len(state.latest_top_rotations) == 0:
+            print("Error: no searches run yet")
+            return True
+        encounter = snapshot_encounter(state.encounter)
+        search_time = state.search_time
+        # The candidates continue the rotation set when the search started, the server simulates it from the start
+        rotations = prepend_rotation_prefix(
+            state.latest_rotation_prefix, state.latest_top_rotations.get_rotations()[:num_rotations])
+
+        def print_verified_rotations(verified_rotations: List[VerifiedRotation]):
+            num_cached = sum(1 for verified_rotation in verified_rotations if verified_rotation.cached)
+            print(f"Info: verified {len(verified_rotations)} rotations ({num_cached} from cache)")
+            for rank, verified_rotation in enumerate(verified_rotations, start=1):
+                simple_rotation = " ".join([
+                    f"\"{skill_cast['skill']}\""
+                    for skill_cast
+                    in verified_rotation.rotation['skill_casts']
+                ])
+                print(f"Info: #{rank} audited damage: {verified_rotation.audited_damage} "
+                      f"(static damage: {verified_rotation.static_damage}) rotation: {simple_rotation}")
+
+        state.jobs.start(
+            line,
+            lambda: verify_rotations(
+                encounter, rotations, SIMULATION_CLIENT, VERIFIED_ROTATION_CACHE, search_time, PROBE_AUDITS,
+                SERVER_VERSION),
+            print_verified_rotations)
+    elif words[0] == "jobs":
+        if not state.jobs.jobs:
+            print("Info: no jobs started yet")
+        for job in state.jobs.jobs.values():
+            best_damage = ""
+            if job.stats is not None and job.stats.best_rotation:
+                best_damage = f", best{' so far' if job.status == 'running' else ''}: {job.stats.best_damage} damage"
+            print(f"Info: job {job.id} ({job.description}): {job.status} after {job.elapsed:.2f}s{best_damage}")
+    elif words[0] in ("cancel", "wait"):
+        if len(words) != 2:
+            print(f"Usage: {words[0]} <job id>")
+            return True
+        try:
+            job_id = int(words[1])
+        except ValueError:
+            print("Error: invalid value")
+            return True
+        if words[0] == "cancel" and not state.jobs.cancel(job_id):
+            print(f"Error: no running job {job_id}")
+        elif words[0] == "wait" and not await state.jobs.wait(job_id):
+            print(f"Error: no job {job_id}")
+    else:
+        print("Usage: set/display/simulate/search/optimize/evaluate/verify/jobs/cancel/wait/cache/profile/stats/exit")
+    return True
+
+
+async def profile_command(line: str, state: LoopState) -> bool:
+    """
+    Executes a command under cProfile and tracemalloc, prints the most expensive functions and allocations and saves
+    both profiles to PROFILE_OUTPUT and PROFILE_MEMORY_OUTPUT for offline analysis. Jobs started by the command run in
+    the foreground so that the profile covers them.
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    state.jobs.background = False
+    try:
+        return await execute_command(line, state)
+    finally:
+        state.jobs.background = True
+        profiler.disable()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        os.makedirs(os.path.dirname(PROFILE_OUTPUT), exist_ok=True)
+        profiler.dump_stats(PROFILE_OUTPUT)
+        snapshot.dump(PROFILE_MEMORY_OUTPUT)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        for statistic in snapshot.statistics("lineno")[:PROFILE_TOP]:
+            print(f"Info: allocated {statistic}")
+        print(f"Info: peak traced memory: {peak_memory / 1024:.1f}KB")
+        print(f"Info: profile saved to {PROFILE_OUTPUT}, allocations saved to {PROFILE_MEMORY_OUTPUT}")
+
+
+async def loop():
+    print("Info: available commands - "
+          "set/display/simulate/search/optimize/evaluate/verify/jobs/cancel/wait/cache/profile/stats/exit")
+
+    # Setup a default encounter
+    state = LoopState()
+    state.encounter = load_encounter(DEFAULT_ENCOUNTER)
+    update_actor_state(state)
+
+    event_loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Read on a thread so that jobs keep reporting while the prompt waits for input
+            try:
+                line = await event_loop.run_in_executor(None, input)
+            except EOFError:
+                break
+            if not await execute_command(line, state):
+                break
+    finally:
+        await state.jobs.close()
 
 
 def main():
-    loop()
+    try:
+        asyncio.run(loop())
+    finally:
+        SKILL_SIMULATION_CACHE.save()
+        VERIFIED_ROTATION_CACHE.save()
+        SIMULATION_CLIENT.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import json
+import socketserver
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+from build import WEAPON_SWAP
+
+# Pending connections accepted by the listening socket, one-shot batches open a connection per request at once
+LISTEN_BACKLOG = 128
+
+
+def synthetic_audit(encounter: Dict) -> Dict:
+    """
+    Deterministic stand-in for a gw2combat audit: every skill cast by an actor other than the last one deals a fixed
+    amount of damage, derived from the skill key, to the last actor in the encounter. Weapon swaps take time but deal
+    no damage.
+    """
+    target_actor = encounter["actors"][-1]
+    tick_events = []
+    for source_actor in encounter["actors"][:-1]:
+        time_ms = 0
+        for skill_cast in source_actor.get("rotation", {}).get("skill_casts", []):
+            skill_key = str(skill_cast["skill"])
+            time_ms = max(time_ms, int(skill_cast.get("cast_time_ms", 0)))
+            if skill_key == WEAPON_SWAP:
+                time_ms += 500
+                continue
+            tick_events.append({
+                "time_ms": time_ms,
+                "actor": target_actor["name"],
+                "event": {
+                    "event_type": "damage_event",
+                    "source_actor": source_actor["name"],
+                    "source_skill": skill_key,
+                    "damage": 100 + zlib.crc32(skill_key.encode("utf-8")) % 9900,
+                },
+            })
+            time_ms += 500
+    tick_events.sort(key=lambda tick_event: tick_event["time_ms"])
+    return {"tick_events": tick_events}
+
+
+class MockSimulationServer(object):
+    """
+    Local stand-in for `gw2combat --server`. Reads newline-terminated encounters and writes newline-terminated audits.
+    If persistent is False the connection is closed after the first response, like the real server.
+    """
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 persistent: bool = True,
+                 latency: float = 0.0,
+                 handler: Callable[[Dict], Dict] = synthetic_audit):
+        self.persistent = persistent
+        self.latency = latency
+        self.handler = handler
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        server = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    with server._lock:
+                        server.requests += 1
+                    if server.latency > 0:
+                        time.sleep(server.latency)
+                    audit = server.handler(json.loads(line))
+                    self.wfile.write((json.dumps(audit) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                    if not server.persistent:
+                        break
+
+        self._server = socketserver.ThreadingTCPServer((host, port), RequestHandler, bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.request_queue_size = LISTEN_BACKLOG
+        self._server.server_bind()
+        self._server.server_activate()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[0], self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
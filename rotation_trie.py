@@ -0,0 +1,100 @@
+import collections
+import dataclasses
+from typing import Dict, List, Optional, Sequence
+
+from compact_actor_state import AnyActorState
+
+
+class RotationTrieNode(object):
+    __slots__ = ("skill_key", "parent", "children", "actor_state", "time", "executed", "static_damage")
+
+    def __init__(self,
+                 skill_key: Optional[str],
+                 parent: Optional["RotationTrieNode"],
+                 actor_state: AnyActorState,
+                 time: int,
+                 executed: bool,
+                 static_damage: int):
+        self.skill_key = skill_key
+        self.parent = parent
+        self.children: Dict[str, RotationTrieNode] = {}
+        self.actor_state = actor_state
+        self.time = time
+        self.executed = executed
+        self.static_damage = static_damage
+
+    def get_rotation(self) -> Dict:
+        """
+        The rotation leading to this node with the cast times of the executed skills, blocked casts are dropped.
+        """
+        skill_casts = []
+        node = self
+        while node.parent is not None:
+            if node.executed:
+                skill_casts.append({"skill": node.skill_key, "cast_time_ms": node.parent.time})
+            node = node.parent
+        skill_casts.reverse()
+        return {"skill_casts": skill_casts}
+
+
+@dataclasses.dataclass
+class RotationTrieStats:
+    reused_nodes: int = 0
+    simulated_nodes: int = 0
+    evictions: int = 0
+
+
+class RotationTrie(object):
+    """
+    Trie of evaluated rotation prefixes. Every node keeps a snapshot of the actor state after its prefix, the elapsed
+    time and the cumulative static damage, so evaluating a rotation only simulates the part after its longest known
+    prefix. Audited damage is not stored, it also depends on the termination conditions and the other actors of the
+    encounter, which the trie is kept across.
+
+    The number of nodes is bounded by evicting the least recently used leaves. Nodes are touched from leaf to root, so
+    a node is always more recent than its descendants and the least recently used node is always a leaf.
+    """
+
+    def __init__(self, actor_state: AnyActorState, max_nodes: int = 100000):
+        self.root = RotationTrieNode(None, None, actor_state.clone(), 1, False, 0)
+        self.max_nodes = max_nodes
+        self.stats = RotationTrieStats()
+        self._nodes: "collections.OrderedDict[int, RotationTrieNode]" = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def evaluate(self, skill_keys: Sequence[str]) -> RotationTrieNode:
+        node = self.root
+        path: List[RotationTrieNode] = []
+        for skill_key in skill_keys:
+            child = node.children.get(skill_key)
+            if child is not None:
+                self.stats.reused_nodes += 1
+            else:
+                self.stats.simulated_nodes += 1
+                actor_state = node.actor_state.clone()
+                time_delta, executed_skill = actor_state.simulate(skill_key)
+                static_damage = node.static_damage
+                if executed_skill is not None:
+                    static_damage += actor_state.skill_states[skill_key].skill_simulation_data.total_damage
+                child = RotationTrieNode(
+                    skill_key, node, actor_state, node.time + time_delta, executed_skill is not None, static_damage)
+                node.children[skill_key] = child
+            path.append(child)
+            node = child
+
+        for path_node in reversed(path):
+            self._nodes[id(path_node)] = path_node
+            self._nodes.move_to_end(id(path_node))
+        self._evict(keep=node)
+        return node
+
+    def _evict(self, keep: RotationTrieNode):
+        while len(self._nodes) > self.max_nodes:
+            _, node = self._nodes.popitem(last=False)
+            if node is keep:
+                self._nodes[id(node)] = node
+                break
+            del node.parent.children[node.skill_key]
+            self.stats.evictions += 1
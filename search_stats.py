@@ -0,0 +1,56 @@
+import dataclasses
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+@dataclasses.dataclass
+class SearchStats:
+    """
+    Counters of a search, also used to control it while it runs on another thread: cancel() asks the search to stop
+    at its next check and return the best rotation found so far with completed set to False, and every new best
+    rotation is offered to on_improvement.
+    """
+    nodes_expanded: int = 0
+    idle_steps: int = 0
+    evaluations: int = 0
+    completed: bool = True
+    start_time: float = dataclasses.field(default_factory=time.perf_counter)
+    end_time: float = 0.0
+    best_damage: int = 0
+    best_rotation: List[Dict] = dataclasses.field(default_factory=list)
+    on_improvement: Optional[Callable[["SearchStats"], None]] = None
+    _cancel_event: threading.Event = dataclasses.field(default_factory=threading.Event, repr=False)
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def offer(self, total_damage: int, rotation: List[Dict]):
+        """
+        Records the rotation if it is the best so far.
+        """
+        if total_damage <= self.best_damage and self.best_rotation:
+            return
+        self.best_damage = total_damage
+        self.best_rotation = rotation
+        if self.on_improvement is not None:
+            self.on_improvement(self)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end_time if self.end_time > 0.0 else time.perf_counter()) - self.start_time
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.nodes_expanded / self.elapsed if self.elapsed > 0.0 else 0.0
+
+    @property
+    def evaluations_per_second(self) -> float:
+        return self.evaluations / self.elapsed if self.elapsed > 0.0 else 0.0
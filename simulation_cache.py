@@ -0,0 +1,99 @@
+import collections
+import dataclasses
+import json
+import os
+import threading
+from typing import Any, Optional
+
+CACHE_FORMAT_VERSION = 2
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+
+class SimulationCache(object):
+    """
+    Size-bounded LRU cache of JSON-serializable simulation results keyed by content hash, optionally persisted to a
+    JSON file. Entries are written in LRU order so that the recency survives a restart.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 4096):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._entries: "collections.OrderedDict[str, Any]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Held while writing the file, concurrent saves share the temporary file and must not overtake each other
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        if path is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+            self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+        self.save()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable cache {self.path}: {e}")
+            return
+        if data.get("version") != CACHE_FORMAT_VERSION:
+            print(f"Info: ignoring cache {self.path} with incompatible version {data.get('version')}")
+            return
+        with self._lock:
+            for key, value in data["entries"][-self.max_entries:]:
+                self._entries[key] = value
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {"version": CACHE_FORMAT_VERSION, "entries": list(self._entries.items())}
+                self._dirty = False
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as cache_file:
+                json.dump(data, cache_file)
+            os.replace(temporary_path, self.path)
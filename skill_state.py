@@ -1,4 +1,6 @@
+import bisect
 import dataclasses
+from array import array
 
 from weapon_type import WeaponType
 
@@ -7,6 +9,27 @@ from weapon_type import WeaponType
 class SkillSimulationData:
     total_damage: int
     time_for_full_damage: int
+    # Cumulative damage of a cast by time since the cast, damage_profile[i] is the damage dealt within
+    # damage_profile_offsets[i] ms. An empty profile credits the total damage at the cast
+    damage_profile_offsets: array = dataclasses.field(default_factory=lambda: array("q"))
+    damage_profile: array = dataclasses.field(default_factory=lambda: array("q"))
+
+    @property
+    def full_damage_offset(self) -> int:
+        """
+        Time since the cast after which get_damage_until no longer truncates the damage.
+        """
+        return self.damage_profile_offsets[-1] if self.damage_profile_offsets else 0
+
+    def get_damage_until(self, time: int) -> int:
+        """
+        :return: damage dealt within `time` ms of the cast, used to score casts that the fight end truncates
+        """
+        offsets = self.damage_profile_offsets
+        if not offsets or time >= offsets[-1]:
+            return self.total_damage
+        index = bisect.bisect_right(offsets, time)
+        return self.damage_profile[index - 1] if index > 0 else 0
 
 
 class SkillState:
@@ -29,3 +52,13 @@ class SkillState:
         self.score_per_cast_time = (score / cast_duration) if cast_duration > 0.0 else score
         self.current_cooldown = 0
         self.current_ammo = max_ammo
+
+    def get_score_per_cast_time_until(self, time: int) -> float:
+        """
+        score_per_cast_time of a cast whose damage is truncated after `time` ms, scaled by the share of its damage that
+        is still dealt.
+        """
+        total_damage = self.skill_simulation_data.total_damage
+        if total_damage <= 0:
+            return self.score_per_cast_time
+        return self.score_per_cast_time * self.skill_simulation_data.get_damage_until(time) / total_damage
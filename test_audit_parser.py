@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from audit_parser import AuditStreamParser, summarize_audit
+
+AUDIT = {
+    "version": "1.0",
+    "tick_events": [
+        {
+            "time_ms": 1,
+            "actor": "golem",
+            "event": {"event_type": "damage_event", "source_actor": "lb-slb", "source_skill": "Rapid Fire",
+                      "damage": 1.25e3},
+        },
+        {"time_ms": 250, "actor": "lb-slb", "event": {"event_type": "effect_event", "effect": "Fury é"}},
+        {
+            "time_ms": 12345,
+            "actor": "golem",
+            "event": {"event_type": "damage_event", "source_actor": "lb-slb", "source_skill": "Barrage",
+                      "damage": -0.5E-2},
+        },
+    ],
+    "offset": 10,
+    "ratio": 2.5e+10,
+}
+
+
+def parse_in_chunks(audit_bytes: bytes, chunk_sizes):
+    tick_events = []
+    parser = AuditStreamParser(tick_events.append)
+    offset = 0
+    for chunk_size in chunk_sizes:
+        parser.feed(audit_bytes[offset:offset + chunk_size])
+        offset += chunk_size
+    parser.feed(audit_bytes[offset:])
+    parser.close()
+    return parser, tick_events
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_every_split_point_gives_the_same_result(indent):
+    audit_bytes = json.dumps(AUDIT, indent=indent, ensure_ascii=False).encode("utf-8")
+    # Splits land inside keys, strings, multi-byte characters and numbers, including mid-exponent
+    for split in range(len(audit_bytes) + 1):
+        parser, tick_events = parse_in_chunks(audit_bytes, [split])
+        assert tick_events == AUDIT["tick_events"], split
+        assert parser.members == {"version": "1.0", "offset": 10, "ratio": 2.5e+10}, split
+        assert parser.num_tick_events == 3
+        assert parser.done
+
+
+def test_byte_by_byte():
+    audit_bytes = json.dumps(AUDIT).encode("utf-8")
+    parser, tick_events = parse_in_chunks(audit_bytes, [1] * len(audit_bytes))
+    assert tick_events == AUDIT["tick_events"]
+    assert summarize_audit(AUDIT).damage_by_actor == {"golem": 1.25e3 - 0.5E-2}
+
+
+def test_trailing_number_is_completed_by_close():
+    parser = AuditStreamParser(lambda tick_event: None)
+    parser.feed(b'{"tick_events": [], "offset": 1')
+    assert not parser.done
+    parser.feed(b'0}')
+    parser.close()
+    assert parser.members == {"offset": 10}
+
+
+@pytest.mark.parametrize("truncated", [
+    b"",
+    b'{"tick_events": [',
+    b'{"tick_events": [{"time_ms": 1',
+    b'{"tick_events": [], "offset": 1.5e',
+    b'{"tick_events": [], "version": "1.',
+    b'{"tick_events": []',
+])
+def test_truncated_audit_raises_on_close(truncated):
+    parser = AuditStreamParser(lambda tick_event: None)
+    parser.feed(truncated)
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_malformed_audit_raises():
+    parser = AuditStreamParser(lambda tick_event: None)
+    with pytest.raises(ValueError):
+        parser.feed(b'["tick_events"]')
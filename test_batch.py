@@ -0,0 +1,80 @@
+import io
+import json
+import os
+
+import pytest
+
+import main as optimizer
+from batch import EXIT_JOB_FAILED, EXIT_SUCCESS, JobContext, run_batch
+from client import ShardedSimulationClient
+from mock_server import MockSimulationServer
+from simulation_cache import SimulationCache
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def stopped_server(monkeypatch):
+    """
+    Address of a server that is down, with the optimizer's client pointed at it and an empty probe cache.
+    """
+    monkeypatch.chdir(ROOT)
+    server = MockSimulationServer().start()
+    server.stop()
+    monkeypatch.setattr(optimizer, "SIMULATION_CLIENT", ShardedSimulationClient(
+        [server.address], persistent=False, timeout=1.0, health_check_interval=0.0))
+    monkeypatch.setattr(optimizer, "SKILL_SIMULATION_CACHE", SimulationCache())
+    return server.address
+
+
+def test_jobs_fail_when_probes_fail(stopped_server):
+    output = io.StringIO()
+    exit_code = run_batch(io.StringIO('{"id": "first"}\n{"id": "second", "search": "beam"}\n'), output, 2)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert exit_code == EXIT_JOB_FAILED
+    assert sorted(result["id"] for result in results) == ["first", "second"]
+    assert all(result["status"] == "error" for result in results)
+    assert all(result["error"].startswith("ProbeError: ") for result in results)
+
+    server = MockSimulationServer(*stopped_server, persistent=False).start()
+    try:
+        output = io.StringIO()
+        assert run_batch(io.StringIO('{"id": "first"}\n'), output, 1) == EXIT_SUCCESS
+        assert json.loads(output.getvalue())["total_damage"] > 0
+    finally:
+        server.stop()
+
+
+def test_failed_probes_are_not_shared_by_later_jobs(stopped_server):
+    context = JobContext()
+    encounter = context.get_encounter(optimizer.DEFAULT_ENCOUNTER)
+    with pytest.raises(optimizer.ProbeError) as probe_error:
+        context.get_actor_state(encounter)
+    assert probe_error.value.failed_skills
+    assert all(
+        skill_state.skill_simulation_data.total_damage == 0
+        for skill_state
+        in probe_error.value.actor_state.skill_states.values()
+    )
+
+    server = MockSimulationServer(*stopped_server, persistent=False).start()
+    try:
+        actor_state = context.get_actor_state(encounter)
+        assert any(
+            skill_state.skill_simulation_data.total_damage > 0 for skill_state in actor_state.skill_states.values())
+    finally:
+        server.stop()
+
+
+def test_probes_without_teams_damage_every_other_actor(stopped_server):
+    context = JobContext()
+    encounter = context.get_encounter(optimizer.DEFAULT_ENCOUNTER)
+    for actor in encounter["actors"]:
+        actor.pop("team")
+    server = MockSimulationServer(*stopped_server, persistent=False).start()
+    try:
+        actor_state = context.get_actor_state(encounter)
+        assert any(
+            skill_state.skill_simulation_data.total_damage > 0 for skill_state in actor_state.skill_states.values())
+    finally:
+        server.stop()
@@ -0,0 +1,68 @@
+import pytest
+
+from actor_state import ActorState
+from branch_and_bound import get_damage_upper_bound, search_branch_and_bound
+from compact_actor_state import CompactActorState
+from skill_state import SkillSimulationData, SkillState
+from weapon_type import WeaponType
+
+MAX_TIME = 400
+DEPTH = 14
+
+
+def get_actor_state() -> ActorState:
+    """
+    A skill with two charges next to a cooldown-free filler. Once the cooldown of the charges expired they refill
+    every tick, so far more charges are cast than one cooldown per charge allows.
+    """
+    skill_states = {
+        "Charges": SkillState("Charges", WeaponType.INVALID, SkillSimulationData(1000, 0), 1000, 200, 10, 2),
+        "Filler": SkillState("Filler", WeaponType.INVALID, SkillSimulationData(100, 0), 100, 0, 100, 1),
+    }
+    return ActorState(
+        skill_states, "set_1", {skill_key: WeaponType.INVALID for skill_key in skill_states}, {"set_1": set()})
+
+
+def search_exhaustively(actor_state, time: int, depth: int, checked_bounds: list) -> int:
+    """
+    Best damage reachable from the node with the expansion of search_branch_and_bound and no pruning. Every node's
+    damage upper bound is recorded next to the damage actually reachable from it.
+    """
+    if time > MAX_TIME or depth >= DEPTH:
+        return 0
+    castable_skills = [skill_key for skill_key in actor_state.skill_states if actor_state.can_cast(skill_key)]
+    if not castable_skills:
+        if actor_state.get_time_to_next_event() is None:
+            return 0
+        next_actor_state = actor_state.clone()
+        time_delta, _ = next_actor_state.simulate(None, skip_idle=True)
+        return search_exhaustively(next_actor_state, time + time_delta, depth, checked_bounds)
+
+    best_damage = 0
+    for skill_key in castable_skills:
+        next_actor_state = actor_state.clone()
+        time_delta, _ = next_actor_state.simulate(skill_key)
+        damage = next_actor_state.skill_states[skill_key].skill_simulation_data.get_damage_until(MAX_TIME - time)
+        best_damage = max(
+            best_damage, damage + search_exhaustively(next_actor_state, time + time_delta, depth + 1, checked_bounds))
+    checked_bounds.append((get_damage_upper_bound(actor_state, MAX_TIME - time + 1, DEPTH - depth), best_damage))
+    return best_damage
+
+
+def test_upper_bound_never_underestimates_multi_ammo_skills():
+    checked_bounds = []
+    search_exhaustively(get_actor_state(), 1, 0, checked_bounds)
+    assert checked_bounds
+    for upper_bound, reachable_damage in checked_bounds:
+        assert upper_bound >= reachable_damage
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_matches_exhaustive_search(compact: bool):
+    actor_state = get_actor_state()
+    expected_damage = search_exhaustively(actor_state.clone(), 1, 0, [])
+    if compact:
+        actor_state = CompactActorState.from_actor_state(actor_state)
+    total_damage, rotation = search_branch_and_bound(actor_state, MAX_TIME, DEPTH, None)
+    assert total_damage == expected_damage
+    assert len(rotation["skill_casts"]) <= DEPTH
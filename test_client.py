@@ -0,0 +1,128 @@
+import time
+
+from client import ShardedSimulationClient, SimulationClient
+from mock_server import MockSimulationServer
+
+def get_encounter(skill_key: str) -> dict:
+    return {
+        "actors": [
+            {"name": "player", "rotation": {"skill_casts": [{"skill": skill_key, "cast_time_ms": 0}]}},
+            {"name": "target"},
+        ],
+    }
+
+
+ENCOUNTER = get_encounter("Skill")
+
+
+def get_source_skill(audit: dict) -> str:
+    return audit["tick_events"][0]["event"]["source_skill"]
+
+
+def test_batch_is_pipelined_over_one_connection_in_order():
+    with MockSimulationServer() as server:
+        client = SimulationClient(*server.address, pool_size=1)
+        skill_keys = [f"Skill {index}" for index in range(10)]
+        results = client.simulate_batch([get_encounter(skill_key) for skill_key in skill_keys])
+        assert [get_source_skill(result.audit) for result in results] == skill_keys
+        assert client.stats.connections_opened == 1
+        assert client.stats.requests == 10
+        assert client.stats.one_shot_requests == 0
+        assert client.persistent
+        client.close()
+
+
+def test_batch_is_split_over_pooled_connections_in_order():
+    with MockSimulationServer() as server:
+        client = SimulationClient(*server.address, pool_size=4)
+        skill_keys = [f"Skill {index}" for index in range(10)]
+        results = client.simulate_batch([get_encounter(skill_key) for skill_key in skill_keys])
+        assert [get_source_skill(result.audit) for result in results] == skill_keys
+        # A connection released early may be picked up by a later slice, never more than one per pooled slot
+        assert 1 <= client.stats.connections_opened <= 4
+        results = client.simulate_batch([get_encounter(skill_key) for skill_key in reversed(skill_keys)])
+        assert [get_source_skill(result.audit) for result in results] == skill_keys[::-1]
+        assert client.stats.connections_opened <= 4
+        client.close()
+
+
+def test_pooled_connection_is_reused():
+    with MockSimulationServer() as server:
+        client = SimulationClient(*server.address)
+        for skill_key in ("First", "Second", "Third"):
+            assert get_source_skill(client.simulate(get_encounter(skill_key))) == skill_key
+        assert client.stats.connections_opened == 1
+        assert client.stats.requests == 3
+        client.close()
+
+
+def test_falls_back_to_one_shot_requests_with_a_one_shot_server():
+    with MockSimulationServer(persistent=False) as server:
+        client = SimulationClient(*server.address, pool_size=1)
+        skill_keys = [f"Skill {index}" for index in range(5)]
+        results = client.simulate_batch([get_encounter(skill_key) for skill_key in skill_keys])
+        assert [get_source_skill(result.audit) for result in results] == skill_keys
+        assert not client.persistent
+        # The first request is answered on the pooled connection before the server closes it
+        assert client.stats.one_shot_requests == 4
+        assert get_source_skill(client.simulate(get_encounter("After"))) == "After"
+        assert server.requests == 6
+
+
+def get_sharded_client(servers, **kwargs) -> ShardedSimulationClient:
+    # One-shot requests, pooled connections would outlive a stopped server
+    return ShardedSimulationClient([server.address for server in servers], persistent=False, **kwargs)
+
+
+def test_batch_spreads_over_least_outstanding_endpoints():
+    servers = [MockSimulationServer(persistent=False, latency=0.05).start() for _ in range(3)]
+    try:
+        client = get_sharded_client(servers, pool_size=2)
+        results = client.simulate_batch([ENCOUNTER] * 24)
+        assert len(results) == 24
+        assert all(result.audit["tick_events"] for result in results)
+        # 6 chunks of 4 requests start together, each on the endpoint with the least outstanding requests
+        assert [server.requests for server in servers] == [8, 8, 8]
+        assert all(endpoint_stats.outstanding == 0 for endpoint_stats in client.endpoint_stats)
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def test_retries_on_another_endpoint_after_a_server_stops():
+    servers = [MockSimulationServer(persistent=False).start() for _ in range(2)]
+    try:
+        client = get_sharded_client(servers, timeout=1.0, health_check_interval=60.0)
+        servers[0].stop()
+        for _ in range(4):
+            assert client.simulate(ENCOUNTER)["tick_events"]
+        assert servers[1].requests == 4
+        assert not client.endpoint_stats[0].healthy
+        assert client.endpoint_stats[0].failures == 1
+        assert client.endpoint_stats[0].retries == 1
+        assert client.endpoint_stats[1].healthy
+    finally:
+        servers[1].stop()
+
+
+def test_unhealthy_endpoint_recovers_after_health_check_interval():
+    servers = [MockSimulationServer(persistent=False).start() for _ in range(2)]
+    try:
+        client = get_sharded_client(servers, timeout=1.0, health_check_interval=0.2)
+        host, port = servers[0].address
+        servers[0].stop()
+        client.simulate(ENCOUNTER)
+        assert not client.endpoint_stats[0].healthy
+
+        # Skipped until the interval has passed, even once the server is back
+        servers[0] = MockSimulationServer(host, port, persistent=False).start()
+        client.simulate(ENCOUNTER)
+        assert servers[0].requests == 0
+
+        time.sleep(0.2)
+        client.simulate(ENCOUNTER)
+        assert servers[0].requests == 1
+        assert client.endpoint_stats[0].healthy
+    finally:
+        for server in servers:
+            server.stop()
@@ -0,0 +1,67 @@
+import json
+import os
+import random
+
+import pytest
+
+from actor_state import ActorState
+from build import get_castable_skills, get_skill_to_weapon_type_dict, get_weapon_set_to_weapon_types_dict
+from compact_actor_state import CompactActorState
+from skill_state import SkillSimulationData, SkillState
+from weapon_type import WeaponType
+
+BUILD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "build-lb-slb.json")
+SEEDS = 200
+STEPS = 300
+
+
+def get_actor_state(build_path: str) -> ActorState:
+    """
+    Actor state of a build with synthetic skill simulation data, the dynamic state doesn't depend on it.
+    """
+    build = json.load(open(build_path))
+    initial_weapon_set = build.get("initial_weapon_set", "set_1")
+    weapon_set_to_weapon_types_dict = get_weapon_set_to_weapon_types_dict(build)
+    weapon_set_to_weapon_types_dict.setdefault(initial_weapon_set, set())
+    skill_states = {
+        skill["skill_key"]: SkillState(
+            skill["skill_key"],
+            WeaponType(skill.get("weapon_type", "invalid")),
+            SkillSimulationData(1000, 0),
+            1000,
+            skill.get("cooldown", (0, 0))[1],
+            skill["cast_duration"][1],
+            skill.get("ammo", 1))
+        for skill
+        in get_castable_skills(build)
+    }
+    return ActorState(
+        skill_states, initial_weapon_set, get_skill_to_weapon_type_dict(build), weapon_set_to_weapon_types_dict)
+
+
+@pytest.mark.parametrize("seed", range(SEEDS))
+def test_compact_actor_state_matches_actor_state(seed):
+    actor_state = get_actor_state(BUILD)
+    compact_actor_state = CompactActorState.from_actor_state(actor_state)
+    skill_keys = sorted(actor_state.skill_states.keys())
+    rng = random.Random(seed)
+    for step in range(STEPS):
+        next_skill = None if rng.random() < 0.2 else rng.choice(skill_keys)
+        skip_idle = rng.random() < 0.5
+        if next_skill is not None:
+            assert actor_state.can_cast(next_skill) == compact_actor_state.can_cast(next_skill), step
+        assert actor_state.simulate(next_skill, skip_idle) == compact_actor_state.simulate(next_skill, skip_idle), step
+        assert actor_state.get_state_key() == compact_actor_state.get_state_key(), step
+        assert actor_state.get_time_to_next_event() == compact_actor_state.get_time_to_next_event(), step
+        assert actor_state.current_weapon_set == compact_actor_state.current_weapon_set, step
+
+
+def test_clones_are_independent():
+    actor_state = get_actor_state(BUILD)
+    compact_actor_state = CompactActorState.from_actor_state(actor_state)
+    state_key = compact_actor_state.get_state_key()
+    clone = compact_actor_state.clone()
+    for skill_key in actor_state.skill_states:
+        clone.simulate(skill_key)
+    assert clone.get_state_key() != state_key
+    assert compact_actor_state.get_state_key() == state_key
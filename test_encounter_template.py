@@ -0,0 +1,131 @@
+import copy
+import json
+import os
+
+import pytest
+
+from encounter_template import ACTOR_ENCOUNTER_ACTOR_NAME, EncounterTemplate, get_actor_encounter, get_enemy_names
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+ROTATION = {"skill_casts": [{"skill": "Rapid Fire", "cast_time_ms": 0}, {"skill": "Barrage", "cast_time_ms": 0}]}
+TERMINATION_CONDITIONS = [{"type": "TIME", "actor": "lb-slb", "time": 30000}]
+
+
+def get_encounter(audit_configuration: bool = True):
+    encounter = json.load(open(os.path.join(RESOURCES, "encounter.json")))
+    for actor in encounter["actors"]:
+        actor["build"] = json.load(open(os.path.join(RESOURCES, os.path.basename(actor["build_path"]))))
+    encounter["actors"][0]["build"]["initial_weapon_set"] = "set_1"
+    encounter["actors"][0]["rotation"] = {"skill_casts": [{"skill": "Long Range Shot", "cast_time_ms": 0}]}
+    if not audit_configuration:
+        encounter.pop("audit_configuration", None)
+    return encounter
+
+
+def get_expected(encounter, rotation=None, initial_weapon_set=None, termination_conditions=(), audits=None):
+    expected = copy.deepcopy(encounter)
+    if rotation is not None:
+        expected["actors"][0]["rotation"] = rotation
+    if initial_weapon_set is not None:
+        expected["actors"][0]["build"]["initial_weapon_set"] = initial_weapon_set
+    expected["termination_conditions"] = expected.get("termination_conditions", []) + list(termination_conditions)
+    if audits is not None:
+        expected.setdefault("audit_configuration", {})["audits_to_perform"] = audits
+    return expected
+
+
+@pytest.mark.parametrize("audit_configuration", [True, False])
+@pytest.mark.parametrize("overrides", [
+    {},
+    {"rotation": ROTATION},
+    {"initial_weapon_set": "set_2"},
+    {"termination_conditions": TERMINATION_CONDITIONS},
+    {"audits": ["DAMAGE"]},
+    {"rotation": ROTATION, "initial_weapon_set": "set_2", "termination_conditions": TERMINATION_CONDITIONS,
+     "audits": ["DAMAGE"]},
+])
+def test_render_matches_the_modified_encounter(audit_configuration, overrides):
+    encounter = get_encounter(audit_configuration)
+    original = copy.deepcopy(encounter)
+    request = EncounterTemplate(encounter).render(**overrides)
+    assert request.endswith(b"\n")
+    assert json.loads(request) == get_expected(encounter, **overrides)
+    # Rendering never modifies the encounter
+    assert encounter == original
+
+
+def test_equivalent_overrides_have_the_same_hash():
+    encounter = get_encounter()
+    template = EncounterTemplate(encounter)
+    assert template.get_hash() == template.get_hash(rotation=copy.deepcopy(encounter["actors"][0]["rotation"]))
+    assert template.get_hash() == template.get_hash(initial_weapon_set="set_1")
+    assert template.get_hash() == template.get_hash(audits=list(encounter["audit_configuration"]["audits_to_perform"]))
+    assert template.get_hash(rotation=ROTATION, termination_conditions=TERMINATION_CONDITIONS) == template.get_hash(
+        rotation=copy.deepcopy(ROTATION), termination_conditions=copy.deepcopy(TERMINATION_CONDITIONS))
+    # Same content, another template and key order
+    reordered_encounter = {key: encounter[key] for key in reversed(list(encounter.keys()))}
+    assert EncounterTemplate(reordered_encounter).get_hash(rotation=ROTATION) == template.get_hash(rotation=ROTATION)
+
+
+def test_different_requests_have_different_hashes():
+    template = EncounterTemplate(get_encounter())
+    hashes = [
+        template.get_hash(),
+        template.get_hash(rotation=ROTATION),
+        template.get_hash(initial_weapon_set="set_2"),
+        template.get_hash(termination_conditions=TERMINATION_CONDITIONS),
+        template.get_hash(audits=["DAMAGE"]),
+        template.get_hash(server_version="1.0"),
+    ]
+    assert len(set(hashes)) == len(hashes)
+
+
+def rename_actor(encounter, name: str):
+    renamed_encounter = copy.deepcopy(encounter)
+    for termination_condition in renamed_encounter["termination_conditions"]:
+        if termination_condition["actor"] == encounter["actors"][0]["name"]:
+            termination_condition["actor"] = name
+    renamed_encounter["actors"][0]["name"] = name
+    return renamed_encounter
+
+
+def test_actor_encounters_of_the_same_build_have_the_same_hash():
+    encounter = get_encounter()
+    encounter["termination_conditions"].append(TERMINATION_CONDITIONS[0])
+    probe_overrides = {
+        "rotation": ROTATION,
+        "termination_conditions": [{"type": "TIME", "actor": ACTOR_ENCOUNTER_ACTOR_NAME, "time": 30000}],
+    }
+    hashes = {
+        EncounterTemplate(get_actor_encounter(rename_actor(encounter, name))).get_hash(**probe_overrides)
+        for name in ("lb-slb", "other-lb-slb", ACTOR_ENCOUNTER_ACTOR_NAME)
+    }
+    assert len(hashes) == 1
+
+    actor_encounter = get_actor_encounter(rename_actor(encounter, "other-lb-slb"))
+    assert [actor["name"] for actor in actor_encounter["actors"]] == [ACTOR_ENCOUNTER_ACTOR_NAME, "golem"]
+    assert actor_encounter["termination_conditions"][-1]["actor"] == ACTOR_ENCOUNTER_ACTOR_NAME
+    # Only the copies are renamed
+    assert encounter["actors"][0]["name"] == "lb-slb"
+    assert encounter["termination_conditions"][-1]["actor"] == "lb-slb"
+
+
+def test_actor_is_not_renamed_to_the_name_of_an_enemy():
+    encounter = get_encounter()
+    encounter["actors"][1]["name"] = ACTOR_ENCOUNTER_ACTOR_NAME
+    actor_encounter = get_actor_encounter(encounter)
+    assert [actor["name"] for actor in actor_encounter["actors"]] == ["lb-slb", ACTOR_ENCOUNTER_ACTOR_NAME]
+
+
+def test_everyone_else_is_an_enemy_without_teams():
+    encounter = get_encounter()
+    encounter["actors"].append({**encounter["actors"][0], "name": "ally"})
+    assert get_enemy_names(encounter, "lb-slb") == ["golem"]
+    assert [actor["name"] for actor in get_actor_encounter(encounter)["actors"]] == [
+        ACTOR_ENCOUNTER_ACTOR_NAME, "golem"]
+
+    for actor in encounter["actors"]:
+        actor.pop("team")
+    assert get_enemy_names(encounter, "lb-slb") == ["golem", "ally"]
+    assert [actor["name"] for actor in get_actor_encounter(encounter)["actors"]] == [
+        ACTOR_ENCOUNTER_ACTOR_NAME, "golem", "ally"]
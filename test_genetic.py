@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from actor_state import ActorState
+from genetic import get_checkpoint_fingerprint, get_checkpoint_path, search_genetic
+from skill_state import SkillSimulationData, SkillState
+from weapon_type import WeaponType
+
+MAX_TIME = 2000
+GENERATIONS = 5
+POPULATION_SIZE = 16
+
+
+def get_actor_state() -> ActorState:
+    skill_states = {
+        "Burst": SkillState("Burst", WeaponType.INVALID, SkillSimulationData(1000, 0), 1000, 500, 50, 1),
+        "Filler": SkillState("Filler", WeaponType.INVALID, SkillSimulationData(100, 0), 100, 0, 100, 1),
+    }
+    return ActorState(
+        skill_states, "set_1", {skill_key: WeaponType.INVALID for skill_key in skill_states}, {"set_1": set()})
+
+
+def run_search(checkpoint_directory: str, seed: int):
+    return search_genetic(
+        get_actor_state(), MAX_TIME, None, GENERATIONS, POPULATION_SIZE, 1, checkpoint_directory, seed)
+
+
+def test_concurrent_searches_keep_their_own_checkpoints(tmp_path):
+    checkpoint_directory = str(tmp_path / "checkpoints")
+    seeds = [0, 0, 1, 1, 2, 2]
+    expected = [run_search(None, seed) for seed in seeds]
+    with ThreadPoolExecutor(max_workers=len(seeds)) as executor:
+        results = list(executor.map(lambda seed: run_search(checkpoint_directory, seed), seeds))
+    assert results == expected
+
+    # One checkpoint per distinct search and no leftover temporary files
+    assert sorted(os.listdir(checkpoint_directory)) == sorted(
+        os.path.basename(get_checkpoint_path(
+            checkpoint_directory, get_checkpoint_fingerprint(get_actor_state(), MAX_TIME, None, POPULATION_SIZE, seed)))
+        for seed in set(seeds))
+
+
+def test_search_resumes_from_its_checkpoint(tmp_path):
+    checkpoint_directory = str(tmp_path)
+    uninterrupted = run_search(None, 0)
+    search_genetic(get_actor_state(), MAX_TIME, None, 2, POPULATION_SIZE, 1, checkpoint_directory, 0)
+    assert run_search(checkpoint_directory, 0) == uninterrupted
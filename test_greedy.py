@@ -0,0 +1,45 @@
+from array import array
+
+import pytest
+
+from actor_state import ActorState
+from compact_actor_state import CompactActorState
+from greedy import search_greedy
+from search_stats import SearchStats
+from skill_state import SkillSimulationData, SkillState
+from weapon_type import WeaponType
+
+
+def get_actor_state() -> ActorState:
+    """
+    Skills that are all on cooldown most of the time, so the search spends most of the fight waiting. One of them deals
+    its damage over time, so the fight end truncates it.
+    """
+    skill_states = {
+        "Burst": SkillState("Burst", WeaponType.INVALID, SkillSimulationData(5000, 0), 5000, 1000, 100, 1),
+        "Strike": SkillState("Strike", WeaponType.INVALID, SkillSimulationData(2000, 0), 2000, 700, 50, 1),
+        "Charges": SkillState("Charges", WeaponType.INVALID, SkillSimulationData(800, 0), 800, 450, 20, 3),
+        "Bleed": SkillState(
+            "Bleed", WeaponType.INVALID,
+            SkillSimulationData(3000, 2000, array("q", [500, 1000, 2000]), array("q", [1000, 2000, 3000])),
+            3000, 1300, 30, 1),
+    }
+    return ActorState(
+        skill_states, "set_1", {skill_key: WeaponType.INVALID for skill_key in skill_states}, {"set_1": set()})
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("max_time", [1000, 5000, 30000])
+def test_skipping_idle_time_gives_the_same_rotation(compact: bool, max_time: int):
+    results = {}
+    idle_steps = {}
+    for skip_idle in (False, True):
+        actor_state = get_actor_state()
+        if compact:
+            actor_state = CompactActorState.from_actor_state(actor_state)
+        stats = SearchStats()
+        results[skip_idle] = search_greedy(actor_state, max_time, None, stats, skip_idle)
+        idle_steps[skip_idle] = stats.idle_steps
+    assert results[True] == results[False]
+    assert results[True][0] > 0
+    assert idle_steps[True] < idle_steps[False]
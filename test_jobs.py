@@ -0,0 +1,35 @@
+import asyncio
+
+from jobs import JobRunner
+
+
+def fail():
+    raise ValueError("no server")
+
+
+def test_failed_job_is_reported():
+    async def run():
+        job_runner = JobRunner(1)
+        job = job_runner.start("fail", fail, lambda result: None)
+        await job_runner.wait(job.id)
+        await job_runner.close()
+        return job
+
+    job = asyncio.run(run())
+    assert job.status == "failed"
+    assert isinstance(job.error, ValueError)
+
+
+def test_failed_foreground_job_is_reported(capsys):
+    job_runner = JobRunner(1)
+    job_runner.background = False
+    results = []
+    job = job_runner.start("fail", fail, results.append)
+    assert job.status == "failed"
+    assert isinstance(job.error, ValueError)
+    assert job.end_time > 0.0
+    assert "Error: job 1 (fail) failed: no server" in capsys.readouterr().out
+
+    job = job_runner.start("succeed", lambda: 1, results.append)
+    assert job.status == "done"
+    assert results == [1]
@@ -0,0 +1,29 @@
+import os
+import threading
+
+from simulation_cache import SimulationCache
+
+
+def test_concurrent_saves(tmp_path):
+    path = os.path.join(tmp_path, "cache.json")
+    cache = SimulationCache(path)
+    errors = []
+
+    def put_and_save(thread_index: int):
+        try:
+            for index in range(50):
+                cache.put(f"{thread_index}-{index}", index)
+                cache.save()
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put_and_save, args=(thread_index,)) for thread_index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    reloaded_cache = SimulationCache(path)
+    assert len(reloaded_cache) == 200
+    assert reloaded_cache.get("3-49") == 49
@@ -0,0 +1,24 @@
+from actor_state import ActorState
+from rotation_trie import RotationTrie
+from skill_state import SkillSimulationData, SkillState
+from verification import prepend_rotation_prefix
+from weapon_type import WeaponType
+
+
+def test_candidates_continue_the_prefix():
+    skill_states = {
+        "Opener": SkillState("Opener", WeaponType.INVALID, SkillSimulationData(500, 0), 500, 1000, 300, 1),
+        "Filler": SkillState("Filler", WeaponType.INVALID, SkillSimulationData(100, 0), 100, 0, 200, 1),
+    }
+    actor_state = ActorState(
+        skill_states, "set_1", {skill_key: WeaponType.INVALID for skill_key in skill_states}, {"set_1": set()})
+    # The second opener is blocked by its cooldown and dropped
+    prefix = RotationTrie(actor_state).evaluate(["Opener", "Opener", "Filler"])
+    candidate = {"skill_casts": [{"skill": "Filler", "cast_time_ms": 1}, {"skill": "Filler", "cast_time_ms": 201}]}
+
+    assert prepend_rotation_prefix(prefix, [(200, candidate)]) == [(800, {"skill_casts": [
+        {"skill": "Opener", "cast_time_ms": 1},
+        {"skill": "Filler", "cast_time_ms": 301},
+        {"skill": "Filler", "cast_time_ms": 501},
+        {"skill": "Filler", "cast_time_ms": 701},
+    ]})]
@@ -0,0 +1,66 @@
+import collections
+import dataclasses
+from typing import Hashable, Tuple
+
+from actor_state import ActorState
+
+
+@dataclasses.dataclass
+class TranspositionStats:
+    lookups: int = 0
+    hits: int = 0
+    prunes: int = 0
+    replacements: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups > 0 else 0.0
+
+
+class TranspositionTable(object):
+    """
+    Bounded map from a search state (actor state and time) to the best (total damage, number of casts) that reached it.
+
+    A state reached again with no more damage and no fewer casts can't lead to a better rotation, so its subtree can
+    be pruned. An entry is replaced by any visit it doesn't dominate, and the least recently used entry is
+    evicted when the table is full. With a time_quantum above 1 ms nearby states share an entry, which prunes more at
+    the cost of exactness.
+    """
+
+    def __init__(self, max_entries: int = 1 << 20, time_quantum: int = 1):
+        self.max_entries = max_entries
+        self.time_quantum = max(1, time_quantum)
+        self.stats = TranspositionStats()
+        self._entries: "collections.OrderedDict[Hashable, Tuple[int, int]]" = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_key(self, actor_state: ActorState, time: int) -> Hashable:
+        return time // self.time_quantum, actor_state.get_state_key(self.time_quantum)
+
+    def is_transposition(self, actor_state: ActorState, time: int, total_damage: int, num_casts: int) -> bool:
+        """
+        Records the visit and returns True if the same state was already reached with at least as much damage in at
+        most as many casts.
+        """
+        key = self.get_key(actor_state, time)
+        self.stats.lookups += 1
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.stats.hits += 1
+            self._entries.move_to_end(key)
+            best_damage, best_num_casts = entry
+            if best_damage >= total_damage and best_num_casts <= num_casts:
+                self.stats.prunes += 1
+                return True
+            self.stats.replacements += 1
+            self._entries[key] = (total_damage, num_casts)
+            return False
+
+        self._entries[key] = (total_damage, num_casts)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+        return False
@@ -0,0 +1,183 @@
+import dataclasses
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from audit_parser import summarize_audit
+from client import AnySimulationClient
+from encounter_template import EncounterTemplate
+from instrumentation import timed
+from rotation_trie import RotationTrieNode
+from simulation_cache import SimulationCache
+
+
+def get_rotation_key(rotation: List[Dict]) -> Tuple:
+    return tuple((skill_cast["skill"], skill_cast["cast_time_ms"]) for skill_cast in rotation)
+
+
+class TopRotations(object):
+    """
+    Keeps the k distinct rotations with the highest static damage offered by a search.
+    """
+
+    def __init__(self, k: int = 32):
+        self.k = k
+        self._heap: List[Tuple[int, int, List[Dict]]] = []
+        self._keys = set()
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def offer(self, total_damage: int, rotation: List[Dict]):
+        if not rotation or (len(self._heap) >= self.k and total_damage <= self._heap[0][0]):
+            return
+        key = get_rotation_key(rotation)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        # The counter breaks damage ties without comparing rotations, earlier offers win
+        self._counter += 1
+        entry = (total_damage, -self._counter, rotation)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        else:
+            _, _, evicted_rotation = heapq.heappushpop(self._heap, entry)
+            self._keys.discard(get_rotation_key(evicted_rotation))
+
+    def get_rotations(self) -> List[Tuple[int, Dict]]:
+        return [
+            (total_damage, {"skill_casts": rotation})
+            for total_damage, _, rotation
+            in sorted(self._heap, reverse=True)
+        ]
+
+
+@dataclasses.dataclass
+class VerifiedRotation:
+    static_damage: int
+    audited_damage: int
+    rotation: Dict
+    cached: bool
+
+
+def verify_rotations(encounter: Dict,
+                     rotations: List[Tuple[int, Dict]],
+                     client: AnySimulationClient,
+                     cache: SimulationCache,
+                     max_time: int,
+                     audits: List[str],
+                     server_version: Optional[str] = None) -> List[VerifiedRotation]:
+    """
+    Simulates every (static damage, rotation) candidate on the server as a single batch and re-ranks them by the
+    audited damage dealt by the first actor. Audited damage is cached by the hash of the verification encounter, which
+    covers the build, the rotation and the termination conditions. The encounter is serialized once and every rotation
+    is spliced into it.
+    """
+    actor_name = encounter["actors"][0]["name"]
+    encounter_template = EncounterTemplate(encounter)
+    termination_conditions = [{"type": "TIME", "time": max_time}]
+    verified_rotations: List[Optional[VerifiedRotation]] = [None] * len(rotations)
+    pending: List[Tuple[int, str, bytes]] = []
+    for index, (static_damage, rotation) in enumerate(rotations):
+        cache_key = encounter_template.get_hash(
+            rotation, termination_conditions=termination_conditions, audits=audits, server_version=server_version)
+        audited_damage = cache.get(cache_key)
+        if audited_damage is not None:
+            verified_rotations[index] = VerifiedRotation(static_damage, audited_damage, rotation, True)
+        else:
+            with timed("verification.render"):
+                request = encounter_template.render(
+                    rotation, termination_conditions=termination_conditions, audits=audits)
+            pending.append((index, cache_key, request))
+
+    results = client.simulate_batch([request for _, _, request in pending])
+    for (index, cache_key, _), result in zip(pending, results):
+        damage_summary = summarize_audit(result.audit)
+        audited_damage = sum(
+            damage
+            for (_, source_actor, _), damage
+            in damage_summary.damage_by_source.items()
+            if source_actor == actor_name
+        )
+        cache.put(cache_key, audited_damage)
+        static_damage, rotation = rotations[index]
+        verified_rotations[index] = VerifiedRotation(static_damage, audited_damage, rotation, False)
+    cache.save()
+
+    return sorted(verified_rotations, key=lambda verified_rotation: verified_rotation.audited_damage, reverse=True)
+
+
+@dataclasses.dataclass
+class VerifiedJointRotation:
+    # Static and audited damage by actor name
+    static_damage: Dict[str, int]
+    audited_damage: Dict[str, int]
+    rotations: Dict[str, Dict]
+    cached: bool
+
+
+def verify_joint_rotation(encounter: Dict,
+                          rotations: Dict[str, Tuple[int, Dict]],
+                          client: AnySimulationClient,
+                          cache: SimulationCache,
+                          max_time: int,
+                          audits: List[str],
+                          server_version: Optional[str] = None) -> VerifiedJointRotation:
+    """
+    Simulates the (static damage, rotation) of every actor in `rotations` together in a single encounter on the
+    server, the other actors keep their rotations, and audits the damage dealt by each of them. Static damage comes
+    from searches that simulate every actor alone, the audited damage also accounts for the interactions between the
+    actors. Audited damage is cached by the hash of the verification encounter.
+    """
+    joint_encounter = {
+        **encounter,
+        "actors": [
+            {**actor, "rotation": rotations[actor["name"]][1]} if actor["name"] in rotations else actor
+            for actor
+            in encounter["actors"]
+        ],
+    }
+    encounter_template = EncounterTemplate(joint_encounter)
+    termination_conditions = [{"type": "TIME", "time": max_time}]
+    static_damage = {actor_name: damage for actor_name, (damage, _) in rotations.items()}
+    joint_rotations = {actor_name: rotation for actor_name, (_, rotation) in rotations.items()}
+    cache_key = encounter_template.get_hash(
+        termination_conditions=termination_conditions, audits=audits, server_version=server_version)
+    audited_damage = cache.get(cache_key)
+    if audited_damage is not None:
+        return VerifiedJointRotation(static_damage, audited_damage, joint_rotations, True)
+
+    with timed("verification.render"):
+        request = encounter_template.render(termination_conditions=termination_conditions, audits=audits)
+    damage_summary = summarize_audit(client.simulate_batch([request])[0].audit)
+    audited_damage = {actor_name: 0 for actor_name in rotations}
+    for (_, source_actor, _), damage in damage_summary.damage_by_source.items():
+        if source_actor in audited_damage:
+            audited_damage[source_actor] += damage
+    cache.put(cache_key, audited_damage)
+    cache.save()
+    return VerifiedJointRotation(static_damage, audited_damage, joint_rotations, False)
+
+
+def prepend_rotation_prefix(prefix: RotationTrieNode, rotations: List[Tuple[int, Dict]]) -> List[Tuple[int, Dict]]:
+    """
+    Turns (static damage, rotation) candidates of a search that started after the rotation of `prefix` into full
+    rotations from the start of the fight, which is what verification simulates. Searches count time from 1, so the
+    candidates' cast times are shifted to the end of the prefix and its static damage is added.
+    """
+    prefix_skill_casts = prefix.get_rotation()["skill_casts"]
+    time_offset = prefix.time - 1
+    return [
+        (
+            prefix.static_damage + static_damage,
+            {
+                "skill_casts": prefix_skill_casts + [
+                    {**skill_cast, "cast_time_ms": skill_cast["cast_time_ms"] + time_offset}
+                    for skill_cast
+                    in rotation["skill_casts"]
+                ],
+            },
+        )
+        for static_damage, rotation
+        in rotations
+    ]